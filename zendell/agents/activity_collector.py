@@ -3,9 +3,12 @@
 import json
 import re
 from datetime import datetime
-from core.utils import get_timestamp
 from zendell.services.llm_provider import ask_gpt
+from zendell.services.structured_output import ask_json
 from bson.objectid import ObjectId
+from zendell.core.log import get_logger
+
+logger = get_logger(__name__)
 
 def activity_collector_node(global_state: dict) -> dict:
     """
@@ -21,21 +24,21 @@ def activity_collector_node(global_state: dict) -> dict:
     last_msg = global_state.get("last_message", "")
     db = global_state["db"]
     
-    print(f"{get_timestamp()}",f"[COLLECTOR] Procesando mensaje de usuario: '{last_msg[:50]}...'")
+    logger.debug("Procesando mensaje de usuario: '%.50s...'", last_msg)
     
     if not last_msg:
-        print(f"{get_timestamp()}","[COLLECTOR] Mensaje vacío, no hay nada que procesar")
+        logger.debug("Mensaje vacío, no hay nada que procesar")
         return global_state
     
     try:
         # Obtener el estado actual del usuario como diccionario
         st = db.get_state(user_id)
-        print(f"{get_timestamp()}",f"[COLLECTOR] Estado del usuario cargado: {st.keys()}")
+        logger.debug("Estado del usuario cargado: %s", st.keys())
         
         # Si estamos en etapas iniciales, extraer información para el perfil
         current_stage = st.get("conversation_stage", "initial")
         if current_stage in ["initial", "ask_profile"]:
-            print(f"{get_timestamp()}",f"[COLLECTOR] Etapa {current_stage}: extrayendo información de perfil")
+            logger.debug("Etapa %s: extrayendo información de perfil", current_stage)
             
             # Extraer y actualizar la información del perfil
             extracted_info = db.extract_and_update_user_info(user_id, last_msg)
@@ -47,17 +50,17 @@ def activity_collector_node(global_state: dict) -> dict:
             return global_state
         
         # Guardar mensaje en contexto de corto plazo
-        print(f"{get_timestamp()}","[COLLECTOR] Guardando mensaje en contexto a corto plazo")
+        logger.debug("Guardando mensaje en contexto a corto plazo")
         db.add_to_short_term_info(user_id, f"[User] {last_msg}")
         
         # Solo recolectar actividades durante etapas específicas
         if current_stage not in ["ask_last_hour", "ask_next_hour"]:
-            print(f"{get_timestamp()}",f"[COLLECTOR] Etapa {current_stage}: no se recolectan actividades")
+            logger.debug("Etapa %s: no se recolectan actividades", current_stage)
             return global_state
         
         # Determinar el contexto temporal (pasado o futuro)
         time_context = "future" if current_stage == "ask_next_hour" else "past"
-        print(f"{get_timestamp()}",f"[COLLECTOR] Recolectando actividades con contexto: {time_context}")
+        logger.debug("Recolectando actividades con contexto: %s", time_context)
         
         # Clasificar la categoría de la actividad
         category = classify_activity(last_msg)
@@ -67,7 +70,7 @@ def activity_collector_node(global_state: dict) -> dict:
         
         # Si no se detectaron subactividades, crear una por defecto
         if not sub_activities:
-            print(f"{get_timestamp()}","[COLLECTOR] No se detectaron subactividades, creando una por defecto")
+            logger.debug("No se detectaron subactividades, creando una por defecto")
             filtered_msg = re.split(r'\?', last_msg)[-1].strip() or last_msg
             default_title = " ".join(filtered_msg.split()[:5]) if filtered_msg.split() else "Actividad"
             default_activity = {
@@ -107,15 +110,15 @@ def activity_collector_node(global_state: dict) -> dict:
             activity_data["analysis"] = analyze_activity(activity_data["title"], last_msg, time_context)
             
             # Guardar la actividad en la base de datos
-            print(f"{get_timestamp()}",f"[COLLECTOR] Guardando actividad: {activity_data['title']}")
+            logger.debug("Guardando actividad: %s", activity_data['title'])
             db.add_activity(user_id, activity_data)
             
-            # Guardar mensaje de sistema sobre la actividad detectada
-            db.save_conversation_message(
+            # Guardar traza interna sobre la actividad detectada
+            db.save_agent_trace(
                 user_id,
-                "system", 
+                "activity_collector",
                 f"Actividad detectada: {activity_data['title']} (Categoría: {activity_data['category']})",
-                {"step": "activity_collector"}
+                {"activity_id": activity_id}
             )
             
             # Añadir la actividad procesada a la lista
@@ -123,7 +126,7 @@ def activity_collector_node(global_state: dict) -> dict:
         
         # Generar razonamiento sobre todas las actividades detectadas
         if new_activities:
-            print(f"{get_timestamp()}",f"[COLLECTOR] Generando razonamiento para {len(new_activities)} actividades")
+            logger.debug("Generando razonamiento para %s actividades", len(new_activities))
             reasoning_prompt = (
                 f"El mensaje '{last_msg}' generó las siguientes actividades: "
                 f"{[act['title'] for act in new_activities]}. "
@@ -151,27 +154,25 @@ def activity_collector_node(global_state: dict) -> dict:
                 st.setdefault("activities_next_hour", []).append(interaction_entry)
             
             # Guardar el estado actualizado
-            print(f"{get_timestamp()}","[COLLECTOR] Guardando estado actualizado con nuevas actividades")
+            logger.debug("Guardando estado actualizado con nuevas actividades")
             db.save_state(user_id, st)
             
             # Actualizar el estado global para el orquestador
             global_state["activities"].extend(new_activities)
             global_state["activity_reasoning"] = reasoning
         else:
-            print(f"{get_timestamp()}","[COLLECTOR] No se generaron actividades nuevas")
+            logger.debug("No se generaron actividades nuevas")
         
         return global_state
         
     except Exception as e:
-        print(f"{get_timestamp()}",f"[COLLECTOR] Error en activity_collector_node: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error en activity_collector_node: %s", e)
         # Continuamos con el flujo a pesar del error
         return global_state
 
 def classify_activity(msg: str) -> str:
     """Clasifica el tipo de actividad basado en el mensaje del usuario."""
-    print(f"{get_timestamp()}",f"[COLLECTOR] Clasificando actividad del mensaje: '{msg[:50]}...'")
+    logger.debug("Clasificando actividad del mensaje: '%.50s...'", msg)
     
     prompt = (
         f"Analiza el siguiente mensaje: '{msg}'. Determina la categoría más adecuada para la actividad descrita. "
@@ -180,41 +181,18 @@ def classify_activity(msg: str) -> str:
         "Devuelve únicamente un JSON válido con este formato: {\"category\": \"Categoría elegida\"}"
     )
     
-    response = ask_gpt(prompt)
-    print(f"{get_timestamp()}",f"[COLLECTOR] Respuesta de clasificación: '{response[:100]}...'")
-    
-    try:
-        import json
-        import re
-        
-        # Buscar patrón JSON en la respuesta
-        json_pattern = r'(\{.*\})'
-        matches = re.search(json_pattern, response, re.DOTALL)
-        
-        if matches:
-            json_str = matches.group(1)
-            data = json.loads(json_str)
-        else:
-            # Intentar limpiar y parsear
-            cleaned_response = re.sub(r'^[^{]*', '', response)
-            cleaned_response = re.sub(r'[^}]*$', '', cleaned_response)
-            
-            if cleaned_response:
-                data = json.loads(cleaned_response)
-            else:
-                print(f"{get_timestamp()}","[COLLECTOR] No se pudo extraer JSON de la clasificación, usando categoría por defecto")
-                return "Otra"
-        
-        category = data.get("category", "Otra")
-        print(f"{get_timestamp()}",f"[COLLECTOR] Categoría detectada: {category}")
-        return category.strip()
-    except Exception as e:
-        print(f"{get_timestamp()}",f"[COLLECTOR] Error al procesar la categoría: {e}")
+    data = ask_json(prompt)
+    if data is None:
+        logger.warning("No se pudo obtener la clasificación, usando categoría por defecto")
         return "Otra"
+    
+    category = data["category"].strip() or "Otra"
+    logger.debug("Categoría detectada: %s", category)
+    return category
 
 def extract_sub_activities(msg: str, time_context: str) -> list:
     """Extrae diferentes actividades de un mensaje del usuario."""
-    print(f"{get_timestamp()}",f"[COLLECTOR] Extrayendo subactividades del mensaje: '{msg[:50]}...'")
+    logger.debug("Extrayendo subactividades del mensaje: '%.50s...'", msg)
     
     prompt = (
         f"Analiza el siguiente mensaje: '{msg}'. Extrae todas las actividades distintas que se describen en el mensaje. "
@@ -230,56 +208,32 @@ def extract_sub_activities(msg: str, time_context: str) -> list:
         ']}'
     )
     
-    response = ask_gpt(prompt)
-    print(f"{get_timestamp()}",f"[COLLECTOR] Respuesta de extracción de subactividades: '{response[:100]}...'")
+    data = ask_json(prompt)
+    if data is None:
+        logger.warning("No se pudieron extraer subactividades, devolviendo lista vacía")
+        return []
     
-    try:
-        import json
-        import re
+    activities = data["activities"]
+    logger.debug("Se detectaron %s subactividades", len(activities))
+    
+    # Completar los campos opcionales de cada actividad
+    for activity in activities:
+        if not activity.get("title"):
+            activity["title"] = "Actividad sin título"
         
-        # Limpiar la respuesta y buscar patrón JSON
-        cleaned_response = re.sub(r'```json|```', '', response).strip()
-        json_pattern = r'(\{.*\})'
-        matches = re.search(json_pattern, cleaned_response, re.DOTALL)
+        if not activity.get("category"):
+            activity["category"] = "Otra"
         
-        if matches:
-            json_str = matches.group(1)
-            data = json.loads(json_str)
-        else:
-            # Intentar limpiar y parsear
-            cleaned_response = re.sub(r'^[^{]*', '', cleaned_response)
-            cleaned_response = re.sub(r'[^}]*$', '', cleaned_response)
-            
-            if cleaned_response:
-                data = json.loads(cleaned_response)
-            else:
-                print(f"{get_timestamp()}","[COLLECTOR] No se pudo extraer JSON de subactividades, devolviendo lista vacía")
-                return []
+        if not isinstance(activity.get("importance"), int):
+            activity["importance"] = 5
         
-        activities = data.get("activities", [])
-        print(f"{get_timestamp()}",f"[COLLECTOR] Se detectaron {len(activities)} subactividades")
-        
-        # Validar y normalizar cada actividad
-        for activity in activities:
-            if "title" not in activity or not activity["title"]:
-                activity["title"] = "Actividad sin título"
-            
-            if "category" not in activity or not activity["category"]:
-                activity["category"] = "Otra"
-            
-            if "importance" not in activity or not isinstance(activity["importance"], int):
-                activity["importance"] = 5
-            
-            activity["time_context"] = time_context
-        
-        return activities
-    except Exception as e:
-        print(f"{get_timestamp()}",f"[COLLECTOR] Error al extraer subactividades: {e}")
-        return []
+        activity["time_context"] = time_context
+    
+    return activities
 
 def generate_clarification_questions(msg: str, activity_title: str) -> list:
     """Genera preguntas de clarificación específicas para una actividad."""
-    print(f"{get_timestamp()}",f"[COLLECTOR] Generando preguntas de clarificación para: '{activity_title}'")
+    logger.debug("Generando preguntas de clarificación para: '%s'", activity_title)
     
     prompt = (
         f"Analiza el mensaje: '{msg}'. Considera la actividad '{activity_title}' y genera "
@@ -289,50 +243,21 @@ def generate_clarification_questions(msg: str, activity_title: str) -> list:
         "Devuelve hasta 3 preguntas en formato JSON: {\"questions\": [\"Pregunta 1\", \"Pregunta 2\", ...]}"
     )
     
-    response = ask_gpt(prompt)
-    print(f"{get_timestamp()}",f"[COLLECTOR] Respuesta de generación de preguntas: '{response[:100]}...'")
+    data = ask_json(prompt)
+    questions = data["questions"] if data is not None else []
     
-    try:
-        import json
-        import re
-        
-        # Buscar patrón JSON en la respuesta
-        json_pattern = r'(\{.*\})'
-        matches = re.search(json_pattern, response, re.DOTALL)
-        
-        if matches:
-            json_str = matches.group(1)
-            data = json.loads(json_str)
-        else:
-            # Intentar limpiar y parsear
-            cleaned_response = re.sub(r'^[^{]*', '', response)
-            cleaned_response = re.sub(r'[^}]*$', '', cleaned_response)
-            
-            if cleaned_response:
-                data = json.loads(cleaned_response)
-            else:
-                print(f"{get_timestamp()}","[COLLECTOR] No se pudo extraer JSON de preguntas, usando pregunta por defecto")
-                return [f"¿Podrías darnos más detalles sobre '{activity_title}'?"]
-        
-        questions = data.get("questions", [])
-        
-        # Si hay preguntas, limitar a 3 máximo
-        if questions:
-            print(f"{get_timestamp()}",f"[COLLECTOR] Se generaron {len(questions)} preguntas de clarificación")
-            return questions[:3]
-        else:
-            # Si no hay preguntas, usar pregunta por defecto
-            print(f"{get_timestamp()}","[COLLECTOR] No se generaron preguntas, usando pregunta por defecto")
-            return [f"¿Podrías darnos más detalles sobre '{activity_title}'?"]
-            
-    except Exception as e:
-        print(f"{get_timestamp()}",f"[COLLECTOR] Error al generar preguntas de clarificación: {e}")
-        # Si hay un error, proporcionar una pregunta genérica
-        return [f"¿Podrías darnos más detalles sobre '{activity_title}'?"]
+    # Si hay preguntas, limitar a 3 máximo
+    if questions:
+        logger.debug("Se generaron %s preguntas de clarificación", len(questions))
+        return questions[:3]
+    
+    # Sin respuesta válida o sin preguntas: pregunta genérica
+    logger.debug("No se generaron preguntas, usando pregunta por defecto")
+    return [f"¿Podrías darnos más detalles sobre '{activity_title}'?"]
 
 def extract_entities_from_activity(msg: str, activity_title: str) -> list:
     """Extrae entidades (personas, lugares, conceptos) relacionadas con una actividad."""
-    print(f"{get_timestamp()}",f"[COLLECTOR] Extrayendo entidades para actividad: '{activity_title}'")
+    logger.debug("Extrayendo entidades para actividad: '%s'", activity_title)
     
     prompt = (
         f"Del mensaje: '{msg}', extrae entidades relacionadas con la actividad '{activity_title}'. "
@@ -346,43 +271,20 @@ def extract_entities_from_activity(msg: str, activity_title: str) -> list:
         ']}'
     )
     
-    response = ask_gpt(prompt)
-    print(f"{get_timestamp()}",f"[COLLECTOR] Respuesta de extracción de entidades: '{response[:100]}...'")
-    
-    try:
-        import json
-        import re
-        
-        # Buscar patrón JSON en la respuesta
-        json_pattern = r'(\{.*\})'
-        matches = re.search(json_pattern, response, re.DOTALL)
-        
-        if matches:
-            json_str = matches.group(1)
-            data = json.loads(json_str)
-        else:
-            # Intentar limpiar y parsear
-            cleaned_response = re.sub(r'^[^{]*', '', response)
-            cleaned_response = re.sub(r'[^}]*$', '', cleaned_response)
-            
-            if cleaned_response:
-                data = json.loads(cleaned_response)
-            else:
-                print(f"{get_timestamp()}","[COLLECTOR] No se pudo extraer JSON de entidades, devolviendo lista vacía")
-                return []
-        
-        entities = data.get("entities", [])
-        
-        # Asignar IDs a las entidades
-        for entity in entities:
-            entity["entity_id"] = str(ObjectId())
-        
-        print(f"{get_timestamp()}",f"[COLLECTOR] Se detectaron {len(entities)} entidades")
-        return entities
-    except Exception as e:
-        print(f"{get_timestamp()}",f"[COLLECTOR] Error al extraer entidades de actividad: {e}")
+    data = ask_json(prompt)
+    if data is None:
+        logger.warning("No se pudieron extraer entidades, devolviendo lista vacía")
         return []
     
+    entities = data["entities"]
+    
+    # Asignar IDs a las entidades
+    for entity in entities:
+        entity["entity_id"] = str(ObjectId())
+    
+    logger.debug("Se detectaron %s entidades", len(entities))
+    return entities
+    
 def analyze_activity(activity_title: str, full_message: str, time_context: str) -> str:
     """Genera un análisis sobre una actividad específica."""
     context_label = "pasada" if time_context == "past" else "futura"
@@ -86,12 +86,11 @@ def analyzer_node(global_state: Dict[str, Any]) -> Dict[str, Any]:
     # Actualizar global_state con el análisis
     global_state["analysis"] = analysis_object
     
-    # Guardar en la base de datos
-    db.save_conversation_message(
+    # Guardar en la base de datos como traza interna
+    db.save_agent_trace(
         user_id, 
-        "system", 
-        f"Análisis: {complete_analysis}", 
-        {"step": "analyzer_node"}
+        "analyzer_node", 
+        f"Análisis: {complete_analysis}"
     )
     
     # Actualizar el estado del usuario con un resumen del análisis
@@ -297,7 +296,7 @@ def extract_insights(activities: List[Dict[str, Any]], complete_analysis: str) -
     insights_text = ask_gpt(prompt)
     
     # Procesar el texto para obtener una lista
-    insights = [insight.strip() for insight in insights_text.split("\n") if insight.strip()]
+    insights = [insight.strip() for insight in (insights_text or "").split("\n") if insight.strip()]
     
     # Si no se pudieron extraer insights o el formato no es el esperado
     if not insights:
@@ -353,7 +352,7 @@ def analyze_tone(activities: List[Dict[str, Any]], analysis: str) -> str:
         f"basándote en las palabras, frases y contexto. Responde con una sola palabra o frase corta."
     )
     
-    tone = ask_gpt(prompt).strip().lower()
+    tone = (ask_gpt(prompt) or "neutral").strip().lower()
     
     # Si la respuesta es muy larga, simplificarla
     if len(tone) > 20:
@@ -2,8 +2,10 @@
 
 import json
 from datetime import datetime
-from core.utils import get_timestamp
-from zendell.services.llm_provider import ask_gpt
+from zendell.services.structured_output import ask_json
+from zendell.core.log import get_logger
+
+logger = get_logger(__name__)
 
 def clarifier_node(global_state: dict) -> dict:
     """
@@ -19,10 +21,10 @@ def clarifier_node(global_state: dict) -> dict:
     db = global_state["db"]
     user_id = global_state.get("user_id", "")
     
-    print(f"{get_timestamp()}",f"[CLARIFIER] Iniciando clarifier_node con {len(activities)} actividades")
+    logger.debug("Iniciando clarifier_node con %s actividades", len(activities))
     
     if not last_msg or not activities:
-        print(f"{get_timestamp()}","[CLARIFIER] No hay mensaje o actividades, terminando sin preguntas")
+        logger.debug("No hay mensaje o actividades, terminando sin preguntas")
         global_state["clarification_questions"] = []
         return global_state
     
@@ -40,11 +42,11 @@ def clarifier_node(global_state: dict) -> dict:
                 "original_question": activity_questions[0]
             })
     
-    print(f"{get_timestamp()}",f"[CLARIFIER] Preguntas extraídas de actividades: {len(all_questions)}")
+    logger.debug("Preguntas extraídas de actividades: %s", len(all_questions))
     
     # Si no hay suficientes preguntas, generar nuevas
     if len(all_questions) < 2:
-        print(f"{get_timestamp()}","[CLARIFIER] Generando nuevas preguntas de clarificación")
+        logger.debug("Generando nuevas preguntas de clarificación")
         # Generar preguntas basadas en todas las actividades
         prompt = (
             f"Analiza el mensaje del usuario: '{last_msg}'. "
@@ -56,35 +58,9 @@ def clarifier_node(global_state: dict) -> dict:
             "Devuelve SOLO un JSON con este formato (nada de texto adicional): {\"questions\": [\"Pregunta 1\", \"Pregunta 2\"]}"
         )
         
-        response = ask_gpt(prompt)
-        print(f"{get_timestamp()}",f"[CLARIFIER] Respuesta del LLM: '{response[:100]}...'")
-        
-        try:
-            # Intentar limpiar y extraer el JSON con regex
-            import re
-            import json
-            
-            # Buscar patrón JSON en la respuesta
-            json_pattern = r'(\{.*\})'
-            matches = re.search(json_pattern, response, re.DOTALL)
-            
-            if matches:
-                json_str = matches.group(1)
-                print(f"{get_timestamp()}",f"[CLARIFIER] JSON extraído: '{json_str[:50]}...'")
-                data = json.loads(json_str)
-            else:
-                # Intentar limpiar eliminando texto antes y después de llaves
-                cleaned_response = re.sub(r'^[^{]*', '', response)
-                cleaned_response = re.sub(r'[^}]*$', '', cleaned_response)
-                print(f"{get_timestamp()}",f"[CLARIFIER] Respuesta limpiada: '{cleaned_response[:50]}...'")
-                
-                if cleaned_response:
-                    data = json.loads(cleaned_response)
-                else:
-                    print(f"{get_timestamp()}","[CLARIFIER] No se pudo extraer JSON, usando pregunta por defecto")
-                    raise ValueError("No JSON found")
-            
-            questions = data.get("questions", [])
+        data = ask_json(prompt)
+        if data is not None:
+            questions = data["questions"]
             
             # Asociar estas preguntas generales con todas las actividades
             for question in questions:
@@ -94,10 +70,10 @@ def clarifier_node(global_state: dict) -> dict:
                     "original_question": question
                 })
                 
-            print(f"{get_timestamp()}",f"[CLARIFIER] {len(questions)} preguntas generadas")
+            logger.debug("%s preguntas generadas", len(questions))
                 
-        except Exception as e:
-            print(f"{get_timestamp()}",f"[CLARIFIER] Error al procesar preguntas de clarificación: {e}")
+        else:
+            logger.warning("No se obtuvieron preguntas de clarificación, usando pregunta por defecto")
             # Fallback: una pregunta genérica
             fallback_question = "¿Podrías darme más detalles sobre estas actividades?"
             all_questions.append({
@@ -105,11 +81,11 @@ def clarifier_node(global_state: dict) -> dict:
                 "activity_id": None,
                 "original_question": fallback_question
             })
-            print(f"{get_timestamp()}","[CLARIFIER] Usando pregunta fallback")
+            logger.debug("Usando pregunta fallback")
     
     # Limitar a 3 preguntas máximo
     selected_questions = all_questions[:3]
-    print(f"{get_timestamp()}",f"[CLARIFIER] Preguntas seleccionadas finales: {len(selected_questions)}")
+    logger.debug("Preguntas seleccionadas finales: %s", len(selected_questions))
     
     # Actualizar global_state con las preguntas seleccionadas
     global_state["clarification_questions"] = [q["question"] for q in selected_questions]
@@ -130,9 +106,9 @@ def clarifier_node(global_state: dict) -> dict:
         })
         db.save_state(user_id, state)
     except Exception as e:
-        print(f"{get_timestamp()}",f"[CLARIFIER] Error al guardar historial de clarificación: {e}")
+        logger.error("Error al guardar historial de clarificación: %s", e)
     
-    print(f"{get_timestamp()}","[CLARIFIER] clarifier_node completado con éxito")
+    logger.debug("clarifier_node completado con éxito")
     return global_state
 
 def process_clarifier_response(global_state: dict) -> dict:
@@ -148,10 +124,10 @@ def process_clarifier_response(global_state: dict) -> dict:
     activities = global_state.get("activities", [])
     question_metadata = global_state.get("clarification_metadata", [])
     
-    print(f"{get_timestamp()}",f"[CLARIFIER] Procesando respuesta del usuario: '{user_input[:50]}...'")
+    logger.debug("Procesando respuesta del usuario: '%.50s...'", user_input)
     
     if not user_input or not activities:
-        print(f"{get_timestamp()}","[CLARIFIER] No hay input de usuario o actividades para procesar")
+        logger.debug("No hay input de usuario o actividades para procesar")
         return global_state
     
     db = global_state["db"]
@@ -162,10 +138,10 @@ def process_clarifier_response(global_state: dict) -> dict:
     
     # Si no hay preguntas registradas, usar una genérica para el análisis
     if not questions_asked:
-        print(f"{get_timestamp()}","[CLARIFIER] No hay preguntas registradas, usando genérica")
+        logger.debug("No hay preguntas registradas, usando genérica")
         questions_asked = ["Pregunta de clarificación sobre las actividades"]
     
-    print(f"{get_timestamp()}",f"[CLARIFIER] Preguntas realizadas: {questions_asked}")
+    logger.debug("Preguntas realizadas: %s", questions_asked)
     
     # Analizar la respuesta del usuario
     prompt = (
@@ -183,8 +159,7 @@ def process_clarifier_response(global_state: dict) -> dict:
         '], "new_questions": ["Posible pregunta adicional 1", "Posible pregunta 2"]}'
     )
     
-    response = ask_gpt(prompt)
-    print(f"{get_timestamp()}",f"[CLARIFIER] Respuesta del LLM: '{response[:100]}...'")
+    data = ask_json(prompt)
     
     # Preparar análisis por defecto
     default_analysis = {
@@ -193,41 +168,11 @@ def process_clarifier_response(global_state: dict) -> dict:
         "insights": "Información adicional proporcionada por el usuario."
     }
     
-    try:
-        # Intentar limpiar y extraer el JSON con regex
-        import re
-        import json
-        
-        # Buscar patrón JSON en la respuesta
-        json_pattern = r'(\{.*\})'
-        matches = re.search(json_pattern, response, re.DOTALL)
-        
-        if matches:
-            json_str = matches.group(1)
-            print(f"{get_timestamp()}",f"[CLARIFIER] JSON extraído: '{json_str[:50]}...'")
-            data = json.loads(json_str)
-        else:
-            # Intentar limpiar eliminando texto antes y después de llaves
-            cleaned_response = re.sub(r'^[^{]*', '', response)
-            cleaned_response = re.sub(r'[^}]*$', '', cleaned_response)
-            print(f"{get_timestamp()}",f"[CLARIFIER] Respuesta limpiada: '{cleaned_response[:50]}...'")
-            
-            if cleaned_response:
-                data = json.loads(cleaned_response)
-            else:
-                print(f"{get_timestamp()}","[CLARIFIER] No se pudo extraer JSON, usando análisis por defecto")
-                raise ValueError("No JSON found")
-        
-        extracted_analyses = data.get("analysis", [])
+    if data is not None:
+        extracted_analyses = data["analysis"]
         new_questions = data.get("new_questions", [])
-        
-        # Verificar que haya análisis
-        if not extracted_analyses:
-            print(f"{get_timestamp()}","[CLARIFIER] Análisis vacío, usando análisis por defecto")
-            extracted_analyses = [default_analysis]
-            
-    except Exception as e:
-        print(f"{get_timestamp()}",f"[CLARIFIER] Error al procesar respuesta del clarificador: {e}")
+    else:
+        logger.warning("No se pudo analizar la respuesta del clarificador, usando análisis por defecto")
         # Valores por defecto
         extracted_analyses = [default_analysis]
         new_questions = []
@@ -236,7 +181,7 @@ def process_clarifier_response(global_state: dict) -> dict:
     if not extracted_analyses:
         extracted_analyses = [default_analysis]
     
-    print(f"{get_timestamp()}",f"[CLARIFIER] Análisis extraídos: {len(extracted_analyses)}")
+    logger.debug("Análisis extraídos: %s", len(extracted_analyses))
     
     # Actualizar actividades con la información obtenida
     updated_activities = 0
@@ -283,9 +228,9 @@ def process_clarifier_response(global_state: dict) -> dict:
                     activity["clarifier_responses"].append(qa_entry)
                     global_state["activities"][i] = activity
         except Exception as e:
-            print(f"{get_timestamp()}",f"[CLARIFIER] Error al actualizar actividad {activity_id}: {e}")
+            logger.error("Error al actualizar actividad %s: %s", activity_id, e)
     
-    print(f"{get_timestamp()}",f"[CLARIFIER] Actividades actualizadas: {updated_activities}")
+    logger.debug("Actividades actualizadas: %s", updated_activities)
     
     # Si hay actividades sin asociación específica (preguntas generales)
     general_activities = [a for a in activities if not any(m.get("activity_id") == a.get("activity_id") for m in question_metadata)]
@@ -308,7 +253,7 @@ def process_clarifier_response(global_state: dict) -> dict:
                     # Actualizar en la base de datos
                     db.add_clarification_to_activity(activity_id, qa_entry["question"], user_input)
                 except Exception as e:
-                    print(f"{get_timestamp()}",f"[CLARIFIER] Error al actualizar actividad general {activity_id}: {e}")
+                    logger.error("Error al actualizar actividad general %s: %s", activity_id, e)
     
     # Actualizar el estado del usuario
     try:
@@ -321,7 +266,7 @@ def process_clarifier_response(global_state: dict) -> dict:
         })
         db.save_state(user_id, state)
     except Exception as e:
-        print(f"{get_timestamp()}",f"[CLARIFIER] Error al actualizar estado del usuario: {e}")
+        logger.error("Error al actualizar estado del usuario: %s", e)
     
     # Actualizar global_state con la información procesada
     global_state["clarifier_responses"] = [analysis.get("extracted_info", "") for analysis in extracted_analyses]
@@ -332,9 +277,9 @@ def process_clarifier_response(global_state: dict) -> dict:
     try:
         analyze_response_for_insights(global_state, user_input)
     except Exception as e:
-        print(f"{get_timestamp()}",f"[CLARIFIER] Error al analizar insights: {e}")
+        logger.error("Error al analizar insights: %s", e)
     
-    print(f"{get_timestamp()}","[CLARIFIER] Procesamiento de respuesta completado")
+    logger.debug("Procesamiento de respuesta completado")
     return global_state
 
 def analyze_response_for_insights(global_state: dict, user_input: str) -> None:
@@ -345,18 +290,18 @@ def analyze_response_for_insights(global_state: dict, user_input: str) -> None:
     db = global_state["db"]
     user_id = global_state.get("user_id", "")
     
-    print(f"{get_timestamp()}",f"[CLARIFIER] Analizando respuesta para insights: '{user_input[:50]}...'")
+    logger.debug("Analizando respuesta para insights: '%.50s...'", user_input)
     
     try:
         # Extraer entidades y conceptos
         entities = db._extract_entities_from_message(user_id, user_input)
-        print(f"{get_timestamp()}",f"[CLARIFIER] Entidades extraídas: {len(entities)}")
+        logger.debug("Entidades extraídas: %s", len(entities))
     except Exception as e:
-        print(f"{get_timestamp()}",f"[CLARIFIER] Error al extraer entidades: {e}")
+        logger.error("Error al extraer entidades: %s", e)
     
     try:
         # Extraer información personal
         info = db.extract_and_update_user_info(user_id, user_input)
-        print(f"{get_timestamp()}",f"[CLARIFIER] Información personal extraída: {len(info) if info else 0} campos")
+        logger.debug("Información personal extraída: %s campos", len(info) if info else 0)
     except Exception as e:
-        print(f"{get_timestamp()}",f"[CLARIFIER] Error al extraer información personal: {e}")
\ No newline at end of file
+        logger.error("Error al extraer información personal: %s", e)
\ No newline at end of file
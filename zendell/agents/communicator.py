@@ -1,68 +1,286 @@
 # zendell/agents/communicator.py
 
 import asyncio
-from core.utils import get_timestamp
+import time
+from config.settings import (
+    MAX_CONCURRENT_USERS, MESSAGE_DEBOUNCE_SECONDS, MESSAGE_DEBOUNCE_MAX_SECONDS,
+    ORCHESTRATOR_WORKERS, ORCHESTRATOR_TIMEOUT_SECONDS
+)
 from zendell.agents.goal_finder import goal_finder_node
 from zendell.agents.orchestrator import orchestrator_flow
-from zendell.services.discord_service import send_dm
+from zendell.core.dispatcher import UserDispatcher
+from zendell.core.executor import OrchestratorExecutor, WorkTimeout
+from zendell.services.messaging_service import MessagingService, DiscordChannel, ReplyRoute, reply_scope
+from zendell.services.llm_usage import usage_scope
+from zendell.services.llm_scheduler import lane_scope, INTERACTIVE, PROACTIVE
+from zendell.services import model_router, llm_resilience, llm_scheduler, structured_output
+from zendell.core.log import get_logger
+
+logger = get_logger(__name__)
+
+TIMEOUT_FALLBACK_TEXT = "Estoy tardando más de lo normal en procesar tu mensaje. Dame un momento y vuelve a escribirme, por favor."
+ERROR_FALLBACK_TEXT = "Lo siento, ha ocurrido un error al procesar tu mensaje. Vuelve a intentarlo en unos minutos, por favor."
 
 class Communicator:
-    def __init__(self, db_manager):
+    def __init__(
+        self,
+        db_manager,
+        max_concurrent_users: int = MAX_CONCURRENT_USERS,
+        debounce_seconds: float = MESSAGE_DEBOUNCE_SECONDS,
+        debounce_max_seconds: float = MESSAGE_DEBOUNCE_MAX_SECONDS,
+        executor: OrchestratorExecutor = None,
+        messaging: MessagingService = None,
+        async_db_manager=None
+    ):
         self.db_manager = db_manager
+        # AsyncMongoDBManager opcional para las lecturas/escrituras hechas desde el event loop
+        self.async_db_manager = async_db_manager
         self.conversations = {}
+        # Buzón por usuario: orden estricto por usuario y paralelismo acotado entre usuarios
+        self.dispatcher = UserDispatcher(max_concurrent_users)
+        # El trabajo síncrono (pymongo, OpenAI) se ejecuta fuera del event loop
+        self.executor = executor or OrchestratorExecutor(ORCHESTRATOR_WORKERS, ORCHESTRATOR_TIMEOUT_SECONDS)
+        # Canales de salida; la entrega se encola y no bloquea el turno
+        self.messaging = messaging or MessagingService([DiscordChannel()])
+        # Fragmentos pendientes de agrupar por usuario
+        self.debounce_seconds = debounce_seconds
+        self.debounce_max_seconds = max(debounce_max_seconds, debounce_seconds)
+        self._pending = {}
+        self._coalesced_messages = 0
+
+    def get_metrics(self) -> dict:
+        """Métricas de colas por usuario, tiempos de espera y mensajes agrupados."""
+        metrics = self.dispatcher.get_metrics()
+        metrics["executor"] = self.executor.get_metrics()
+        metrics["messaging"] = self.messaging.get_metrics()
+        metrics["llm_tiers"] = model_router.router.get_metrics()
+        metrics["llm_resilience"] = llm_resilience.get_metrics()
+        metrics["llm_lanes"] = llm_scheduler.scheduler.get_metrics()
+        metrics["structured_output"] = structured_output.get_metrics()
+        metrics["pending_fragments"] = sum(len(p["texts"]) for p in self._pending.values())
+        metrics["coalesced_messages"] = self._coalesced_messages
+        return metrics
+
+    @staticmethod
+    def _is_command(text: str) -> bool:
+        return text.strip().upper() == "FIN" or "mensaje anterior" in text.lower()
 
-    async def on_user_message(self, text: str, author_id: str):
-        self.db_manager.save_conversation_message(
-        user_id=author_id,
-        role="user",
-        content=text,
-        extra_data={"step": "user_input"}
-         )
+    async def on_user_message(self, text: str, author_id: str, route: ReplyRoute = None):
+        # Sin awaits antes de encolar: el orden de llegada se conserva aunque
+        # lleguen varios mensajes del mismo usuario de forma concurrente.
+        # Los mensajes del usuario se guardan dentro de su turno.
+        # Con `route`, las respuestas del turno salen por su canal y quedan en ella.
+        routes = [route] if route is not None else []
         buffer = self.conversations.get(author_id, [])
         buffer.append(text)
         self.conversations[author_id] = buffer
-        if text.strip().upper() == "FIN":
-            await self.handle_end_of_conversation(author_id)
+
+        if self._is_command(text):
+            # Los comandos no se agrupan: primero se procesa lo pendiente, luego el comando
+            await self.flush_pending(author_id)
+            await self.dispatcher.submit(author_id, self._routed, routes, self._process_command, text, author_id)
+            return
+        if self.debounce_seconds <= 0:
+            await self.dispatcher.submit(author_id, self._routed, routes, self._process_fragments, [text], author_id)
+            return
+        await self._debounce(text, author_id, routes)
+
+    @staticmethod
+    async def _routed(routes: list, func, *args):
+        """Ejecuta el turno asociando sus mensajes salientes a las rutas de las peticiones que lo originan."""
+        with reply_scope(routes):
+            return await func(*args)
+
+    async def _debounce(self, text: str, author_id: str, routes: list = None):
+        """
+        Acumula el fragmento en la ventana del usuario. El turno se lanza cuando pasan
+        debounce_seconds sin mensajes nuevos o debounce_max_seconds desde el primero.
+        """
+        now = time.monotonic()
+        pending = self._pending.get(author_id)
+        if pending is None:
+            pending = {
+                "texts": [],
+                "routes": [],
+                "first_at": now,
+                "last_at": now,
+                "future": asyncio.get_running_loop().create_future(),
+                "timer": None
+            }
+            self._pending[author_id] = pending
+            pending["timer"] = asyncio.create_task(self._debounce_timer(author_id, pending))
+        else:
+            self._coalesced_messages += 1
+        pending["texts"].append(text)
+        pending["routes"].extend(routes or [])
+        pending["last_at"] = now
+        await asyncio.shield(pending["future"])
+
+    async def _debounce_timer(self, author_id: str, pending: dict):
+        while True:
+            deadline = min(
+                pending["last_at"] + self.debounce_seconds,
+                pending["first_at"] + self.debounce_max_seconds
+            )
+            delay = deadline - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        await self._flush(author_id, pending)
+
+    async def flush_pending(self, author_id: str):
+        """Procesa de inmediato los fragmentos pendientes del usuario, si los hay."""
+        pending = self._pending.get(author_id)
+        if pending is None:
             return
-        if "mensaje anterior" in text.lower():
-            await self.handle_previous_message(author_id)
+        if pending["timer"] is not None and pending["timer"] is not asyncio.current_task():
+            pending["timer"].cancel()
+        await self._flush(author_id, pending)
+
+    async def _flush(self, author_id: str, pending: dict):
+        if self._pending.get(author_id) is not pending:
+            # Ya se vació por otra vía (comando o timer)
+            await asyncio.shield(pending["future"])
             return
-        # Se pasa el db manager a orchestrator_flow a través del global_state.
-        flow = orchestrator_flow(author_id, text, self.db_manager)
-        final = flow["final_text"]
-        await send_dm(author_id, final)
+        self._pending.pop(author_id, None)
+        future = pending["future"]
+        try:
+            await self.dispatcher.submit(
+                author_id, self._routed, pending["routes"], self._process_fragments, pending["texts"], author_id
+            )
+            if not future.done():
+                future.set_result(None)
+        except Exception as e:
+            # El error llega a quienes esperan los fragmentos agrupados
+            if not future.done():
+                future.set_exception(e)
+
+    async def _save_message(self, **message):
+        """Guarda un mensaje con Motor si hay manager asíncrono; si no, con pymongo en el executor."""
+        if self.async_db_manager is not None:
+            return await self.async_db_manager.save_conversation_message(**message)
+        return await self.executor.run(self.db_manager.save_conversation_message, timeout=0, **message)
+
+    async def _save_user_messages(self, texts: list, author_id: str):
+        for text in texts:
+            await self._save_message(
+                user_id=author_id,
+                role="user",
+                content=text,
+                extra_data={"step": "user_input"}
+            )
+
+    async def _flush_writes(self):
+        """Vacía el buffer de escrituras del db manager al final del turno (una o dos round trips)."""
+        if getattr(self.db_manager, "write_buffer", None) is not None:
+            await self.executor.run(self.db_manager.flush_writes, timeout=0)
+
+    async def _process_fragments(self, texts: list, author_id: str):
+        """Guarda cada fragmento como mensaje propio y lanza un único turno con el texto combinado."""
+        # Las llamadas al LLM del turno (también la extracción de entidades al guardar) se imputan al usuario
+        # y van por el carril interactivo del planificador
+        with usage_scope(author_id), lane_scope(INTERACTIVE):
+            try:
+                await self._save_user_messages(texts, author_id)
+                await self._process_user_message("\n".join(texts), author_id)
+            finally:
+                await self._flush_writes()
+
+    async def _process_command(self, text: str, author_id: str):
+        with usage_scope(author_id), lane_scope(INTERACTIVE):
+            try:
+                await self._save_user_messages([text], author_id)
+                if text.strip().upper() == "FIN":
+                    await self.handle_end_of_conversation(author_id)
+                    return
+                await self.handle_previous_message(author_id)
+            finally:
+                await self._flush_writes()
+
+    async def _process_user_message(self, text: str, author_id: str):
+        # Si el canal del usuario admite streaming, la respuesta se entrega mientras se genera
+        stream = await self.messaging.open_stream(author_id)
+        final = ERROR_FALLBACK_TEXT
+        orphan = None
+        try:
+            # Se pasa el db manager a orchestrator_flow a través del global_state.
+            if stream is not None:
+                flow = await self.executor.run(orchestrator_flow, author_id, text, self.db_manager, on_token=stream.push)
+            else:
+                flow = await self.executor.run(orchestrator_flow, author_id, text, self.db_manager)
+            final = flow["final_text"]
+        except WorkTimeout as e:
+            logger.warning("Timeout procesando el turno de %s", author_id)
+            final = TIMEOUT_FALLBACK_TEXT
+            orphan = e
+        except Exception as e:
+            # El usuario recibe un aviso de error (no el de espera) y el turno termina aquí
+            logger.exception("Error procesando el turno de %s: %s", author_id, e)
+        finally:
+            if stream is not None:
+                stream.close(final)
+        if stream is None:
+            await self.messaging.send(author_id, final)
+        if orphan is not None:
+            # El turno abandonado se cancela en su siguiente punto de control; hasta que su hilo
+            # termina no se libera el buzón, para que el siguiente turno no se solape con él
+            await orphan.wait_finished()
 
     async def handle_end_of_conversation(self, author_id: str):
         farewell = "¡Gracias! Te escribiré en la siguiente hora."
-        self.db_manager.save_conversation_message(user_id=author_id, role="assistant", content=farewell)
-        await send_dm(author_id, farewell)
+        await self._save_message(user_id=author_id, role="assistant", content=farewell)
+        await self.messaging.send(author_id, farewell)
         if author_id in self.conversations:
             self.conversations.pop(author_id)
 
     async def handle_previous_message(self, author_id: str):
-        c = self.db_manager.conversations_coll.find({"user_id": author_id}).sort("timestamp", -1).limit(2)
-        data = list(c)
+        # Últimos dos mensajes del diálogo en orden cronológico
+        if self.async_db_manager is not None:
+            data = await self.async_db_manager.get_dialogue(author_id, limit=2)
+        else:
+            data = await self.executor.run(self.db_manager.get_dialogue, author_id, limit=2, timeout=0)
         if len(data) < 2:
-            await send_dm(author_id, "No existe un mensaje anterior.")
+            await self.messaging.send(author_id, "No existe un mensaje anterior.")
         else:
-            msg = data[1]["content"]
-            await send_dm(author_id, f"El mensaje anterior fue: '{msg}'")
+            msg = data[0]["content"]
+            await self.messaging.send(author_id, f"El mensaje anterior fue: '{msg}'")
 
-    async def trigger_interaction(self, user_id: str):
+    async def trigger_interaction(self, user_id: str, hours_between_interactions: float = 1, route: ReplyRoute = None):
         """
         Inicia una interacción con el usuario basada en el contexto actual.
+        Se encola en el buzón del usuario para no solaparse con sus mensajes.
         """
+        routes = [route] if route is not None else []
+        await self.dispatcher.submit(user_id, self._routed, routes, self._run_interaction, user_id, hours_between_interactions)
+
+    async def _run_interaction(self, user_id: str, hours_between_interactions: float = 1):
+        try:
+            with usage_scope(user_id), lane_scope(PROACTIVE):
+                cont = await self.executor.run(self._prepare_interaction, user_id, hours_between_interactions)
+        except WorkTimeout as e:
+            logger.warning("Timeout en la interacción proactiva con %s", user_id)
+            await e.wait_finished()
+            return
+        finally:
+            await self._flush_writes()
+        if cont:
+            await self.messaging.send(user_id, cont)
+
+    def _prepare_interaction(self, user_id: str, hours_between_interactions: float = 1) -> str:
+        """Parte síncrona de la interacción proactiva; devuelve el texto a enviar o ''."""
         # Obtener estado antes y después de goal_finder para detectar cambios
         state_before = self.db_manager.get_state(user_id)
-        result = goal_finder_node(user_id, self.db_manager)
+        result = goal_finder_node(user_id, self.db_manager, hours_between_interactions)
         state_after = self.db_manager.get_state(user_id)
         
         # Verificar si goal_finder indica que no debemos interactuar
         if not state_after.get("can_interact", True):
-            print(f"{get_timestamp()}","[COMMUNICATOR] No es momento de interactuar según goal_finder.")
-            return
+            logger.debug("No es momento de interactuar según goal_finder.")
+            return ""
         
-        # Buscar mensajes recientes del asistente
+        # Buscar mensajes recientes del asistente (lectura directa: antes se vacía el buffer)
+        if getattr(self.db_manager, "write_buffer", None) is not None:
+            self.db_manager.flush_writes()
         msgs = self.db_manager.conversations_coll.find(
             {"user_id": user_id, "role": "assistant"},
             sort=[("timestamp", -1)],
@@ -72,6 +290,5 @@ class Communicator:
         
         # Solo enviar si hay un mensaje disponible y se actualizó el estado
         if arr and (str(state_before) != str(state_after)):
-            cont = arr[0].get("content", "")
-            if cont:
-                await send_dm(user_id, cont)
\ No newline at end of file
+            return arr[0].get("content", "")
+        return ""
@@ -1,9 +1,11 @@
 # zendell/agents/goal_finder.py
 
 from datetime import datetime, timedelta
-from core.utils import get_timestamp
 from zendell.services.llm_provider import ask_gpt
 from zendell.core.memory_manager import MemoryManager
+from zendell.core.log import get_logger
+
+logger = get_logger(__name__)
 
 def can_interact(last_time_str: str, hours: int = 1) -> bool:
     """
@@ -44,7 +46,7 @@ def goal_finder_node(user_id: str, db_manager, hours_between_interactions: int =
 
     # Verificar límite diario
     if state.get("daily_interaction_count", 0) >= max_daily_interactions:
-        print(f"{get_timestamp()}", "[GoalFinder] Límite de interacciones diarias alcanzado.")
+        logger.debug("Límite de interacciones diarias alcanzado.")
         return state
 
     # AÑADIR: Verificar si la conversación previa está en estado final
@@ -52,12 +54,12 @@ def goal_finder_node(user_id: str, db_manager, hours_between_interactions: int =
     if current_stage == "final":
         state["conversation_stage"] = "ready_for_new"
         db_manager.save_state(user_id, state)
-        print(f"{get_timestamp()}", "[GoalFinder] Conversación anterior finalizada, listo para una nueva interacción.")
+        logger.debug("Conversación anterior finalizada, listo para una nueva interacción.")
         return state  # Retornar early sin actualizar el timestamp
 
     # Verificar si puede interactuar (después de la comprobación del estado final)
     if not can_interact(state.get("last_interaction_time", ""), hours_between_interactions):
-        print(f"{get_timestamp()}", "[GoalFinder] No ha transcurrido el intervalo para interactuar.")
+        logger.debug("No ha transcurrido el intervalo para interactuar.")
         return state
 
     # Determinar el objetivo de la interacción
@@ -124,7 +126,7 @@ def determine_interaction_goals(user_id: str, db_manager, memory_manager, state:
         }
     
     # Verificar última actividad para determinar contexto
-    recent_activities = db_manager.get_recent_activities(user_id, limit=5)
+    recent_activities = db_manager.get_activity_summaries(user_id, limit=5)
     future_activities = [act for act in recent_activities if act.get("time_context") == "future"]
     
     if future_activities:
@@ -194,7 +196,7 @@ def generate_proactive_message(user_id: str, db_manager, state: dict, goals: dic
     elif interaction_type == "returning_user":
         name = state.get("name", "")
         # Obtener actividades recientes para contexto
-        recent_activities = db_manager.get_recent_activities(user_id, limit=3)
+        recent_activities = db_manager.get_activity_summaries(user_id, limit=3)
         activities_context = ""
         if recent_activities:
             activity_titles = [act.get("title", "") for act in recent_activities]
@@ -1,13 +1,44 @@
 # zendell/agents/orchestrator.py
 
-from typing import Dict, Any
+import time
+from contextvars import ContextVar
+from typing import Dict, Any, Callable, Optional
 from datetime import datetime, timedelta
-from core.utils import get_timestamp
-from zendell.services.llm_provider import ask_gpt_chat
+from zendell.services.llm_provider import ask_gpt_chat, ask_gpt_chat_stream
 from zendell.agents.activity_collector import activity_collector_node
 from zendell.core.memory_manager import MemoryManager
+from zendell.core.db import apply_state_defaults
+from zendell.core.instrumentation import turn, span, current_turn
+from zendell.core.executor import check_cancelled
+from zendell.services.llm_usage import usage_scope
+from zendell.core.log import get_logger
 
-def orchestrator_flow(user_id: str, last_message: str, db_manager) -> Dict[str, Any]:
+logger = get_logger(__name__)
+
+# Callback que recibe los fragmentos de la respuesta al usuario mientras se generan (streaming)
+reply_token_callback: ContextVar[Optional[Callable[[str], None]]] = ContextVar("reply_token_callback", default=None)
+
+def orchestrator_flow(user_id: str, last_message: str, db_manager, on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """
+    Ejecuta un turno del orquestador.
+    
+    Si se indica on_token, la respuesta al usuario se genera en streaming y cada
+    fragmento se pasa a on_token en cuanto llega; el texto completo se guarda y
+    se devuelve en "final_text" igual que sin streaming.
+    
+    El resultado incluye en "metrics" la traza del turno (core/instrumentation.py):
+    llamadas al LLM con sus tokens, operaciones de base de datos y tiempo por etapa.
+    """
+    token = reply_token_callback.set(on_token)
+    try:
+        with turn(user_id) as trace, usage_scope(user_id):
+            result = _orchestrator_flow(user_id, last_message, db_manager)
+        result["metrics"] = trace.to_dict()
+        return result
+    finally:
+        reply_token_callback.reset(token)
+
+def _orchestrator_flow(user_id: str, last_message: str, db_manager) -> Dict[str, Any]:
     """
     Coordina el flujo completo de la conversación y orquesta los diferentes agentes.
     
@@ -18,60 +49,33 @@ def orchestrator_flow(user_id: str, last_message: str, db_manager) -> Dict[str,
     4. Construye el contexto adecuado para las respuestas al usuario
     5. Coordina la transición entre etapas
     """
-    print(f"{get_timestamp()}", f"[ORCHESTRATOR] START => user_id={user_id}, last_message='{last_message}'")
+    logger.debug("START => user_id=%s, last_message='%s'", user_id, last_message)
     
     # Inicializar el gestor de memoria si está disponible, o None si no lo está
     try:
         memory_manager = MemoryManager(db_manager)
-        print(f"{get_timestamp()}", "[ORCHESTRATOR] Memory Manager inicializado correctamente")
+        logger.debug("Memory Manager inicializado correctamente")
     except Exception as e:
-        print(f"{get_timestamp()}", f"[ORCHESTRATOR] Error al inicializar Memory Manager: {e}")
+        logger.error("Error al inicializar Memory Manager: %s", e)
         memory_manager = None
     
-    # Obtener el estado actual del usuario
+    # Obtener el estado actual del usuario (get_state ya completa los campos por defecto)
     try:
         state = db_manager.get_state(user_id)
-        print(f"{get_timestamp()}", f"[ORCHESTRATOR] Estado cargado correctamente: {state.keys()}")
-    except Exception as e:
-        print(f"{get_timestamp()}", f"[ORCHESTRATOR] Error al obtener estado del usuario: {e}")
-        state = {
-            "user_id": user_id,
-            "name": "Desconocido",
-            "conversation_stage": "initial",
-            "short_term_info": [],
-            "general_info": {}
-        }
-    
-    # Verificar y asegurar que el estado tenga todos los campos necesarios
-    if "name" not in state:
-        state["name"] = "Desconocido"
-        print(f"{get_timestamp()}", "[ORCHESTRATOR] Campo 'name' faltante, añadido valor por defecto")
-    if "conversation_stage" not in state:
-        state["conversation_stage"] = "initial"
-        print(f"{get_timestamp()}", "[ORCHESTRATOR] Campo 'conversation_stage' faltante, añadido valor por defecto")
-    if "short_term_info" not in state:
-        state["short_term_info"] = []
-        print(f"{get_timestamp()}", "[ORCHESTRATOR] Campo 'short_term_info' faltante, añadido valor por defecto")
-    if "general_info" not in state:
-        state["general_info"] = {}
-        print(f"{get_timestamp()}", "[ORCHESTRATOR] Campo 'general_info' faltante, añadido valor por defecto")
-    
-    try:
-        db_manager.save_state(user_id, state)
-        print(f"{get_timestamp()}", "[ORCHESTRATOR] Estado verificado y guardado correctamente")
     except Exception as e:
-        print(f"{get_timestamp()}", f"[ORCHESTRATOR] Error al guardar estado inicial: {e}")
+        logger.error("Error al obtener estado del usuario: %s", e)
+        state = apply_state_defaults({}, user_id)
     
     # Verificar si hay un override para la etapa
     stage = state.get("conversation_stage", "initial")
     if state.get("conversation_stage_override"):
-        print(f"{get_timestamp()}", f"[ORCHESTRATOR] Detected conversation_stage_override={state['conversation_stage_override']}")
+        logger.debug("Detected conversation_stage_override=%s", state['conversation_stage_override'])
         stage = state["conversation_stage_override"]
         state["conversation_stage_override"] = None
         try:
             db_manager.save_state(user_id, state)
         except Exception as e:
-            print(f"{get_timestamp()}", f"[ORCHESTRATOR] Error al guardar estado después de override: {e}")
+            logger.error("Error al guardar estado después de override: %s", e)
     
     # Inicializar el estado global que se pasará entre agentes
     global_state = {
@@ -87,20 +91,26 @@ def orchestrator_flow(user_id: str, last_message: str, db_manager) -> Dict[str,
         "memory_manager": memory_manager
     }
     
+    turn_trace = current_turn()
+    if turn_trace is not None:
+        turn_trace.stage = stage
+    
     # 1) Procesar el mensaje con el recolector de actividades
-    print(f"{get_timestamp()}", f"[ORCHESTRATOR] activity_collector_node => stage={stage}")
+    logger.debug("activity_collector_node => stage=%s", stage)
     try:
-        global_state = activity_collector_node(global_state)
+        with span("activity_collector"):
+            global_state = activity_collector_node(global_state)
     except Exception as e:
-        print(f"{get_timestamp()}", f"[ORCHESTRATOR] Error en activity_collector_node: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error en activity_collector_node: %s", e)
+    
+    # Si el Communicator ya abandonó el turno (timeout), no se sigue
+    check_cancelled()
     
     # 2) Volver a cargar el estado (pudo cambiar en el collector)
     try:
         state = db_manager.get_state(user_id)
     except Exception as e:
-        print(f"{get_timestamp()}", f"[ORCHESTRATOR] Error al recargar estado después de collector: {e}")
+        logger.error("Error al recargar estado después de collector: %s", e)
     
     # Determinar los campos faltantes en el perfil
     missing_fields = get_missing_profile_fields(state)
@@ -108,10 +118,11 @@ def orchestrator_flow(user_id: str, last_message: str, db_manager) -> Dict[str,
     # Obtener los rangos de tiempo para referencias
     time_ranges = get_time_ranges()
     
-    print(f"{get_timestamp()}", f"[ORCHESTRATOR] missing fields={missing_fields}, time_ranges={time_ranges}, current_stage={stage}")
+    logger.debug("missing fields=%s, time_ranges=%s, current_stage=%s", missing_fields, time_ranges, stage)
     
     # Variable para la respuesta final
     reply = ""
+    stage_started = time.perf_counter()
     
     # Manejar cada etapa de la conversación
     if stage == "initial":
@@ -134,7 +145,8 @@ def orchestrator_flow(user_id: str, last_message: str, db_manager) -> Dict[str,
         global_state["current_period"] = "past"
         try:
             from zendell.agents.clarifier import clarifier_node
-            global_state = clarifier_node(global_state)
+            with span("clarifier"):
+                global_state = clarifier_node(global_state)
             questions = global_state.get("clarification_questions", [])
             if questions:
                 reply = generate_clarification_message(db_manager, user_id, questions, "clarifier_last_hour")
@@ -142,7 +154,7 @@ def orchestrator_flow(user_id: str, last_message: str, db_manager) -> Dict[str,
                 reply = "Gracias por compartir lo que hiciste. No necesito más detalles sobre eso."
                 stage = "ask_next_hour"
         except Exception as e:
-            print(f"{get_timestamp()}", f"[ORCHESTRATOR] Error en clarifier_node para past: {e}")
+            logger.error("Error en clarifier_node para past: %s", e)
             reply = "Gracias por compartir lo que hiciste. Pasemos a lo siguiente."
             stage = "ask_next_hour"
     
@@ -150,11 +162,12 @@ def orchestrator_flow(user_id: str, last_message: str, db_manager) -> Dict[str,
         try:
             from zendell.agents.clarifier import process_clarifier_response
             global_state["user_clarifier_response"] = last_message
-            global_state = process_clarifier_response(global_state)
+            with span("clarifier_response"):
+                global_state = process_clarifier_response(global_state)
             stage = "ask_next_hour"
             reply = generate_next_hour_question(db_manager, user_id, time_ranges)
         except Exception as e:
-            print(f"{get_timestamp()}", f"[ORCHESTRATOR] Error en process_clarifier_response para past: {e}")
+            logger.error("Error en process_clarifier_response para past: %s", e)
             stage = "ask_next_hour"
             reply = generate_next_hour_question(db_manager, user_id, time_ranges)
     
@@ -162,7 +175,8 @@ def orchestrator_flow(user_id: str, last_message: str, db_manager) -> Dict[str,
         stage = "clarifier_next_hour"
         global_state["current_period"] = "future"
         from zendell.agents.clarifier import clarifier_node
-        global_state = clarifier_node(global_state)
+        with span("clarifier"):
+            global_state = clarifier_node(global_state)
         questions = global_state.get("clarification_questions", [])
         if questions:
             reply = generate_clarification_message(db_manager, user_id, questions, "clarifier_next_hour")
@@ -172,32 +186,31 @@ def orchestrator_flow(user_id: str, last_message: str, db_manager) -> Dict[str,
     
     elif stage == "clarifier_next_hour":
         try:
-            print(f"{get_timestamp()}", "[ORCHESTRATOR] Procesando respuesta de clarificación para actividades futuras")
+            logger.debug("Procesando respuesta de clarificación para actividades futuras")
             from zendell.agents.clarifier import process_clarifier_response
             global_state["user_clarifier_response"] = last_message
-            global_state = process_clarifier_response(global_state)
+            with span("clarifier_response"):
+                global_state = process_clarifier_response(global_state)
             
             # Realizar análisis sobre las actividades recopiladas
             try:
-                print(f"{get_timestamp()}", "[ORCHESTRATOR] Iniciando análisis de actividades")
+                logger.debug("Iniciando análisis de actividades")
                 from zendell.agents.analyzer import analyzer_node
-                global_state = analyzer_node(global_state)
-                print(f"{get_timestamp()}", "[ORCHESTRATOR] Análisis completado")
+                with span("analyzer"):
+                    global_state = analyzer_node(global_state)
+                logger.debug("Análisis completado")
             except Exception as e:
-                print(f"{get_timestamp()}", f"[ORCHESTRATOR] Error en analyzer_node: {e}")
-                import traceback
-                traceback.print_exc()
+                logger.exception("Error en analyzer_node: %s", e)
             
             # Generar recomendaciones basadas en el análisis
             try:
-                print(f"{get_timestamp()}", "[ORCHESTRATOR] Generando recomendaciones")
+                logger.debug("Generando recomendaciones")
                 from zendell.agents.recommender import recommender_node
-                global_state = recommender_node(global_state)
-                print(f"{get_timestamp()}", "[ORCHESTRATOR] Recomendaciones generadas")
+                with span("recommender"):
+                    global_state = recommender_node(global_state)
+                logger.debug("Recomendaciones generadas")
             except Exception as e:
-                print(f"{get_timestamp()}", f"[ORCHESTRATOR] Error en recommender_node: {e}")
-                import traceback
-                traceback.print_exc()
+                logger.exception("Error en recommender_node: %s", e)
             
             # Avanzar a la etapa final
             stage = "final"
@@ -206,14 +219,12 @@ def orchestrator_flow(user_id: str, last_message: str, db_manager) -> Dict[str,
             try:
                 reply = generate_final_message(db_manager, user_id, global_state)
             except Exception as e:
-                print(f"{get_timestamp()}", f"[ORCHESTRATOR] Error al generar mensaje final: {e}")
+                logger.error("Error al generar mensaje final: %s", e)
                 reply = ("¡Gracias por toda la información que has compartido! Ha sido muy útil conocer más sobre ti y "
                          "tus actividades. Volveré a contactarte pronto para seguir aprendiendo. ¿Hay algo más en que pueda ayudarte por ahora?")
         
         except Exception as e:
-            print(f"{get_timestamp()}", f"[ORCHESTRATOR] Error en la etapa clarifier_next_hour: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Error en la etapa clarifier_next_hour: %s", e)
             stage = "final"
             reply = ("Gracias por compartir tus planes y responder a mis preguntas. He guardado toda esta información. "
                      "¿Hay algo más en lo que pueda ayudarte antes de terminar esta conversación?")
@@ -227,12 +238,21 @@ def orchestrator_flow(user_id: str, last_message: str, db_manager) -> Dict[str,
         stage = "initial"
         reply = "Parece que hubo un problema en nuestra conversación. ¿Podemos empezar de nuevo?"
     
+    # Tiempo de la etapa (respuesta incluida), distinto del collector y de la persistencia
+    if turn_trace is not None:
+        turn_trace.add_span(f"stage.{turn_trace.stage}", (time.perf_counter() - stage_started) * 1000)
+    
+    # Un turno abandonado no guarda una respuesta ni un cambio de etapa que el usuario no vio
+    check_cancelled()
+    
     # Actualizar la etapa de conversación en el estado
     state["conversation_stage"] = stage
-    db_manager.save_state(user_id, state)
-    db_manager.save_conversation_message(user_id, "assistant", reply, {"step": stage})
+    with span("persist"):
+        db_manager.save_state(user_id, state)
+        db_manager.save_conversation_message(user_id, "assistant", reply, {"step": stage})
     
-    print(f"{get_timestamp()}", f"[ORCHESTRATOR] END => new_stage={stage}, reply='{reply[:60]}...'")
+    logger.info("Turno completado", user_id=user_id, stage=stage)
+    logger.debug("END => new_stage=%s, reply='%.60s...'", stage, reply)
     
     return {
         "global_state": global_state,
@@ -258,7 +278,7 @@ def get_missing_profile_fields(state: dict) -> list:
     if not info.get("metas", ""):
         fields.append("metas")
     
-    print(f"{get_timestamp()}", f"[ORCHESTRATOR] Campos faltantes en el perfil: {fields}")
+    logger.debug("Campos faltantes en el perfil: %s", fields)
     return fields
 
 def get_time_ranges() -> dict:
@@ -275,9 +295,47 @@ def get_time_ranges() -> dict:
         }
     }
 
-def build_system_context(db, user_id: str, stage: str) -> str:
-    """Construye el contexto del sistema para el modelo de lenguaje."""
-    state = db.get_state(user_id)
+# Descripción fija de cada etapa para el contexto del sistema
+STAGE_DESCRIPTIONS = {
+    "ask_profile": (
+        "En esta etapa, pido datos personales básicos como nombre, ocupación, "
+        "gustos y metas de forma amigable y conversacional. "
+        "Evito sonar como un formulario y muestro genuino interés."
+    ),
+    "ask_last_hour": (
+        "En esta etapa, pregunto al usuario qué hizo en la última hora. "
+        "Soy específico sobre el rango de tiempo y muestro curiosidad genuina. "
+        "Formulo la pregunta de manera conversacional."
+    ),
+    "clarifier_last_hour": (
+        "En esta etapa, profundizo con preguntas de clarificación sobre actividades pasadas. "
+        "Pregunto por detalles específicos como qué, cuándo, dónde, con quién, por qué. "
+        "Las preguntas deben ser naturales y mostrar interés real."
+    ),
+    "ask_next_hour": (
+        "En esta etapa, pregunto al usuario qué planea hacer en la próxima hora. "
+        "Soy específico sobre el rango de tiempo y muestro curiosidad genuina. "
+        "Formulo la pregunta de manera conversacional."
+    ),
+    "clarifier_next_hour": (
+        "En esta etapa, profundizo con preguntas de clarificación sobre planes futuros. "
+        "Pregunto por detalles específicos como qué, cuándo, dónde, con quién, por qué. "
+        "Las preguntas deben ser naturales y mostrar interés real."
+    ),
+    "final": (
+        "En esta etapa, cierro la conversación de forma amigable. "
+        "Resumo lo que he aprendido, ofrezco algún insight valioso y "
+        "preparo al usuario para la próxima interacción."
+    )
+}
+
+def build_system_context(db, user_id: str, stage: str, state: dict = None) -> str:
+    """
+    Construye el contexto del sistema para el modelo de lenguaje.
+    Si quien llama ya leyó el estado del usuario, lo pasa en `state` y no se vuelve a leer.
+    """
+    if state is None:
+        state = db.get_state(user_id)
     name = state.get("name", "Desconocido")
     st_info = state.get("short_term_info", [])
     last_notes = ". ".join(st_info[-3:]) if st_info else ""
@@ -287,49 +345,15 @@ def build_system_context(db, user_id: str, stage: str) -> str:
         "Objetivo: Recopilar información y mantener una conversación fluida y natural. "
     )
     
-    if stage == "ask_profile":
-        context += (
-            "En esta etapa, pido datos personales básicos como nombre, ocupación, "
-            "gustos y metas de forma amigable y conversacional. "
-            "Evito sonar como un formulario y muestro genuino interés."
-        )
-    elif stage == "ask_last_hour":
-        context += (
-            "En esta etapa, pregunto al usuario qué hizo en la última hora. "
-            "Soy específico sobre el rango de tiempo y muestro curiosidad genuina. "
-            "Formulo la pregunta de manera conversacional."
-        )
-    elif stage == "clarifier_last_hour":
-        context += (
-            "En esta etapa, profundizo con preguntas de clarificación sobre actividades pasadas. "
-            "Pregunto por detalles específicos como qué, cuándo, dónde, con quién, por qué. "
-            "Las preguntas deben ser naturales y mostrar interés real."
-        )
-    elif stage == "ask_next_hour":
-        context += (
-            "En esta etapa, pregunto al usuario qué planea hacer en la próxima hora. "
-            "Soy específico sobre el rango de tiempo y muestro curiosidad genuina. "
-            "Formulo la pregunta de manera conversacional."
-        )
-    elif stage == "clarifier_next_hour":
-        context += (
-            "En esta etapa, profundizo con preguntas de clarificación sobre planes futuros. "
-            "Pregunto por detalles específicos como qué, cuándo, dónde, con quién, por qué. "
-            "Las preguntas deben ser naturales y mostrar interés real."
-        )
-    elif stage == "final":
-        context += (
-            "En esta etapa, cierro la conversación de forma amigable. "
-            "Resumo lo que he aprendido, ofrezco algún insight valioso y "
-            "preparo al usuario para la próxima interacción."
-        )
-    
-    return context
+    return context + STAGE_DESCRIPTIONS.get(stage, "")
 
-def ask_gpt_in_context(db, user_id: str, user_prompt: str, stage: str) -> str:
-    """Utiliza el modelo de lenguaje con contexto específico para cada etapa."""
-    system_text = build_system_context(db, user_id, stage)
-    logs = db.get_user_conversation(user_id, limit=8)
+def ask_gpt_in_context(db, user_id: str, user_prompt: str, stage: str, state: dict = None) -> str:
+    """
+    Utiliza el modelo de lenguaje con contexto específico para cada etapa.
+    El modelo lo decide el nivel de "ask_gpt_in_context" en LLM_MODEL_ROUTES (fast por defecto).
+    """
+    system_text = build_system_context(db, user_id, stage, state)
+    logs = db.get_dialogue(user_id, limit=8)
     chat = [{"role": "system", "content": system_text}]
     
     for msg in logs:
@@ -337,9 +361,17 @@ def ask_gpt_in_context(db, user_id: str, user_prompt: str, stage: str) -> str:
         chat.append({"role": role, "content": msg["content"]})
     
     chat.append({"role": "user", "content": user_prompt})
-    db.save_conversation_message(user_id, "system", f"GPT Prompt: {user_prompt}", {"step": stage})
-    
-    response = ask_gpt_chat(chat, model="gpt-3.5-turbo", temperature=0.7)
+    db.save_agent_trace(user_id, "gpt_prompt", user_prompt, {"step": stage})
+    
+    on_token = reply_token_callback.get()
+    if on_token is not None:
+        parts = []
+        for part in ask_gpt_chat_stream(chat, temperature=0.7):
+            parts.append(part)
+            on_token(part)
+        response = "".join(parts).strip()
+    else:
+        response = ask_gpt_chat(chat, temperature=0.7)
     
     return response if response else "¿Podrías repetirme lo que necesitas?"
 
@@ -358,7 +390,7 @@ def generate_profile_request(db, user_id: str, missing_fields: list) -> str:
         needed = ", ".join(missing_fields)
         prompt = f"Hola {current_name}, para conocerte mejor, me gustaría saber más sobre tu {needed}."
     
-    return ask_gpt_in_context(db, user_id, prompt, "ask_profile")
+    return ask_gpt_in_context(db, user_id, prompt, "ask_profile", state)
 
 def generate_last_hour_question(db, user_id: str, time_ranges: dict) -> str:
     """Genera una pregunta natural sobre lo que hizo el usuario en la última hora."""
@@ -370,7 +402,7 @@ def generate_last_hour_question(db, user_id: str, time_ranges: dict) -> str:
         f"{time_ranges['last_hour']['end']}, {name}? Me interesa saber cómo ha ido tu última hora."
     )
     
-    return ask_gpt_in_context(db, user_id, prompt, "ask_last_hour")
+    return ask_gpt_in_context(db, user_id, prompt, "ask_last_hour", state)
 
 def generate_next_hour_question(db, user_id: str, time_ranges: dict) -> str:
     """Genera una pregunta natural sobre lo que planea hacer el usuario en la próxima hora."""
@@ -382,7 +414,7 @@ def generate_next_hour_question(db, user_id: str, time_ranges: dict) -> str:
         f"{time_ranges['next_hour']['end']}, {name}? Me interesa saber qué harás."
     )
     
-    return ask_gpt_in_context(db, user_id, prompt, "ask_next_hour")
+    return ask_gpt_in_context(db, user_id, prompt, "ask_next_hour", state)
 
 def generate_clarification_message(db, user_id: str, questions: list, stage: str) -> str:
     """Genera un mensaje con preguntas de clarificación de forma natural."""
@@ -99,7 +99,7 @@ def generate_recommendations(context: Dict[str, Any]) -> List[Dict[str, Any]]:
     recommendations_text = ask_gpt(prompt)
     
     # Procesar el texto para convertirlo en una estructura de datos
-    raw_recommendations = parse_recommendations(recommendations_text)
+    raw_recommendations = parse_recommendations(recommendations_text or "")
     
     # Añadir metadatos a cada recomendación
     recommendations = []
@@ -186,7 +186,8 @@ def classify_recommendation(recommendation: str) -> str:
         f"Responde SOLO con el nombre de la categoría, sin explicación."
     )
     
-    category = ask_gpt(prompt).strip()
+    # Sin respuesta del LLM se usa la categoría por defecto
+    category = (ask_gpt(prompt) or "").strip()
     
     # Verificar que la categoría es válida
     valid_categories = [
@@ -263,13 +264,12 @@ def save_recommendations(db, user_id: str, recommendations: List[str], analysis_
         recommendations: Lista de recomendaciones
         analysis_summary: Resumen del análisis que generó las recomendaciones
     """
-    # Guardar en los logs de conversación
+    # Guardar como traza interna (el usuario las recibe dentro del mensaje final)
     recommendations_text = "\n".join([f"- {rec}" for rec in recommendations])
-    db.save_conversation_message(
-        user_id=user_id,
-        role="assistant",
-        content=recommendations_text,
-        extra_data={"step": "recommender_node"}
+    db.save_agent_trace(
+        user_id,
+        "recommender_node",
+        recommendations_text
     )
     
     # Actualizar el estado del usuario con un resumen
@@ -0,0 +1,72 @@
+# zendell/benchmarks/common.py
+
+import contextlib
+import io
+import json
+import logging
+import subprocess
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+def percentile(values: List[float], q: float) -> float:
+    """Percentil q (0-1) por el método del rango más cercano, como el dispatcher."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def summarize(values: Iterable[float]) -> Dict[str, float]:
+    """Resumen estándar de una serie (latencias en ms, contadores por turno...)."""
+    values = list(values)
+    if not values:
+        return {"count": 0, "mean": 0.0, "p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 3),
+        "p50": round(percentile(values, 0.50), 3),
+        "p90": round(percentile(values, 0.90), 3),
+        "p99": round(percentile(values, 0.99), 3),
+        "max": round(max(values), 3)
+    }
+
+@contextlib.contextmanager
+def quiet(enabled: bool = True):
+    """Silencia los logs de los agentes durante la medición."""
+    if not enabled:
+        yield
+        return
+    previous = logging.root.manager.disable
+    logging.disable(logging.CRITICAL)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        logging.disable(previous)
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+def write_report(report: Dict[str, Any], path: Optional[str]) -> None:
+    """Añade revisión y fecha al informe y lo guarda como JSON (o lo imprime si no hay ruta)."""
+    report = {"revision": git_revision(), "created_at": datetime.utcnow().isoformat(), **report}
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if path:
+        with open(path, "w", encoding="utf-8") as output:
+            output.write(text + "\n")
+    print(text)
+
+def compare_reports(baseline: Dict[str, Any], current: Dict[str, Any], section: str, fields=("p50", "p90", "p99")) -> List[str]:
+    """Líneas con la variación porcentual de cada métrica de `section` respecto al informe base."""
+    lines = []
+    for name, stats in current.get(section, {}).items():
+        base = baseline.get(section, {}).get(name)
+        if not base:
+            continue
+        for field in fields:
+            if base.get(field):
+                delta = (stats[field] - base[field]) / base[field] * 100
+                lines.append(f"{section}.{name}.{field}: {base[field]} -> {stats[field]} ({delta:+.1f}%)")
+    return lines
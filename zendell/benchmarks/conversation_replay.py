@@ -0,0 +1,173 @@
+# zendell/benchmarks/conversation_replay.py
+"""
+Benchmark de conversación completa: reproduce guiones de varios usuarios contra
+orchestrator_flow (initial → ask_profile → ask_last_hour → clarifier_last_hour →
+ask_next_hour → clarifier_next_hour → final) y mide por etapa.
+
+Uso (desde zendell/):
+    python -m benchmarks.conversation_replay --users 20 --output replay.json
+    python -m benchmarks.conversation_replay --script conversaciones.json --db mongo --llm openai
+    python -m benchmarks.conversation_replay --compare replay.json
+
+El guion es una lista JSON de {"user_id": "...", "messages": ["...", ...]}; sin
+--script se genera uno sintético y determinista a partir de --seed.
+"""
+
+import argparse
+import json
+import random
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from config.settings import MONGO_URI
+from zendell.agents.orchestrator import orchestrator_flow
+from zendell.core.db import MongoDBManager
+from zendell.core import instrumentation
+from zendell.services import llm_provider, structured_output
+from zendell.services.fake_llm import FakeLLMProvider
+from benchmarks.common import summarize, quiet, write_report, compare_reports
+
+NAMES = ["Ana", "Luis", "Marta", "Jorge", "Lucía", "Pablo", "Sofía", "Diego"]
+PAST = ["revisando correos del trabajo", "programando una API", "estudiando inglés", "cocinando con mi hermana", "corriendo en el parque"]
+FUTURE = ["ir al gimnasio", "preparar la reunión de mañana", "leer un libro", "llamar a mi madre", "terminar el informe"]
+DETAILS = ["Fue con mi compañero Juan y me sentí bien", "Me llevó una hora y fue difícil", "Lo hice en casa, tranquilo", "Estaba cansado pero lo terminé"]
+
+def synthetic_script(users: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """Un ciclo completo por usuario: saludo, perfil, última hora, aclaración, próxima hora, aclaración, cierre."""
+    rng = random.Random(seed)
+    script = []
+    for index in range(users):
+        script.append({
+            "user_id": f"bench_user_{index}",
+            "messages": [
+                "Hola",
+                f"Me llamo {rng.choice(NAMES)}, trabajo como desarrollador, me gusta leer y quiero aprender",
+                f"En la última hora estuve {rng.choice(PAST)}",
+                rng.choice(DETAILS),
+                f"En la próxima hora voy a {rng.choice(FUTURE)}",
+                rng.choice(DETAILS),
+                "Gracias, eso es todo"
+            ]
+        })
+    return script
+
+def load_script(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as script_file:
+        return json.load(script_file)
+
+def build_db(backend: str, write_buffer: bool = False) -> MongoDBManager:
+    # Una URI en memoria nueva por ejecución para empezar siempre desde cero
+    uri = f"memory://replay-{time.time_ns()}" if backend == "memory" else MONGO_URI
+    return MongoDBManager(uri=uri, db_name="zendell_bench_db", write_buffer=write_buffer)
+
+def replay(
+    script: List[Dict[str, Any]],
+    db_manager: MongoDBManager,
+    workers: int = 1,
+    verbose: bool = False
+) -> Dict[str, Any]:
+    """
+    Reproduce el guion. Los mensajes de un usuario van en orden; con workers > 1
+    varios usuarios avanzan en paralelo, como con el dispatcher del Communicator.
+    """
+    # Las llamadas al LLM y las operaciones de base de datos se miden con core/instrumentation
+    instrumentation.instrument_db_manager(db_manager)
+    # Respuestas JSON válidas, reparadas e inválidas de esta ejecución
+    structured_output.reset_metrics()
+    turns: List[Dict[str, Any]] = []
+
+    def run_user(entry: Dict[str, Any]) -> List[Dict[str, Any]]:
+        user_id = entry["user_id"]
+        results = []
+        for message in entry["messages"]:
+            stage = db_manager.get_state(user_id).get("conversation_stage", "initial")
+            started = time.perf_counter()
+            # Igual que el Communicator: se guarda el mensaje y se ejecuta el turno;
+            # orchestrator_flow reutiliza esta traza, que así incluye el guardado y el vaciado
+            with instrumentation.turn(user_id, stage) as trace:
+                db_manager.save_conversation_message(user_id, "user", message, {"step": "user_input"})
+                orchestrator_flow(user_id, message, db_manager)
+                db_manager.flush_writes()
+            results.append({
+                "user_id": user_id,
+                "stage": stage,
+                "latency_ms": (time.perf_counter() - started) * 1000,
+                "llm_calls": len(trace.llm_calls),
+                "llm_tokens": trace.prompt_tokens + trace.completion_tokens,
+                "db_ops": trace.db_op_count
+            })
+        return results
+
+    tracemalloc.start()
+    memory_start = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    with quiet(not verbose):
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for results in pool.map(run_user, script):
+                turns.extend(results)
+    elapsed = time.perf_counter() - started
+    memory_end, memory_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stages: Dict[str, List[float]] = {}
+    for turn in turns:
+        stages.setdefault(turn["stage"], []).append(turn["latency_ms"])
+
+    return {
+        "turns": len(turns),
+        "users": len(script),
+        "elapsed_s": round(elapsed, 3),
+        "turns_per_second": round(len(turns) / elapsed, 2) if elapsed else 0.0,
+        "turn_latency_ms": summarize(turn["latency_ms"] for turn in turns),
+        "stage_latency_ms": {stage: summarize(values) for stage, values in stages.items()},
+        "llm_calls_per_turn": summarize(turn["llm_calls"] for turn in turns),
+        "llm_tokens_per_turn": summarize(turn["llm_tokens"] for turn in turns),
+        "db_ops_per_turn": summarize(turn["db_ops"] for turn in turns),
+        "structured_output": structured_output.get_metrics(),
+        "memory_kb": {
+            "start": round(memory_start / 1024, 1),
+            "end": round(memory_end / 1024, 1),
+            "peak": round(memory_peak / 1024, 1),
+            "growth": round((memory_end - memory_start) / 1024, 1),
+            "growth_per_turn": round((memory_end - memory_start) / 1024 / max(len(turns), 1), 2)
+        }
+    }
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Replay de conversaciones completas contra orchestrator_flow")
+    parser.add_argument("--script", help="Guion JSON grabado (por defecto, uno sintético)")
+    parser.add_argument("--users", type=int, default=10, help="Usuarios del guion sintético")
+    parser.add_argument("--workers", type=int, default=1, help="Usuarios procesados en paralelo")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", choices=["memory", "mongo"], default="memory", help="Backend de datos (mongo usa MONGO_URI)")
+    parser.add_argument("--write-buffer", action="store_true", help="Activa el buffer write-behind del manager")
+    parser.add_argument("--llm", default="fake", help="Proveedor de LLM registrado (fake, openai...)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latencia simulada del LLM fake")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="Fichero JSON donde guardar el informe")
+    parser.add_argument("--compare", help="Informe JSON anterior con el que comparar")
+    parser.add_argument("--verbose", action="store_true", help="No silenciar los logs de los agentes")
+    args = parser.parse_args(argv)
+
+    if args.llm == "fake":
+        llm_provider.set_provider(FakeLLMProvider(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                                                  failure_rate=args.failure_rate, seed=args.seed))
+    else:
+        llm_provider.set_provider(args.llm)
+
+    script = load_script(args.script) if args.script else synthetic_script(args.users, args.seed)
+    report = replay(script, build_db(args.db, args.write_buffer), workers=args.workers, verbose=args.verbose)
+    report["config"] = {key: value for key, value in vars(args).items() if key not in ("output", "compare", "verbose")}
+    write_report(report, args.output)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        for line in compare_reports(baseline, report, "stage_latency_ms"):
+            print(line)
+    return report
+
+if __name__ == "__main__":
+    main()
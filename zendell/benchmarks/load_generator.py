@@ -0,0 +1,216 @@
+# zendell/benchmarks/load_generator.py
+"""
+Generador de carga multiusuario para el camino de mensajes y los bucles proactivos.
+
+Simula N usuarios que escriben con llegadas de Poisson (--rate mensajes/s por usuario)
+mientras hourly_interaction_loop y maintenance_tasks_loop se ejecutan en el mismo
+event loop. Usa el Communicator real (dispatcher, debounce, executor) con un canal
+loopback, el LLM fake y la base de datos en memoria (o MONGO_URI con --db mongo).
+
+Para cada número de usuarios de --users informa del throughput, la latencia de cola
+(desde que llega el mensaje hasta que su turno termina), la profundidad de las colas,
+el lag del event loop, la espera por carril del planificador de LLM (interactive,
+proactive, maintenance) y el punto de saturación.
+
+Uso (desde zendell/):
+    python -m benchmarks.load_generator --users 1,5,10,25,50 --duration 10 --latency-ms 300
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from typing import Any, Dict, List, Optional
+from config.settings import MONGO_URI, ORCHESTRATOR_TIMEOUT_SECONDS, LLM_RPM_LIMIT, LLM_TPM_LIMIT, LLM_MAX_CONCURRENCY
+from zendell.agents.communicator import Communicator
+from zendell.core.async_db import AsyncMongoDBManager
+from zendell.core.db import MongoDBManager
+from zendell.core.executor import OrchestratorExecutor
+from zendell.main import hourly_interaction_loop, maintenance_tasks_loop
+from zendell.services import llm_provider, llm_scheduler
+from zendell.services.fake_llm import FakeLLMProvider
+from zendell.services.messaging_service import MessagingService, LoopbackChannel
+from benchmarks.common import summarize, quiet, write_report
+from benchmarks.conversation_replay import synthetic_script
+
+async def _sample_loop_lag(interval: float, samples: List[float], stop: asyncio.Event) -> None:
+    # Retraso con el que el event loop despierta respecto a lo pedido
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - expected) * 1000)
+
+async def _sample_queues(communicator: Communicator, interval: float, samples: List[Dict[str, int]], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        metrics = communicator.get_metrics()
+        samples.append({
+            "queued": metrics["queued_total"],
+            "running": metrics["running"],
+            "executor_in_flight": metrics["executor"]["in_flight"],
+            "pending_fragments": metrics["pending_fragments"]
+        })
+        await asyncio.sleep(interval)
+
+async def run_step(
+    users: int,
+    rate: float,
+    duration: float,
+    workers: int,
+    db_backend: str = "memory",
+    debounce_seconds: float = 0.0,
+    proactive_interval_minutes: float = 0.05,
+    maintenance_interval_hours: float = 0.01,
+    drain_timeout: float = 60.0,
+    seed: int = 0
+) -> Dict[str, Any]:
+    """Ejecuta una carga de `users` usuarios durante `duration` segundos y devuelve sus métricas."""
+    uri = f"memory://load-{time.time_ns()}" if db_backend == "memory" else MONGO_URI
+    db_manager = MongoDBManager(uri=uri, db_name="zendell_load_db")
+    executor = OrchestratorExecutor(workers, ORCHESTRATOR_TIMEOUT_SECONDS)
+    async_db_manager = AsyncMongoDBManager(uri=uri, db_name="zendell_load_db", sync_manager=db_manager, executor=executor)
+    channel = LoopbackChannel(seed=seed)
+    communicator = Communicator(
+        db_manager,
+        max_concurrent_users=workers,
+        debounce_seconds=debounce_seconds,
+        executor=executor,
+        messaging=MessagingService([channel]),
+        async_db_manager=async_db_manager
+    )
+
+    rng = random.Random(seed)
+    scripts = synthetic_script(users, seed)
+    latencies: List[float] = []
+    errors = 0
+    lag_samples: List[float] = []
+    queue_samples: List[Dict[str, int]] = []
+    stop = asyncio.Event()
+
+    async def timed_message(text: str, user_id: str) -> None:
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            await communicator.on_user_message(text, user_id)
+            latencies.append((time.perf_counter() - started) * 1000)
+        except Exception:
+            errors += 1
+
+    async def simulate_user(entry: Dict[str, Any], deadline: float, sent: List[asyncio.Task]) -> None:
+        index = 0
+        while True:
+            # Llegadas de Poisson: tiempos entre mensajes exponenciales
+            await asyncio.sleep(rng.expovariate(rate) if rate > 0 else duration)
+            if time.perf_counter() >= deadline:
+                return
+            text = entry["messages"][index % len(entry["messages"])]
+            index += 1
+            sent.append(asyncio.create_task(timed_message(text, entry["user_id"])))
+
+    background = [
+        asyncio.create_task(hourly_interaction_loop(communicator, proactive_interval_minutes)),
+        asyncio.create_task(maintenance_tasks_loop(db_manager, async_db_manager, executor, maintenance_interval_hours)),
+        asyncio.create_task(_sample_loop_lag(0.05, lag_samples, stop)),
+        asyncio.create_task(_sample_queues(communicator, 0.25, queue_samples, stop))
+    ]
+
+    sent: List[asyncio.Task] = []
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(simulate_user(entry, deadline, sent) for entry in scripts))
+    # Se espera a que terminen los turnos ya enviados (acotado por drain_timeout)
+    done, pending = await asyncio.wait(sent, timeout=drain_timeout) if sent else (set(), set())
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    for task in background + list(pending):
+        task.cancel()
+    await asyncio.gather(*background, *pending, return_exceptions=True)
+    await communicator.messaging.drain()
+    metrics = communicator.get_metrics()
+    executor.shutdown()
+
+    return {
+        "users": users,
+        "offered_rate": round(users * rate, 3),
+        "arrival_rate": round(len(sent) / duration, 3),
+        "messages_sent": len(sent),
+        "messages_completed": len(latencies),
+        "messages_unfinished": len(pending),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_second": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        "latency_ms": summarize(latencies),
+        "event_loop_lag_ms": summarize(lag_samples),
+        "queue_depth": summarize(sample["queued"] for sample in queue_samples),
+        "executor_in_flight": summarize(sample["executor_in_flight"] for sample in queue_samples),
+        "dispatcher_wait_p95_ms": round(metrics["wait_time_p95_ms"], 3),
+        "executor_timeouts": metrics["executor"]["timeouts"],
+        "replies_delivered": metrics["messaging"].get("delivered", 0),
+        "llm_lanes": metrics["llm_lanes"]
+    }
+
+def find_saturation(steps: List[Dict[str, Any]], slo_p99_ms: float) -> Optional[int]:
+    """
+    Primer número de usuarios en el que el sistema deja de seguir la carga:
+    procesa menos del 90% de lo que llega, deja mensajes sin terminar o supera el SLO de p99.
+    """
+    for step in steps:
+        arrivals = step["arrival_rate"]
+        behind = arrivals and step["throughput_per_second"] < 0.9 * arrivals
+        if behind or step["messages_unfinished"] or step["latency_ms"]["p99"] > slo_p99_ms:
+            return step["users"]
+    return None
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Generador de carga multiusuario para Zendell")
+    parser.add_argument("--users", default="1,5,10,25", help="Números de usuarios a probar, separados por comas")
+    parser.add_argument("--rate", type=float, default=0.2, help="Mensajes por segundo de cada usuario")
+    parser.add_argument("--duration", type=float, default=10.0, help="Segundos de carga por paso")
+    parser.add_argument("--workers", type=int, default=8, help="Usuarios en paralelo y hilos del executor")
+    parser.add_argument("--debounce", type=float, default=0.0, help="Ventana de debounce del Communicator (s)")
+    parser.add_argument("--db", choices=["memory", "mongo"], default="memory")
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Latencia media del LLM fake")
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--proactive-minutes", type=float, default=0.05, help="Intervalo de hourly_interaction_loop")
+    parser.add_argument("--maintenance-hours", type=float, default=0.01, help="Intervalo de maintenance_tasks_loop")
+    parser.add_argument("--llm-rpm", type=float, default=LLM_RPM_LIMIT, help="Límite de peticiones por minuto del planificador (0 = sin límite)")
+    parser.add_argument("--llm-tpm", type=float, default=LLM_TPM_LIMIT, help="Límite de tokens por minuto del planificador (0 = sin límite)")
+    parser.add_argument("--llm-concurrency", type=int, default=LLM_MAX_CONCURRENCY, help="Llamadas al LLM simultáneas")
+    parser.add_argument("--slo-p99-ms", type=float, default=10000.0, help="Latencia p99 máxima aceptable")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Fichero JSON donde guardar el informe")
+    parser.add_argument("--verbose", action="store_true", help="No silenciar los logs de los agentes")
+    args = parser.parse_args(argv)
+
+    llm_provider.set_provider(FakeLLMProvider(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                                              failure_rate=args.failure_rate, seed=args.seed))
+    steps = []
+    for users in [int(value) for value in args.users.split(",") if value.strip()]:
+        # Planificador nuevo por paso: las esperas por carril son las de ese paso
+        llm_scheduler.scheduler = llm_scheduler.LLMScheduler(args.llm_concurrency, args.llm_rpm, args.llm_tpm)
+        with quiet(not args.verbose):
+            step = asyncio.run(run_step(
+                users, args.rate, args.duration, args.workers,
+                db_backend=args.db,
+                debounce_seconds=args.debounce,
+                proactive_interval_minutes=args.proactive_minutes,
+                maintenance_interval_hours=args.maintenance_hours,
+                seed=args.seed
+            ))
+        steps.append(step)
+        print(f"[LOAD] users={users} throughput={step['throughput_per_second']}/s "
+              f"p99={step['latency_ms']['p99']}ms lag_p99={step['event_loop_lag_ms']['p99']}ms "
+              f"queue_max={step['queue_depth']['max']} "
+              f"interactive_wait_max={step['llm_lanes']['interactive']['max_wait_ms']}ms")
+
+    report = {
+        "steps": steps,
+        "saturation_users": find_saturation(steps, args.slo_p99_ms),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "verbose")}
+    }
+    write_report(report, args.output)
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+# zendell/core/api.py
+
+import asyncio
+import json
+from typing import Any, Dict, List, Optional
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from config.settings import API_MAX_BATCH_SIZE
+from zendell.core.async_db import AsyncMongoDBManager
+from zendell.core import instrumentation
+from zendell.services.messaging_service import MessagingChannel, ReplyRoute, current_receipt
+
+# Nombre del canal de mensajería por el que se entregan las respuestas a clientes HTTP
+API_CHANNEL = "api"
+
+class UserMessage(BaseModel):
+    user_id: str
+    text: str = Field(min_length=1)
+
+class MessageBatch(BaseModel):
+    messages: List[UserMessage]
+
+class InteractionRequest(BaseModel):
+    hours_between_interactions: float = 1
+
+class ApiChannel(MessagingChannel):
+    """
+    Canal de los clientes HTTP. No guarda las respuestas: cada petición las recoge de su
+    ReplyRoute, así que peticiones simultáneas del mismo usuario no se mezclan.
+    Admite streaming: los fragmentos se publican en la cola de eventos de la ruta (SSE).
+    """
+    name = API_CHANNEL
+    supports_streaming = True
+    # Sin red: no hace falta limitar las entregas simultáneas como en Discord
+    max_concurrency = 64
+
+    @staticmethod
+    def _publish(event: str, data: str) -> None:
+        receipt = current_receipt.get()
+        for route in receipt.routes if receipt is not None else ():
+            if route.events is not None:
+                route.events.put_nowait((event, data))
+
+    async def send(self, user_id: str, text: str) -> Any:
+        self._publish("reply", text)
+        return text
+
+    async def send_stream(self, user_id: str, stream) -> Any:
+        async for token in stream:
+            self._publish("token", token)
+        final = stream.final_text or ""
+        self._publish("reply", final)
+        return final
+
+def create_app(communicator, async_db_manager=None) -> FastAPI:
+    """
+    Crea la API HTTP de Zendell sobre un Communicator ya inicializado.
+
+    - Las escrituras pasan por el Communicator (buzón por usuario, debounce, executor),
+      igual que los mensajes de Discord.
+    - Las lecturas (respuestas, estadísticas) usan AsyncMongoDBManager (Motor) y no
+      bloquean el event loop.
+    - Las respuestas a cada petición se entregan por el canal "api" y se devuelven a esa
+      petición; el canal fijado para el usuario (Discord) no cambia.
+    """
+    app = FastAPI(title="Zendell API")
+    if API_CHANNEL not in communicator.messaging.channels:
+        communicator.messaging.register_channel(ApiChannel())
+    state = {"db": async_db_manager or communicator.async_db_manager}
+
+    def get_db() -> AsyncMongoDBManager:
+        if state["db"] is None:
+            state["db"] = AsyncMongoDBManager(sync_manager=communicator.db_manager, executor=communicator.executor)
+        return state["db"]
+
+    async def process_message(message: UserMessage, events: Optional[asyncio.Queue] = None) -> Dict[str, Any]:
+        route = ReplyRoute(API_CHANNEL, events=events)
+        await communicator.on_user_message(message.text, message.user_id, route=route)
+        return {"user_id": message.user_id, "replies": await route.replies()}
+
+    @app.post("/messages")
+    async def post_message(message: UserMessage) -> Dict[str, Any]:
+        """Procesa un mensaje de usuario y devuelve las respuestas generadas."""
+        return await process_message(message)
+
+    @app.post("/messages/stream")
+    async def post_message_stream(message: UserMessage) -> StreamingResponse:
+        """
+        Procesa un mensaje y devuelve la respuesta como Server-Sent Events:
+        eventos "token" con cada fragmento, "reply" con el texto completo y "done" al terminar.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def run():
+            try:
+                await process_message(message, events=queue)
+            finally:
+                queue.put_nowait(("done", ""))
+
+        async def events():
+            task = asyncio.create_task(run())
+            try:
+                while True:
+                    event, data = await queue.get()
+                    yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+                    if event == "done":
+                        break
+            finally:
+                await task
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/messages/batch")
+    async def post_message_batch(batch: MessageBatch) -> Dict[str, Any]:
+        """
+        Procesa muchos mensajes en una sola petición. Los usuarios se procesan en
+        paralelo; los mensajes de un mismo usuario, en el orden recibido.
+        """
+        if len(batch.messages) > API_MAX_BATCH_SIZE:
+            raise HTTPException(status_code=413, detail=f"Máximo {API_MAX_BATCH_SIZE} mensajes por lote")
+
+        by_user: Dict[str, List[UserMessage]] = {}
+        for message in batch.messages:
+            by_user.setdefault(message.user_id, []).append(message)
+
+        async def process_user(messages: List[UserMessage]) -> Dict[str, Any]:
+            route = ReplyRoute(API_CHANNEL)
+            await asyncio.gather(*(communicator.on_user_message(m.text, m.user_id, route=route) for m in messages))
+            return {"user_id": messages[0].user_id, "replies": await route.replies()}
+
+        results = await asyncio.gather(*(process_user(msgs) for msgs in by_user.values()))
+        return {"results": list(results)}
+
+    @app.get("/users/{user_id}/replies")
+    async def get_replies(user_id: str, since: Optional[str] = None, limit: int = 20) -> Dict[str, Any]:
+        """Devuelve las últimas respuestas del asistente guardadas para el usuario."""
+        replies = await get_db().get_assistant_replies(user_id, since=since, limit=limit)
+        return {"user_id": user_id, "replies": replies}
+
+    @app.post("/users/{user_id}/interactions")
+    async def trigger_interaction(user_id: str, request: InteractionRequest) -> Dict[str, Any]:
+        """Lanza una interacción proactiva y devuelve el mensaje enviado, si lo hubo."""
+        route = ReplyRoute(API_CHANNEL)
+        await communicator.trigger_interaction(user_id, request.hours_between_interactions, route=route)
+        return {"user_id": user_id, "replies": await route.replies()}
+
+    @app.get("/users/{user_id}/statistics")
+    async def get_statistics(user_id: str) -> Dict[str, Any]:
+        """Estadísticas de interacción del usuario."""
+        statistics = await get_db().get_user_statistics(user_id)
+        if not statistics["total_activities"] and not statistics["total_conversations"]:
+            raise HTTPException(status_code=404, detail="Usuario sin datos")
+        return {"user_id": user_id, **statistics}
+
+    @app.get("/metrics")
+    async def get_metrics() -> Dict[str, Any]:
+        """Métricas internas: colas por usuario, executor y entregas."""
+        return communicator.get_metrics()
+
+    @app.get("/metrics/prometheus", response_class=PlainTextResponse)
+    async def get_prometheus_metrics() -> PlainTextResponse:
+        """Métricas por turno (LLM, tokens, base de datos, etapas) en formato de texto de Prometheus."""
+        return PlainTextResponse(instrumentation.registry.to_prometheus(), media_type="text/plain; version=0.0.4")
+
+    return app
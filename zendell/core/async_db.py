@@ -0,0 +1,263 @@
+# zendell/core/async_db.py
+
+import asyncio
+import random
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING
+from config.settings import MONGO_URI, MONGO_DB_NAME, AGENT_TRACES_SAMPLE_RATE
+from zendell.core.db import DIALOGUE_ROLES, ACTIVITY_SUMMARY_PROJECTION, DIALOGUE_PROJECTION, apply_state_defaults
+from zendell.core.db_models import UserProfile, ActivitySummary, DialogueMessage
+from zendell.core.mongo_clients import get_motor_client
+from zendell.core.write_buffer import WriteBuffer
+
+class AsyncMongoDBManager:
+    """
+    Variante asíncrona de MongoDBManager sobre Motor, con la misma superficie de métodos.
+
+    - Las operaciones de lectura/escritura frecuentes en rutas asíncronas (estado,
+      conversaciones, trazas, actividades, estadísticas) usan Motor directamente y
+      no bloquean el event loop.
+    - El resto de métodos (los que llaman al LLM o encadenan mucha lógica) se delegan
+      al MongoDBManager síncrono en el executor; se invocan igual, con await.
+    """
+
+    def __init__(self, uri: str = MONGO_URI, db_name: str = MONGO_DB_NAME, sync_manager=None, executor=None):
+        # Cliente Motor compartido del proceso (pool configurado en settings)
+        self.client = get_motor_client(uri)
+        self.db = self.client[db_name]
+        self.sync_manager = sync_manager
+        self.executor = executor
+
+        # Colecciones principales
+        self.user_profiles_coll = self.db["user_profiles"]
+        self.user_states_coll = self.db["user_states"]
+        self.activities_coll = self.db["activities"]
+        self.conversations_coll = self.db["conversations"]
+        self.entities_coll = self.db["entities"]
+        self.memories_coll = self.db["system_memories"]
+        self.agent_traces_coll = self.db["agent_traces"]
+
+    def __getattr__(self, name: str):
+        # Delegación al manager síncrono para los métodos sin versión nativa en Motor
+        sync_manager = self.__dict__.get("sync_manager")
+        if sync_manager is None or name.startswith("__"):
+            raise AttributeError(name)
+        method = getattr(sync_manager, name)
+        if not callable(method):
+            return method
+
+        async def delegated(*args, **kwargs):
+            return await self._run_sync(method, *args, **kwargs)
+        return delegated
+
+    async def _run_sync(self, func, *args, **kwargs):
+        if self.executor is not None:
+            return await self.executor.run(func, *args, timeout=0, **kwargs)
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+    def _buffered(self) -> bool:
+        # Con el buffer write-behind activo, las escrituras de estado/conversación y sus
+        # lecturas pasan por el manager síncrono para ver las operaciones pendientes
+        return isinstance(getattr(self.sync_manager, "write_buffer", None), WriteBuffer)
+
+    # ======== MÉTODOS PARA PERFILES DE USUARIO ========
+
+    async def get_user_profile(self, user_id: str) -> UserProfile:
+        """Obtiene el perfil completo del usuario."""
+        doc = await self.user_profiles_coll.find_one({"user_id": user_id})
+        if not doc:
+            profile = UserProfile(user_id=user_id)
+            await self.user_profiles_coll.insert_one(profile.to_dict())
+            return profile
+        return UserProfile.from_dict(doc)
+
+    async def update_user_profile(self, profile: UserProfile) -> None:
+        """Actualiza el perfil completo del usuario."""
+        profile.last_updated = datetime.utcnow().isoformat()
+        await self.user_profiles_coll.update_one(
+            {"user_id": profile.user_id},
+            {"$set": profile.to_dict()},
+            upsert=True
+        )
+
+    # ======== MÉTODOS PARA ESTADO DEL USUARIO ========
+
+    async def get_user_ids(self) -> List[str]:
+        """Devuelve los user_id con estado guardado."""
+        return [user_id for user_id in await self.user_states_coll.distinct("user_id") if user_id]
+
+    async def get_state(self, user_id: str) -> Dict[str, Any]:
+        """Obtiene el estado actual del usuario (lectura pura, defaults en memoria)."""
+        if self._buffered():
+            return await self._run_sync(self.sync_manager.get_state, user_id)
+        doc = await self.user_states_coll.find_one({"user_id": user_id}, {"_id": 0})
+        return apply_state_defaults(doc or {}, user_id)
+
+    async def save_state(self, user_id: str, state: Dict[str, Any]) -> None:
+        """Guarda el estado actual del usuario."""
+        if self._buffered():
+            return await self._run_sync(self.sync_manager.save_state, user_id, state)
+        await self.user_states_coll.update_one({"user_id": user_id}, {"$set": state}, upsert=True)
+
+    async def update_conversation_stage(self, user_id: str, stage: str) -> None:
+        """Actualiza la etapa de conversación del usuario."""
+        if self._buffered():
+            return await self._run_sync(self.sync_manager.update_conversation_stage, user_id, stage)
+        await self.user_states_coll.update_one(
+            {"user_id": user_id},
+            {"$set": {"conversation_stage": stage}},
+            upsert=True
+        )
+
+    async def add_to_short_term_info(self, user_id: str, info: str) -> None:
+        """Añade información al contexto de corto plazo."""
+        if self._buffered():
+            return await self._run_sync(self.sync_manager.add_to_short_term_info, user_id, info)
+        await self.user_states_coll.update_one(
+            {"user_id": user_id},
+            {"$push": {"short_term_info": {"$each": [info], "$slice": -20}}},
+            upsert=True
+        )
+
+    # ======== MÉTODOS PARA ACTIVIDADES ========
+
+    async def get_activity(self, activity_id: str) -> Optional[Dict[str, Any]]:
+        """Obtiene una actividad por su ID."""
+        return await self.activities_coll.find_one({"activity_id": activity_id})
+
+    async def get_recent_activities(self, user_id: str, time_context: Optional[str] = None, categories: Optional[List[str]] = None, limit: int = 10,
+                                    projection: Optional[Dict[str, int]] = None) -> List[Dict[str, Any]]:
+        """Obtiene actividades recientes del usuario con filtros y proyección opcionales."""
+        query = {"user_id": user_id}
+        if time_context:
+            query["time_context"] = time_context
+        if categories:
+            query["category"] = {"$in": categories}
+        cursor = self.activities_coll.find(query, projection, sort=[("timestamp", DESCENDING)], limit=limit)
+        return await cursor.to_list(length=limit)
+
+    async def get_activity_summaries(self, user_id: str, time_context: Optional[str] = None, limit: int = 10) -> List[ActivitySummary]:
+        """Vista ligera de las actividades recientes."""
+        return await self.get_recent_activities(user_id, time_context=time_context, limit=limit, projection=ACTIVITY_SUMMARY_PROJECTION)
+
+    # ======== MÉTODOS PARA CONVERSACIONES ========
+
+    async def save_conversation_message(self, user_id: str, role: str, content: str, extra_data: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Guarda un mensaje de la conversación y devuelve su ID.
+        La extracción de entidades (usa el LLM) se ejecuta en el executor.
+        """
+        if self._buffered():
+            return await self._run_sync(self.sync_manager.save_conversation_message, user_id, role, content, extra_data)
+        if role not in DIALOGUE_ROLES:
+            source = (extra_data or {}).get("step", role)
+            return await self.save_agent_trace(user_id, source, content, extra_data)
+
+        message_id = str(ObjectId())
+        message_doc = {
+            "message_id": message_id,
+            "user_id": user_id,
+            "role": role,
+            "content": content,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+        if extra_data:
+            message_doc.update(extra_data)
+
+        if role == "user" and content and self.sync_manager is not None:
+            message_doc["entities_extracted"] = await self._run_sync(
+                self.sync_manager._extract_entities_from_message, user_id, content
+            )
+
+        await self.conversations_coll.insert_one(message_doc)
+
+        short_info = f"[{role.upper()}] {content[:100]}" + ("..." if len(content) > 100 else "")
+        await self.add_to_short_term_info(user_id, short_info)
+        return message_id
+
+    async def get_user_conversation(self, user_id: str, limit: int = 20, projection: Optional[Dict[str, int]] = None) -> List[Dict[str, Any]]:
+        """Obtiene los mensajes recientes de un usuario en orden cronológico."""
+        if self._buffered():
+            return await self._run_sync(self.sync_manager.get_user_conversation, user_id, limit, projection)
+        cursor = self.conversations_coll.find(
+            {"user_id": user_id, "role": {"$in": DIALOGUE_ROLES}},
+            projection,
+            sort=[("timestamp", DESCENDING)],
+            limit=limit
+        )
+        return (await cursor.to_list(length=limit))[::-1]
+
+    async def get_dialogue(self, user_id: str, limit: int = 20) -> List[DialogueMessage]:
+        """Vista ligera del diálogo reciente (rol, contenido y fecha)."""
+        return await self.get_user_conversation(user_id, limit, projection=DIALOGUE_PROJECTION)
+
+    async def get_assistant_replies(self, user_id: str, since: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """Obtiene las últimas respuestas del asistente (contenido y fecha) en orden cronológico."""
+        query: Dict[str, Any] = {"user_id": user_id, "role": "assistant"}
+        if since:
+            query["timestamp"] = {"$gt": since}
+        cursor = self.conversations_coll.find(
+            query, {"_id": 0, "content": 1, "timestamp": 1},
+            sort=[("timestamp", DESCENDING)],
+            limit=limit
+        )
+        return (await cursor.to_list(length=limit))[::-1]
+
+    async def save_agent_trace(self, user_id: str, source: str, content: str, extra_data: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """Guarda un registro interno de un agente (mismo muestreo que la versión síncrona)."""
+        if self._buffered():
+            return await self._run_sync(self.sync_manager.save_agent_trace, user_id, source, content, extra_data)
+        if AGENT_TRACES_SAMPLE_RATE < 1.0 and random.random() >= AGENT_TRACES_SAMPLE_RATE:
+            return None
+
+        trace_id = str(ObjectId())
+        # extra_data va primero: sus claves no pueden pisar los campos propios de la traza
+        trace_doc = {
+            **(extra_data or {}),
+            "trace_id": trace_id,
+            "user_id": user_id,
+            "source": source,
+            "content": content,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+        await self.agent_traces_coll.insert_one(trace_doc)
+        return trace_id
+
+    async def get_agent_traces(self, user_id: str, source: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """Obtiene las trazas internas más recientes de un usuario."""
+        query = {"user_id": user_id}
+        if source:
+            query["source"] = source
+        cursor = self.agent_traces_coll.find(query, sort=[("timestamp", DESCENDING)], limit=limit)
+        return (await cursor.to_list(length=limit))[::-1]
+
+    # ======== ESTADÍSTICAS ========
+
+    async def get_user_statistics(self, user_id: str) -> Dict[str, Any]:
+        """Obtiene estadísticas sobre la interacción con el usuario (consultas en paralelo)."""
+        total_activities, total_conversations, profile, first_interaction, last_interaction = await asyncio.gather(
+            self.activities_coll.count_documents({"user_id": user_id}),
+            self.conversations_coll.count_documents({"user_id": user_id}),
+            self.get_user_profile(user_id),
+            self.conversations_coll.find_one({"user_id": user_id}, {"_id": 0, "timestamp": 1}, sort=[("timestamp", ASCENDING)]),
+            self.conversations_coll.find_one({"user_id": user_id}, {"_id": 0, "timestamp": 1}, sort=[("timestamp", DESCENDING)])
+        )
+        total_entities = sum(len(entity_ids) for entity_ids in profile.known_entities.values())
+
+        first_date = first_interaction["timestamp"] if first_interaction else datetime.utcnow().isoformat()
+        last_date = last_interaction["timestamp"] if last_interaction else datetime.utcnow().isoformat()
+        try:
+            relationship_days = (datetime.fromisoformat(last_date) - datetime.fromisoformat(first_date)).days
+        except ValueError:
+            relationship_days = 0
+
+        return {
+            "total_activities": total_activities,
+            "total_conversations": total_conversations,
+            "total_entities_known": total_entities,
+            "first_interaction": first_date,
+            "last_interaction": last_date,
+            "days_of_relationship": relationship_days
+        }
@@ -1,7 +1,7 @@
 # zendell/core/db_models.py
 
 from datetime import datetime
-from typing import Dict, List, Any, Optional, Union
+from typing import Dict, List, Any, Optional, Union, TypedDict
 from dataclasses import dataclass, field, asdict
 
 def current_datetime() -> str:
@@ -172,6 +172,14 @@ class UserProfile(BaseModel):
     life_areas: Dict[str, Dict[str, Any]] = field(default_factory=dict)
     known_entities: Dict[str, List[str]] = field(default_factory=dict)  # {entity_type: [entity_ids]}
 
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]):
+        """Crea el perfil reconstruyendo general_info como GeneralInfo (en MongoDB se guarda como diccionario)."""
+        profile = super().from_dict(data)
+        if isinstance(profile.general_info, dict):
+            profile.general_info = GeneralInfo.from_dict(profile.general_info)
+        return profile
+
 @dataclass
 class SystemMemory(BaseModel):
     """Memoria del sistema."""
@@ -183,4 +191,26 @@ class SystemMemory(BaseModel):
     last_accessed: str = field(default_factory=current_datetime)
     access_count: int = 0
     related_entities: List[Dict[str, Any]] = field(default_factory=list)
-    related_activities: List[Dict[str, Any]] = field(default_factory=list)
\ No newline at end of file
+    related_activities: List[Dict[str, Any]] = field(default_factory=list)
+# ======== VISTAS LIGERAS (resultados de consultas con proyección) ========
+
+class ActivitySummary(TypedDict, total=False):
+    """Campos de una actividad que usan los listados y contextos (ACTIVITY_SUMMARY_PROJECTION)."""
+    activity_id: str
+    title: str
+    category: str
+    time_context: str
+    timestamp: str
+
+class DialogueMessage(TypedDict, total=False):
+    """Turno de diálogo sin metadatos (DIALOGUE_PROJECTION)."""
+    role: str
+    content: str
+    timestamp: str
+
+class EntitySummary(TypedDict, total=False):
+    """Identificación básica de una entidad (ENTITY_SUMMARY_PROJECTION)."""
+    entity_id: str
+    name: str
+    type: str
+    importance: int
@@ -0,0 +1,113 @@
+# zendell/core/dispatcher.py
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Tuple
+
+class UserDispatcher:
+    """
+    Ejecutor por usuario (modelo actor/buzón) para el trabajo de los agentes.
+
+    - Cada usuario tiene su propio buzón: sus mensajes se procesan estrictamente
+      en orden, nunca dos a la vez, evitando que dos ejecuciones del orquestador
+      mezclen sus get_state/save_state.
+    - Usuarios distintos se procesan en paralelo, limitados por un semáforo global
+      (max_concurrent_users) que actúa como pool de trabajadores.
+    - Expone métricas de profundidad de cola y tiempo de espera.
+    """
+
+    def __init__(self, max_concurrent_users: int = 8, wait_samples: int = 1000):
+        self.max_concurrent_users = max_concurrent_users
+        self._mailboxes: Dict[str, Deque[Tuple[Callable[..., Awaitable[Any]], tuple, asyncio.Future, float]]] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._semaphore = None
+        self._running = 0
+        self._processed = 0
+        self._failed = 0
+        self._wait_times: Deque[float] = deque(maxlen=wait_samples)
+        self._max_wait = 0.0
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Se crea de forma perezosa para enlazarlo al event loop en ejecución
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent_users)
+        return self._semaphore
+
+    async def submit(self, user_id: str, func: Callable[..., Awaitable[Any]], *args) -> Any:
+        """
+        Encola una corrutina en el buzón del usuario y espera su resultado.
+
+        Args:
+            user_id: Usuario al que pertenece el trabajo (define el orden)
+            func: Función asíncrona a ejecutar
+            *args: Argumentos para func
+
+        Returns:
+            Any: El valor devuelto por func (o propaga su excepción)
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        mailbox = self._mailboxes.setdefault(user_id, deque())
+        mailbox.append((func, args, future, time.monotonic()))
+
+        if user_id not in self._workers:
+            self._workers[user_id] = loop.create_task(self._drain(user_id))
+
+        return await future
+
+    async def _drain(self, user_id: str) -> None:
+        """Procesa en orden el buzón de un usuario hasta vaciarlo."""
+        mailbox = self._mailboxes[user_id]
+        semaphore = self._get_semaphore()
+        try:
+            while mailbox:
+                func, args, future, enqueued_at = mailbox.popleft()
+                async with semaphore:
+                    wait = time.monotonic() - enqueued_at
+                    self._wait_times.append(wait)
+                    self._max_wait = max(self._max_wait, wait)
+                    self._running += 1
+                    try:
+                        result = await func(*args)
+                        if not future.done():
+                            future.set_result(result)
+                        self._processed += 1
+                    except Exception as e:
+                        self._failed += 1
+                        if not future.done():
+                            future.set_exception(e)
+                    finally:
+                        self._running -= 1
+        finally:
+            # Sin await entre la comprobación del buzón y la limpieza: no hay carreras con submit()
+            self._workers.pop(user_id, None)
+            if not mailbox:
+                self._mailboxes.pop(user_id, None)
+
+    def queue_depth(self, user_id: str) -> int:
+        """Número de trabajos pendientes (sin empezar) para un usuario."""
+        return len(self._mailboxes.get(user_id, ()))
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Devuelve métricas de colas y tiempos de espera del dispatcher."""
+        waits = sorted(self._wait_times)
+        depths = {user_id: len(mailbox) for user_id, mailbox in self._mailboxes.items() if mailbox}
+
+        def percentile(p: float) -> float:
+            if not waits:
+                return 0.0
+            return waits[min(len(waits) - 1, int(p * len(waits)))]
+
+        return {
+            "max_concurrent_users": self.max_concurrent_users,
+            "active_users": len(self._workers),
+            "running": self._running,
+            "queued_total": sum(depths.values()),
+            "queue_depth": depths,
+            "processed": self._processed,
+            "failed": self._failed,
+            "wait_time_avg_ms": (sum(waits) / len(waits) * 1000) if waits else 0.0,
+            "wait_time_p95_ms": percentile(0.95) * 1000,
+            "wait_time_max_ms": self._max_wait * 1000
+        }
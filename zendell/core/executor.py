@@ -0,0 +1,146 @@
+# zendell/core/executor.py
+
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+# Señal de cancelación del trabajo en curso en este hilo (la fija OrchestratorExecutor.run)
+_cancel_event: contextvars.ContextVar[Optional[threading.Event]] = contextvars.ContextVar("executor_cancel_event", default=None)
+
+class WorkCancelled(BaseException):
+    """
+    El executor abandonó el trabajo (timeout o cancelación). Hereda de BaseException, como
+    asyncio.CancelledError, para que los `except Exception` de los agentes no la absorban.
+    """
+
+def cancel_requested() -> bool:
+    """True si el trabajo que se ejecuta en este hilo ya no tiene quien espere su resultado."""
+    event = _cancel_event.get()
+    return event is not None and event.is_set()
+
+def check_cancelled() -> None:
+    """Punto de cancelación cooperativa: lanza WorkCancelled si el trabajo se abandonó."""
+    if cancel_requested():
+        raise WorkCancelled()
+
+class WorkTimeout(asyncio.TimeoutError):
+    """
+    Timeout de OrchestratorExecutor.run. El hilo sigue hasta su siguiente punto de
+    cancelación; wait_finished() espera a que termine de verdad.
+    """
+
+    def __init__(self, future: asyncio.Future):
+        super().__init__()
+        self._future = future
+
+    async def wait_finished(self) -> None:
+        """Espera al hilo abandonado; su resultado o error se descartan."""
+        await asyncio.wait([self._future])
+
+class OrchestratorExecutor:
+    """
+    Pool de hilos dedicado para el trabajo síncrono de los agentes.
+
+    orchestrator_flow, goal_finder_node y las llamadas a pymongo/OpenAI son bloqueantes;
+    ejecutarlos directamente en el event loop congela los heartbeats de Discord y al
+    resto de handlers. Este executor los ejecuta en hilos y devuelve resultados
+    awaitables, con timeout opcional por llamada.
+
+    Cancelación: si se agota el timeout o se cancela la tarea que espera, el trabajo
+    aún no iniciado se descarta y el que ya está en un hilo recibe la señal de
+    cancelación: check_cancelled() lanza WorkCancelled en su siguiente punto de control
+    (entre etapas del orquestador y antes de cada llamada al LLM). Tras un timeout se
+    lanza WorkTimeout, con el que el llamador puede esperar a que el hilo termine antes
+    de dejar paso al siguiente trabajo del mismo usuario.
+    """
+
+    def __init__(self, max_workers: int = 8, default_timeout: Optional[float] = None):
+        self.max_workers = max_workers
+        self.default_timeout = default_timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="zendell-worker")
+        self._in_flight = 0
+        self._completed = 0
+        self._timeouts = 0
+        self._cancelled = 0
+        self._orphaned = 0
+        self._total_time = 0.0
+
+    async def run(self, func: Callable[..., Any], *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """
+        Ejecuta func(*args, **kwargs) en el pool y espera su resultado.
+
+        Args:
+            func: Función síncrona a ejecutar
+            timeout: Segundos máximos de espera (None usa default_timeout; 0 sin límite)
+
+        Returns:
+            Any: El valor devuelto por func
+
+        Raises:
+            WorkTimeout: Si se supera el timeout (subclase de asyncio.TimeoutError)
+        """
+        loop = asyncio.get_running_loop()
+        timeout = self.default_timeout if timeout is None else timeout
+        # Se copia el contexto para que las ContextVar del llamador lleguen al hilo
+        context = contextvars.copy_context()
+        cancel_event = threading.Event()
+        context.run(_cancel_event.set, cancel_event)
+        future = loop.run_in_executor(self._pool, functools.partial(context.run, func, *args, **kwargs))
+        start = time.monotonic()
+        self._in_flight += 1
+        try:
+            if timeout:
+                # shield: el timeout no debe dar por terminado el futuro mientras el hilo sigue
+                result = await asyncio.wait_for(asyncio.shield(future), timeout)
+            else:
+                result = await future
+            self._completed += 1
+            return result
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            self._abandon(future, cancel_event)
+            raise WorkTimeout(future) from None
+        except asyncio.CancelledError:
+            self._cancelled += 1
+            self._abandon(future, cancel_event)
+            future.cancel()
+            raise
+        finally:
+            self._in_flight -= 1
+            self._total_time += time.monotonic() - start
+
+    def _abandon(self, future: asyncio.Future, cancel_event: threading.Event) -> None:
+        # Se avisa al hilo y se cuenta como huérfano hasta que termine
+        cancel_event.set()
+        if future.done():
+            return
+        self._orphaned += 1
+
+        def finished(done: asyncio.Future) -> None:
+            self._orphaned -= 1
+            # El resultado (o WorkCancelled) ya no le interesa a nadie
+            if not done.cancelled():
+                done.exception()
+
+        future.add_done_callback(finished)
+
+    def shutdown(self, wait: bool = False) -> None:
+        """Detiene el pool descartando el trabajo pendiente."""
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Devuelve métricas de uso del pool."""
+        finished = self._completed + self._timeouts
+        return {
+            "max_workers": self.max_workers,
+            "in_flight": self._in_flight,
+            "completed": self._completed,
+            "timeouts": self._timeouts,
+            "cancelled": self._cancelled,
+            "orphaned": self._orphaned,
+            "avg_run_time_ms": (self._total_time / finished * 1000) if finished else 0.0
+        }
@@ -6,7 +6,9 @@ from zendell.agents.activity_collector import activity_collector_node
 from zendell.agents.clarifier import clarifier_node, process_clarifier_response
 from zendell.agents.analyzer import analyzer_node
 from zendell.agents.recommender import recommender_node
-from core.utils import get_timestamp
+from zendell.core.log import get_logger
+
+logger = get_logger(__name__)
 
 # Definición completa del estado para LangGraph
 class GlobalState(TypedDict):
@@ -40,7 +42,7 @@ class GlobalState(TypedDict):
 # Función para imprimir seguimiento del grafo
 def trace_step(name: str, state: GlobalState) -> GlobalState:
     """Registra la ejecución de cada nodo para seguimiento."""
-    print(f"{get_timestamp()}", f"[LANGGRAPH] Ejecutando nodo: {name}")
+    logger.debug("Ejecutando nodo: %s", name)
     return state
 
 # Nodo para comprender el perfil del usuario
@@ -62,7 +64,7 @@ def profile_manager_node(state: GlobalState) -> GlobalState:
         db.add_to_short_term_info(user_id, f"[Profile] Información extraída: {extracted_info}")
         
     except Exception as e:
-        print(f"{get_timestamp()}", f"[LANGGRAPH] Error en profile_manager_node: {e}")
+        logger.error("Error en profile_manager_node: %s", e)
     
     return state
 
@@ -119,7 +121,7 @@ def response_generator_node(state: GlobalState) -> GlobalState:
         db.save_conversation_message(user_id, "assistant", response, {"step": current_stage})
         
     except Exception as e:
-        print(f"{get_timestamp()}", f"[LANGGRAPH] Error en response_generator_node: {e}")
+        logger.error("Error en response_generator_node: %s", e)
         state["final_text"] = "Gracias por tu mensaje. ¿Hay algo más en que pueda ayudarte?"
     
     return state
@@ -155,7 +157,7 @@ def memory_update_node(state: GlobalState) -> GlobalState:
             memory_manager.generate_long_term_reflection(user_id)
     
     except Exception as e:
-        print(f"{get_timestamp()}", f"[LANGGRAPH] Error en memory_update_node: {e}")
+        logger.error("Error en memory_update_node: %s", e)
     
     return state
 
@@ -273,6 +275,6 @@ conversation_graph = build_conversation_graph()
 try:
     from langgraph.graph import save
     save(conversation_graph, "zendell_conversation_graph.json")
-    print(f"{get_timestamp()}", "[LANGGRAPH] Grafo guardado para visualización")
+    logger.info("Grafo guardado para visualización")
 except Exception as e:
-    print(f"{get_timestamp()}", f"[LANGGRAPH] Error al guardar el grafo: {e}")
\ No newline at end of file
+    logger.error("Error al guardar el grafo: %s", e)
\ No newline at end of file
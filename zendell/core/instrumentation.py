@@ -0,0 +1,384 @@
+# zendell/core/instrumentation.py
+"""
+Instrumentación por turno del orquestador.
+
+Cada turno (orchestrator_flow) abre una TurnTrace en un ContextVar; mientras está
+activa se registran en ella:
+
+- Las llamadas al LLM (ask_gpt, ask_gpt_chat y streaming) con call_site, modelo,
+  tokens de prompt/completion, latencia y error, a través de llm_provider.add_listener.
+- Las llamadas a los métodos públicos de MongoDBManager (solo las más externas, para
+  no contar dos veces get_state dentro de save_state) y cada operación de colección,
+  que es un round trip real a la base de datos. Los round trips del buffer de
+  escrituras se cuentan con write_buffer.add_flush_listener, sin tocar el buffer.
+- Spans con nombre (etapa, agente) con su tiempo de pared.
+
+Al cerrar el turno la traza se agrega en `registry` (exportable en formato de texto
+de Prometheus) y, si INSTRUMENTATION_JSONL_PATH está definido, se añade como una
+línea JSON a ese fichero. orchestrator_flow devuelve la traza en result["metrics"].
+"""
+
+import contextlib
+import functools
+import json
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from config.settings import INSTRUMENTATION_JSONL_PATH
+from zendell.services import llm_provider
+from zendell.core import write_buffer
+from zendell.services.llm_provider import LLMResponse
+from zendell.core.log import get_logger
+
+logger = get_logger(__name__)
+
+# Operaciones de colección que cuentan como un round trip a la base de datos
+DB_OPERATIONS = {
+    "find", "find_one", "insert_one", "insert_many", "update_one", "update_many", "replace_one",
+    "delete_one", "delete_many", "count_documents", "distinct", "aggregate", "bulk_write", "find_one_and_update"
+}
+
+# Límites (ms) de los histogramas de duración
+DURATION_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+@dataclass
+class LLMSpan:
+    """Una llamada al LLM dentro de un turno."""
+    call_site: str
+    model: str
+    provider: str
+    latency_ms: float
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    stream: bool = False
+    error: str = ""
+
+@dataclass
+class TurnTrace:
+    """Métricas de un turno: llamadas al LLM, operaciones de base de datos y spans."""
+    user_id: str
+    stage: str = ""
+    started_at: str = field(default_factory=lambda: datetime.utcnow().isoformat())
+    wall_ms: float = 0.0
+    llm_calls: List[LLMSpan] = field(default_factory=list)
+    # "colección.operación" -> [número, ms]
+    db_ops: Dict[str, List[float]] = field(default_factory=dict)
+    # método de MongoDBManager -> [número, ms]
+    db_methods: Dict[str, List[float]] = field(default_factory=dict)
+    # nombre del span -> ms acumulados
+    spans: Dict[str, float] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._db_depth = 0
+
+    def add_llm_call(self, span: LLMSpan) -> None:
+        with self._lock:
+            self.llm_calls.append(span)
+
+    def add_db_op(self, key: str, elapsed_ms: float) -> None:
+        with self._lock:
+            entry = self.db_ops.setdefault(key, [0, 0.0])
+            entry[0] += 1
+            entry[1] += elapsed_ms
+
+    def add_span(self, name: str, elapsed_ms: float) -> None:
+        with self._lock:
+            self.spans[name] = self.spans.get(name, 0.0) + elapsed_ms
+
+    @property
+    def db_op_count(self) -> int:
+        return int(sum(count for count, _ in self.db_ops.values()))
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(call.prompt_tokens for call in self.llm_calls)
+
+    @property
+    def completion_tokens(self) -> int:
+        return sum(call.completion_tokens for call in self.llm_calls)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Resumen serializable (lo que se adjunta al resultado del turno y se exporta en JSONL)."""
+        with self._lock:
+            return {
+                "user_id": self.user_id,
+                "stage": self.stage,
+                "started_at": self.started_at,
+                "wall_ms": round(self.wall_ms, 3),
+                "llm": {
+                    "calls": len(self.llm_calls),
+                    "errors": sum(1 for call in self.llm_calls if call.error),
+                    "prompt_tokens": self.prompt_tokens,
+                    "completion_tokens": self.completion_tokens,
+                    "latency_ms": round(sum(call.latency_ms for call in self.llm_calls), 3),
+                    "spans": [asdict(call) for call in self.llm_calls]
+                },
+                "db": {
+                    "operations": self.db_op_count,
+                    "latency_ms": round(sum(ms for _, ms in self.db_ops.values()), 3),
+                    "by_operation": {key: {"count": int(count), "ms": round(ms, 3)} for key, (count, ms) in self.db_ops.items()},
+                    "by_method": {key: {"count": int(count), "ms": round(ms, 3)} for key, (count, ms) in self.db_methods.items()}
+                },
+                "spans_ms": {name: round(ms, 3) for name, ms in self.spans.items()}
+            }
+
+_current_turn: ContextVar[Optional[TurnTrace]] = ContextVar("current_turn", default=None)
+
+def current_turn() -> Optional[TurnTrace]:
+    """Traza del turno en curso (None fuera de un turno)."""
+    return _current_turn.get()
+
+# ======== MÉTRICAS AGREGADAS ========
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(names: Tuple[str, ...], values: Tuple[Any, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class MetricsRegistry:
+    """
+    Contadores e histogramas acumulados de todos los turnos del proceso.
+    Se exportan en el formato de texto de Prometheus (to_prometheus).
+    """
+
+    # nombre -> (tipo, ayuda, etiquetas)
+    METRICS = {
+        "zendell_turns_total": ("counter", "Turnos del orquestador procesados", ("stage",)),
+        "zendell_turn_duration_ms": ("histogram", "Tiempo de pared por turno", ("stage",)),
+        "zendell_span_duration_ms": ("histogram", "Tiempo de pared por span (etapa o agente)", ("span",)),
+        "zendell_llm_calls_total": ("counter", "Llamadas al LLM", ("call_site", "model", "status")),
+        "zendell_llm_tokens_total": ("counter", "Tokens enviados y recibidos del LLM", ("call_site", "model", "kind")),
+        "zendell_llm_latency_ms": ("histogram", "Latencia de las llamadas al LLM", ("call_site",)),
+        "zendell_db_operations_total": ("counter", "Operaciones (round trips) contra la base de datos", ("collection", "operation")),
+        "zendell_db_operation_ms_total": ("counter", "Tiempo acumulado en operaciones de base de datos", ("collection", "operation")),
+    }
+
+    def __init__(self, buckets: Tuple[float, ...] = DURATION_BUCKETS_MS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters: Dict[str, Dict[Tuple, float]] = {}
+            # nombre -> etiquetas -> [cuentas por bucket..., suma, número]
+            self._histograms: Dict[str, Dict[Tuple, List[float]]] = {}
+
+    def _inc(self, name: str, labels: Tuple, value: float = 1) -> None:
+        series = self._counters.setdefault(name, {})
+        series[labels] = series.get(labels, 0) + value
+
+    def _observe(self, name: str, labels: Tuple, value: float) -> None:
+        series = self._histograms.setdefault(name, {})
+        data = series.setdefault(labels, [0] * len(self.buckets) + [0.0, 0])
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                data[index] += 1
+        data[-2] += value
+        data[-1] += 1
+
+    def record_turn(self, trace: TurnTrace) -> None:
+        with self._lock:
+            stage = trace.stage or "unknown"
+            self._inc("zendell_turns_total", (stage,))
+            self._observe("zendell_turn_duration_ms", (stage,), trace.wall_ms)
+            for name, elapsed_ms in trace.spans.items():
+                self._observe("zendell_span_duration_ms", (name,), elapsed_ms)
+            for call in trace.llm_calls:
+                self._inc("zendell_llm_calls_total", (call.call_site, call.model, "error" if call.error else "ok"))
+                self._inc("zendell_llm_tokens_total", (call.call_site, call.model, "prompt"), call.prompt_tokens)
+                self._inc("zendell_llm_tokens_total", (call.call_site, call.model, "completion"), call.completion_tokens)
+                self._observe("zendell_llm_latency_ms", (call.call_site,), call.latency_ms)
+            for key, (count, elapsed_ms) in trace.db_ops.items():
+                labels = tuple(key.split(".", 1))
+                self._inc("zendell_db_operations_total", labels, count)
+                self._inc("zendell_db_operation_ms_total", labels, elapsed_ms)
+
+    def to_prometheus(self) -> str:
+        """Exporta las métricas en el formato de texto de Prometheus (versión 0.0.4)."""
+        lines: List[str] = []
+        with self._lock:
+            for name, (kind, help_text, label_names) in self.METRICS.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == "counter":
+                    for labels, value in sorted(self._counters.get(name, {}).items()):
+                        lines.append(f"{name}{_labels(label_names, labels)} {value:g}")
+                    continue
+                for labels, data in sorted(self._histograms.get(name, {}).items()):
+                    for bound, count in zip(self.buckets, data):
+                        le = 'le="%g"' % bound
+                        lines.append(f"{name}_bucket{_labels(label_names, labels, le)} {count}")
+                    le = 'le="+Inf"'
+                    lines.append(f"{name}_bucket{_labels(label_names, labels, le)} {data[-1]}")
+                    lines.append(f"{name}_sum{_labels(label_names, labels)} {data[-2]:.3f}")
+                    lines.append(f"{name}_count{_labels(label_names, labels)} {data[-1]}")
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+_jsonl_lock = threading.Lock()
+
+def write_jsonl(trace: TurnTrace, path: str) -> None:
+    """Añade la traza del turno como una línea JSON al fichero indicado."""
+    line = json.dumps(trace.to_dict(), ensure_ascii=False)
+    with _jsonl_lock:
+        with open(path, "a", encoding="utf-8") as output:
+            output.write(line + "\n")
+
+# ======== TURNOS Y SPANS ========
+
+@contextlib.contextmanager
+def turn(user_id: str, stage: str = "", jsonl_path: Optional[str] = None) -> Iterator[TurnTrace]:
+    """
+    Abre la traza de un turno. Si ya hay uno activo en este contexto (por ejemplo,
+    un benchmark que mide también el guardado del mensaje) se reutiliza el exterior,
+    que es el que se registra al cerrarse.
+    """
+    active = _current_turn.get()
+    if active is not None:
+        yield active
+        return
+    trace = TurnTrace(user_id=user_id, stage=stage)
+    token = _current_turn.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_turn.reset(token)
+        trace.wall_ms = (time.perf_counter() - trace._started) * 1000
+        registry.record_turn(trace)
+        path = jsonl_path or INSTRUMENTATION_JSONL_PATH
+        if path:
+            try:
+                write_jsonl(trace, path)
+            except OSError as e:
+                logger.error("Error al escribir %s: %s", path, e)
+
+@contextlib.contextmanager
+def span(name: str) -> Iterator[None]:
+    """Mide el tiempo de pared de un bloque dentro del turno en curso (sin turno, no hace nada)."""
+    trace = _current_turn.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, (time.perf_counter() - started) * 1000)
+
+# ======== LLM ========
+
+def record_llm_call(response: LLMResponse) -> None:
+    """Listener de llm_provider: añade la llamada al turno en curso."""
+    trace = _current_turn.get()
+    if trace is None:
+        return
+    trace.add_llm_call(LLMSpan(
+        call_site=response.call_site,
+        model=response.model,
+        provider=response.provider,
+        latency_ms=response.latency_ms,
+        prompt_tokens=response.prompt_tokens,
+        completion_tokens=response.completion_tokens,
+        stream=bool(response.metadata.get("stream")),
+        error=response.metadata.get("error", "")
+    ))
+
+llm_provider.add_listener(record_llm_call)
+
+# ======== BASE DE DATOS ========
+
+class InstrumentedCollection:
+    """Proxy de una colección que mide cada operación dentro del turno en curso."""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._collection, name)
+        if name not in DB_OPERATIONS:
+            return attribute
+        key = f"{self._collection.name}.{name}"
+
+        def measured(*args, **kwargs):
+            trace = _current_turn.get()
+            if trace is None:
+                return attribute(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                trace.add_db_op(key, (time.perf_counter() - started) * 1000)
+        return measured
+
+class InstrumentedDatabase:
+    """Proxy de la base de datos: las colecciones que devuelve están instrumentadas."""
+
+    def __init__(self, database):
+        self._database = database
+
+    def __getitem__(self, name: str) -> InstrumentedCollection:
+        return InstrumentedCollection(self._database[name])
+
+    def __getattr__(self, name: str):
+        return getattr(self._database, name)
+
+def record_buffer_flush(collection: str, operation: str, elapsed_ms: float) -> None:
+    """Listener de write_buffer: añade cada round trip de un flush al turno que lo hace."""
+    trace = _current_turn.get()
+    if trace is not None:
+        trace.add_db_op(f"{collection}.{operation}", elapsed_ms)
+
+write_buffer.add_flush_listener(record_buffer_flush)
+
+def _measure_method(name: str, method):
+    @functools.wraps(method)
+    def measured(*args, **kwargs):
+        trace = _current_turn.get()
+        if trace is None:
+            return method(*args, **kwargs)
+        trace._db_depth += 1
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            trace._db_depth -= 1
+            # Solo la llamada más externa: save_state -> get_state cuenta como save_state
+            if trace._db_depth == 0:
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                with trace._lock:
+                    entry = trace.db_methods.setdefault(name, [0, 0.0])
+                    entry[0] += 1
+                    entry[1] += elapsed_ms
+    return measured
+
+def instrument_db_manager(db_manager) -> None:
+    """
+    Instrumenta un MongoDBManager: sus colecciones y su base de datos pasan por proxies
+    medidos y sus métodos públicos registran llamadas y tiempo en el turno en curso.
+    El buffer de escrituras (que puede ser compartido) no se toca: sus flushes se miden
+    con record_buffer_flush. Es idempotente.
+    """
+    if getattr(db_manager, "_instrumented", False):
+        return
+    for attribute, value in list(vars(db_manager).items()):
+        if attribute.endswith("_coll"):
+            setattr(db_manager, attribute, InstrumentedCollection(value))
+    db_manager.db = InstrumentedDatabase(db_manager.db)
+    for name in dir(type(db_manager)):
+        if name.startswith("_"):
+            continue
+        method = getattr(db_manager, name)
+        if callable(method):
+            setattr(db_manager, name, _measure_method(name, method))
+    db_manager._instrumented = True
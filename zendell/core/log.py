@@ -0,0 +1,218 @@
+# zendell/core/log.py
+"""
+Logging estructurado de Zendell sobre el módulo logging estándar.
+
+- get_logger(__name__) devuelve un logger del árbol "zendell" con formato perezoso:
+  los argumentos se pasan aparte (log.debug("Actividad %s", title)) y solo se
+  formatean si el nivel está activo, así que a nivel INFO una línea debug cuesta
+  una comprobación de nivel.
+- Campos estructurados como keywords: log.info("Turno terminado", user_id=..., stage=...).
+  Salen como key=value en texto o como claves en JSON (LOG_FORMAT=json).
+- Niveles por módulo con LOG_MODULE_LEVELS="agents.clarifier=DEBUG,core.db=WARNING".
+- Muestreo para líneas debug muy frecuentes: log.debug(..., sample=0.1) emite una de cada 10;
+  sample=True usa LOG_SAMPLE_RATE (p. ej. para los ecos de respuestas del LLM).
+- Con LOG_ASYNC el formato de la línea y la escritura se hacen en un hilo aparte
+  (QueueHandler + QueueListener): quien registra solo resuelve el mensaje y lo encola.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+from typing import Any, Dict, Optional, Union
+from config.settings import LOG_LEVEL, LOG_MODULE_LEVELS, LOG_FORMAT, LOG_ASYNC, LOG_SAMPLE_RATE
+
+ROOT_LOGGER = "zendell"
+
+# Atributo del LogRecord en el que viajan los campos estructurados
+_RECORD_FIELDS = "fields"
+
+def _level(name: str, default: int = logging.INFO) -> int:
+    level = logging.getLevelName(name.upper())
+    return level if isinstance(level, int) else default
+
+class StdoutHandler(logging.StreamHandler):
+    """Escribe en el sys.stdout actual (no en el del arranque), como hacían los print."""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value) -> None:
+        pass
+
+class TextFormatter(logging.Formatter):
+    """Línea legible: fecha, nivel, logger y mensaje, seguidos de los campos key=value."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s", "%Y-%m-%d %H:%M:%S")
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = getattr(record, _RECORD_FIELDS, None)
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return text
+
+class JsonFormatter(logging.Formatter):
+    """Un objeto JSON por línea, para enviar los logs a un agregador."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        entry.update(getattr(record, _RECORD_FIELDS, None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class StructuredLogger:
+    """
+    Envoltorio ligero de logging.Logger con campos estructurados y muestreo.
+    Los métodos aceptan (msg, *args, sample=None, **fields).
+    """
+    __slots__ = ("_logger", "_sample_counts", "_sample_lock")
+
+    def __init__(self, logger: logging.Logger):
+        self._logger = logger
+        self._sample_counts: Dict[str, int] = {}
+        self._sample_lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self._logger.name
+
+    def isEnabledFor(self, level: int) -> bool:
+        return self._logger.isEnabledFor(level)
+
+    def _sampled(self, msg: str, rate: float) -> bool:
+        # Determinista por plantilla de mensaje: con rate=0.1 se emite la 1ª, 11ª, 21ª...
+        if rate is True:
+            rate = _state["sample_rate"]
+        if rate >= 1:
+            return True
+        if rate <= 0:
+            return False
+        with self._sample_lock:
+            count = self._sample_counts.get(msg, 0)
+            self._sample_counts[msg] = count + 1
+        return count % round(1 / rate) == 0
+
+    def _log(self, level: int, msg: str, args: tuple, sample: Union[float, bool, None], fields: Dict[str, Any], exc_info=None) -> None:
+        if not self._logger.isEnabledFor(level):
+            return
+        if sample is not None:
+            if not self._sampled(msg, sample):
+                return
+            rate = _state["sample_rate"] if sample is True else sample
+            if rate < 1:
+                fields["sample_rate"] = rate
+        self._logger.log(level, msg, *args, exc_info=exc_info, extra={_RECORD_FIELDS: fields} if fields else None, stacklevel=3)
+
+    def debug(self, msg: str, *args, sample: Union[float, bool, None] = None, **fields) -> None:
+        self._log(logging.DEBUG, msg, args, sample, fields)
+
+    def info(self, msg: str, *args, sample: Union[float, bool, None] = None, **fields) -> None:
+        self._log(logging.INFO, msg, args, sample, fields)
+
+    def warning(self, msg: str, *args, sample: Union[float, bool, None] = None, **fields) -> None:
+        self._log(logging.WARNING, msg, args, sample, fields)
+
+    def error(self, msg: str, *args, exc_info=None, **fields) -> None:
+        self._log(logging.ERROR, msg, args, None, fields, exc_info)
+
+    def exception(self, msg: str, *args, **fields) -> None:
+        """Error con la traza de la excepción en curso (sustituye a traceback.print_exc)."""
+        self._log(logging.ERROR, msg, args, None, fields, True)
+
+    def critical(self, msg: str, *args, exc_info=None, **fields) -> None:
+        self._log(logging.CRITICAL, msg, args, None, fields, exc_info)
+
+_loggers: Dict[str, StructuredLogger] = {}
+_state: Dict[str, Any] = {"configured": False, "listener": None, "sample_rate": LOG_SAMPLE_RATE}
+_config_lock = threading.Lock()
+
+def _qualified(name: str) -> str:
+    # Los módulos se importan como "zendell.core.db" o "core.db" según el punto de entrada
+    if name == "__main__":
+        return f"{ROOT_LOGGER}.main"
+    if name == ROOT_LOGGER or name.startswith(ROOT_LOGGER + "."):
+        return name
+    return f"{ROOT_LOGGER}.{name}"
+
+def parse_module_levels(spec: str) -> Dict[str, int]:
+    """Convierte "agents.clarifier=DEBUG,core.db=WARNING" en {logger: nivel}."""
+    levels = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        module, level = (part.strip() for part in item.split("=", 1))
+        levels[_qualified(module)] = _level(level, logging.NOTSET)
+    return levels
+
+def configure_logging(
+    level: str = LOG_LEVEL,
+    module_levels: str = LOG_MODULE_LEVELS,
+    fmt: str = LOG_FORMAT,
+    use_queue: bool = LOG_ASYNC,
+    sample_rate: float = LOG_SAMPLE_RATE,
+    stream=None
+) -> None:
+    """(Re)configura el árbol de loggers "zendell". Se llama al arrancar o, si no, en el primer get_logger."""
+    with _config_lock:
+        root = logging.getLogger(ROOT_LOGGER)
+        listener = _state["listener"]
+        if listener is not None:
+            listener.stop()
+            _state["listener"] = None
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+
+        handler = logging.StreamHandler(stream) if stream is not None else StdoutHandler()
+        handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+        if use_queue:
+            records: queue.SimpleQueue = queue.SimpleQueue()
+            listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+            listener.start()
+            _state["listener"] = listener
+            handler = logging.handlers.QueueHandler(records)
+        root.addHandler(handler)
+        root.setLevel(_level(level))
+        root.propagate = False
+
+        for name in list(logging.root.manager.loggerDict):
+            if name.startswith(ROOT_LOGGER + "."):
+                logging.getLogger(name).setLevel(logging.NOTSET)
+        for name, module_level in parse_module_levels(module_levels).items():
+            logging.getLogger(name).setLevel(module_level)
+        _state["sample_rate"] = sample_rate
+        _state["configured"] = True
+
+def shutdown_logging() -> None:
+    """Vacía la cola de logs pendientes (se llama también al salir del proceso)."""
+    with _config_lock:
+        listener = _state["listener"]
+        if listener is not None:
+            listener.stop()
+            _state["listener"] = None
+
+atexit.register(shutdown_logging)
+
+def get_logger(name: str) -> StructuredLogger:
+    """Logger estructurado para un módulo (usar get_logger(__name__))."""
+    if not _state["configured"]:
+        configure_logging()
+    qualified = _qualified(name)
+    logger = _loggers.get(qualified)
+    if logger is None:
+        logger = _loggers.setdefault(qualified, StructuredLogger(logging.getLogger(qualified)))
+    return logger
@@ -4,6 +4,7 @@ from typing import List, Dict, Any, Optional, Union, Tuple
 from datetime import datetime, timedelta
 from bson.objectid import ObjectId
 from zendell.services.llm_provider import ask_gpt, ask_gpt_chat
+from zendell.core.db import DIALOGUE_ROLES, ACTIVITY_CLARIFICATION_PROJECTION
 
 class MemoryManager:
     """
@@ -24,7 +25,7 @@ class MemoryManager:
     
     def get_recent_context(self, user_id: str, limit: int = 8) -> List[Dict[str, Any]]:
         """Obtiene el contexto reciente de la conversación."""
-        return self.db.get_user_conversation(user_id, limit)
+        return self.db.get_dialogue(user_id, limit)
     
     def get_current_state_summary(self, user_id: str) -> str:
         """Genera un resumen del estado actual del usuario."""
@@ -140,7 +141,7 @@ class MemoryManager:
         )
         
         insights_text = ask_gpt(prompt)
-        insights = [insight.strip() for insight in insights_text.split("\n") if insight.strip()]
+        insights = [insight.strip() for insight in (insights_text or "").split("\n") if insight.strip()]
         
         # Generar un resumen de patrones
         summary_prompt = (
@@ -148,7 +149,7 @@ class MemoryManager:
             "resume en un párrafo conciso los patrones de comportamiento y prioridades del usuario."
         )
         
-        patterns_summary = ask_gpt(summary_prompt)
+        patterns_summary = ask_gpt(summary_prompt) or ""
         
         return {
             "patterns": patterns_summary,
@@ -164,6 +165,7 @@ class MemoryManager:
         pipeline = [
             {"$match": {
                 "user_id": user_id,
+                "role": {"$in": DIALOGUE_ROLES},
                 "timestamp": {"$gte": cutoff_date}
             }},
             {"$sort": {"timestamp": 1}}
@@ -185,7 +187,7 @@ class MemoryManager:
         )
         
         summary = ask_gpt(prompt)
-        return summary
+        return summary or ""
     
     # ======== MÉTODOS DE MEMORIA A LARGO PLAZO ========
     
@@ -272,6 +274,9 @@ class MemoryManager:
         )
         
         reflection = ask_gpt(prompt)
+        if not reflection:
+            # Sin respuesta (fallo o presupuesto agotado): se conserva el resumen anterior
+            return ""
         
         # Guardar la reflexión como memoria del sistema de alta relevancia
         memory_data = {
@@ -376,11 +381,7 @@ class MemoryManager:
         }
         
         # Obtener actividades pasadas recientes
-        past_activities = self.db.get_recent_activities(
-            user_id, 
-            time_context="past",
-            limit=5
-        )
+        past_activities = self.db.get_activity_summaries(user_id, time_context="past", limit=5)
         
         activities_summary = []
         for act in past_activities:
@@ -402,7 +403,8 @@ class MemoryManager:
         activities = self.db.get_recent_activities(
             user_id,
             time_context=time_context,
-            limit=5
+            limit=5,
+            projection=ACTIVITY_CLARIFICATION_PROJECTION
         )
         
         # Obtener historial de clarificación
@@ -428,11 +430,7 @@ class MemoryManager:
         }
         
         # Obtener actividades futuras ya mencionadas
-        future_activities = self.db.get_recent_activities(
-            user_id, 
-            time_context="future",
-            limit=5
-        )
+        future_activities = self.db.get_activity_summaries(user_id, time_context="future", limit=5)
         
         activities_summary = []
         for act in future_activities:
@@ -0,0 +1,744 @@
+# zendell/core/memory_store.py
+
+import copy
+import re
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING, InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from pymongo.results import InsertOneResult, InsertManyResult, UpdateResult, DeleteResult, BulkWriteResult
+
+# Prefijo de URI que selecciona el backend en memoria (p. ej. MONGO_URI="memory://")
+MEMORY_URI_PREFIX = "memory://"
+
+_MISSING = object()
+
+class MemoryClient:
+    """
+    Cliente en memoria con la parte de la API de pymongo que usa Zendell.
+
+    Sirve para ejecutar agentes, orquestador y benchmarks en proceso, sin MongoDB:
+    consultas con operadores, proyecciones, sort/limit/skip, actualizaciones
+    ($set, $unset, $inc, $push con $each/$slice, $addToSet, $pull, $setOnInsert),
+    upserts, bulk_write, índices únicos y las agregaciones de db.py y memory_manager.py
+    ($match, $group, $sort, $limit, $skip, $project, $unwind, $count).
+    """
+
+    def __init__(self, uri: str = MEMORY_URI_PREFIX):
+        self.uri = uri
+        self._databases: Dict[str, "MemoryDatabase"] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> "MemoryDatabase":
+        with self._lock:
+            if name not in self._databases:
+                self._databases[name] = MemoryDatabase(self, name)
+            return self._databases[name]
+
+    def get_database(self, name: str) -> "MemoryDatabase":
+        return self[name]
+
+    def list_database_names(self) -> List[str]:
+        return list(self._databases)
+
+    def drop_database(self, name: Union[str, "MemoryDatabase"]) -> None:
+        name = getattr(name, "name", name)
+        with self._lock:
+            self._databases.pop(name, None)
+
+    def close(self) -> None:
+        pass
+
+class MemoryDatabase:
+    def __init__(self, client: MemoryClient, name: str):
+        self.client = client
+        self.name = name
+        self._collections: Dict[str, "MemoryCollection"] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> "MemoryCollection":
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = MemoryCollection(self, name)
+            return self._collections[name]
+
+    def __getattr__(self, name: str) -> "MemoryCollection":
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_collection(self, name: str) -> "MemoryCollection":
+        return self[name]
+
+    def create_collection(self, name: str, capped: bool = False, size: Optional[int] = None, max: Optional[int] = None, **kwargs) -> "MemoryCollection":
+        """Crea la colección; en las capped solo se respeta `max` (número de documentos)."""
+        with self._lock:
+            if name in self._collections:
+                raise OperationFailure(f"Collection {self.name}.{name} already exists")
+            collection = MemoryCollection(self, name, capped_max=max if capped else None)
+            self._collections[name] = collection
+            return collection
+
+    def list_collection_names(self) -> List[str]:
+        return list(self._collections)
+
+    def drop_collection(self, name: str) -> None:
+        with self._lock:
+            self._collections.pop(name, None)
+
+class MemoryCursor:
+    """Cursor perezoso: sort/skip/limit se aplican al iterar, como en pymongo."""
+
+    def __init__(self, collection: "MemoryCollection", filter: Optional[Dict[str, Any]], projection: Optional[Dict[str, Any]]):
+        self._collection = collection
+        self._filter = filter or {}
+        self._projection = projection
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction: Optional[int] = None) -> "MemoryCursor":
+        self._sort = _normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, skip: int) -> "MemoryCursor":
+        self._skip = skip
+        return self
+
+    def limit(self, limit: int) -> "MemoryCursor":
+        self._limit = limit
+        return self
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        docs = self._collection._select(self._filter)
+        if self._sort:
+            docs = _sort_docs(docs, self._sort)
+        docs = docs[self._skip:]
+        if self._limit:
+            docs = docs[:abs(self._limit)]
+        return iter([_project(doc, self._projection) for doc in docs])
+
+    def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        docs = list(self)
+        return docs[:length] if length else docs
+
+class MemoryCollection:
+    def __init__(self, database: MemoryDatabase, name: str, capped_max: Optional[int] = None):
+        self.database = database
+        self.name = name
+        self.capped_max = capped_max
+        self._docs: List[Dict[str, Any]] = []
+        self._unique: List[List[str]] = []
+        self._indexes: Dict[str, Dict[str, Any]] = {"_id_": {"key": [("_id", ASCENDING)], "unique": True}}
+        self._lock = threading.RLock()
+
+    # ======== LECTURA ========
+
+    def _select(self, filter: Dict[str, Any]) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [doc for doc in self._docs if _matches(doc, filter)]
+
+    def find(self, filter: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, Any]] = None,
+             sort=None, limit: int = 0, skip: int = 0, **kwargs) -> MemoryCursor:
+        cursor = MemoryCursor(self, filter, projection)
+        if sort:
+            cursor.sort(sort)
+        return cursor.skip(skip).limit(limit)
+
+    def find_one(self, filter: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, Any]] = None, sort=None, **kwargs) -> Optional[Dict[str, Any]]:
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        for doc in self.find(filter, projection, sort=sort, limit=1):
+            return doc
+        return None
+
+    def count_documents(self, filter: Dict[str, Any], **kwargs) -> int:
+        return len(self._select(filter))
+
+    def estimated_document_count(self) -> int:
+        with self._lock:
+            return len(self._docs)
+
+    def distinct(self, key: str, filter: Optional[Dict[str, Any]] = None) -> List[Any]:
+        values: List[Any] = []
+        for doc in self._select(filter or {}):
+            for value in _resolve(doc, key):
+                for item in (value if isinstance(value, list) else [value]):
+                    if item is not _MISSING and item not in values:
+                        values.append(copy.deepcopy(item))
+        return values
+
+    def aggregate(self, pipeline: List[Dict[str, Any]], **kwargs) -> MemoryCursor:
+        docs = [copy.deepcopy(doc) for doc in self._select({})]
+        for stage in pipeline:
+            (operator, spec), = stage.items()
+            docs = _run_stage(operator, spec, docs)
+        return _ListCursor(docs)
+
+    # ======== ESCRITURA ========
+
+    def insert_one(self, document: Dict[str, Any], **kwargs) -> InsertOneResult:
+        with self._lock:
+            self._insert(document)
+        return InsertOneResult(document["_id"], True)
+
+    def insert_many(self, documents: Iterable[Dict[str, Any]], ordered: bool = True, **kwargs) -> InsertManyResult:
+        documents = list(documents)
+        with self._lock:
+            for document in documents:
+                self._insert(document)
+        return InsertManyResult([document["_id"] for document in documents], True)
+
+    def _insert(self, document: Dict[str, Any]) -> None:
+        # Igual que pymongo: el _id generado se añade al documento del llamador
+        document.setdefault("_id", ObjectId())
+        stored = copy.deepcopy(document)
+        self._check_unique(stored)
+        self._docs.append(stored)
+        if self.capped_max and len(self._docs) > self.capped_max:
+            del self._docs[:len(self._docs) - self.capped_max]
+
+    def update_one(self, filter: Dict[str, Any], update: Dict[str, Any], upsert: bool = False, **kwargs) -> UpdateResult:
+        return UpdateResult(self._update(filter, update, upsert, multi=False), True)
+
+    def update_many(self, filter: Dict[str, Any], update: Dict[str, Any], upsert: bool = False, **kwargs) -> UpdateResult:
+        return UpdateResult(self._update(filter, update, upsert, multi=True), True)
+
+    def replace_one(self, filter: Dict[str, Any], replacement: Dict[str, Any], upsert: bool = False, **kwargs) -> UpdateResult:
+        return UpdateResult(self._update(filter, replacement, upsert, multi=False, replace=True), True)
+
+    def find_one_and_update(self, filter: Dict[str, Any], update: Dict[str, Any], projection=None, upsert: bool = False,
+                            return_document: bool = False, **kwargs) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            before = self.find_one(filter)
+            self._update(filter, update, upsert, multi=False)
+            if return_document:
+                query = {"_id": before["_id"]} if before else filter
+                return self.find_one(query, projection)
+            return _project(before, projection) if before else None
+
+    def _update(self, filter: Dict[str, Any], update: Dict[str, Any], upsert: bool, multi: bool, replace: bool = False) -> Dict[str, Any]:
+        if not replace and not all(key.startswith("$") for key in update):
+            raise ValueError("update only works with $ operators")
+        with self._lock:
+            targets = [doc for doc in self._docs if _matches(doc, filter)]
+            if not multi:
+                targets = targets[:1]
+            modified = 0
+            for doc in targets:
+                new_doc = {"_id": doc["_id"], **copy.deepcopy(update)} if replace else _apply_update(copy.deepcopy(doc), update, inserting=False)
+                if new_doc != doc:
+                    self._check_unique(new_doc, ignore=doc)
+                    doc.clear()
+                    doc.update(new_doc)
+                    modified += 1
+            if targets or not upsert:
+                return {"n": len(targets), "nModified": modified, "updatedExisting": bool(targets)}
+
+            seed = _upsert_seed(filter)
+            new_doc = {**seed, **copy.deepcopy(update)} if replace else _apply_update(seed, update, inserting=True)
+            self._insert(new_doc)
+            return {"n": 1, "nModified": 0, "upserted": new_doc["_id"], "updatedExisting": False}
+
+    def delete_one(self, filter: Dict[str, Any], **kwargs) -> DeleteResult:
+        return DeleteResult({"n": self._delete(filter, multi=False)}, True)
+
+    def delete_many(self, filter: Dict[str, Any], **kwargs) -> DeleteResult:
+        return DeleteResult({"n": self._delete(filter, multi=True)}, True)
+
+    def _delete(self, filter: Dict[str, Any], multi: bool) -> int:
+        with self._lock:
+            removed = 0
+            kept = []
+            for doc in self._docs:
+                if (multi or not removed) and _matches(doc, filter):
+                    removed += 1
+                else:
+                    kept.append(doc)
+            self._docs = kept
+            return removed
+
+    def bulk_write(self, requests: List[Any], ordered: bool = True, **kwargs) -> BulkWriteResult:
+        """Ejecuta operaciones InsertOne/UpdateOne/UpdateMany/ReplaceOne/DeleteOne/DeleteMany de pymongo."""
+        result = {"nInserted": 0, "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []}
+        with self._lock:
+            for index, request in enumerate(requests):
+                if isinstance(request, InsertOne):
+                    self._insert(request._doc)
+                    result["nInserted"] += 1
+                elif isinstance(request, (UpdateOne, UpdateMany, ReplaceOne)):
+                    raw = self._update(
+                        request._filter, request._doc, request._upsert,
+                        multi=isinstance(request, UpdateMany), replace=isinstance(request, ReplaceOne)
+                    )
+                    if "upserted" in raw:
+                        result["nUpserted"] += 1
+                        result["upserted"].append({"index": index, "_id": raw["upserted"]})
+                    else:
+                        result["nMatched"] += raw["n"]
+                        result["nModified"] += raw["nModified"]
+                elif isinstance(request, (DeleteOne, DeleteMany)):
+                    result["nRemoved"] += self._delete(request._filter, multi=isinstance(request, DeleteMany))
+                else:
+                    raise TypeError(f"Operación no soportada en bulk_write: {request!r}")
+        return BulkWriteResult(result, True)
+
+    # ======== ÍNDICES ========
+
+    def create_index(self, keys, unique: bool = False, name: Optional[str] = None, **kwargs) -> str:
+        """Registra el índice; solo los únicos tienen efecto (se comprueban al escribir)."""
+        keys = _normalize_sort(keys, None)
+        name = name or "_".join(f"{field}_{direction}" for field, direction in keys)
+        with self._lock:
+            self._indexes[name] = {"key": keys, "unique": unique}
+            if unique:
+                self._unique.append([field for field, _ in keys])
+        return name
+
+    def index_information(self) -> Dict[str, Dict[str, Any]]:
+        return copy.deepcopy(self._indexes)
+
+    def drop(self) -> None:
+        self.database.drop_collection(self.name)
+
+    def _check_unique(self, candidate: Dict[str, Any], ignore: Optional[Dict[str, Any]] = None) -> None:
+        for fields in [["_id"]] + self._unique:
+            key = [_first(candidate, field) for field in fields]
+            if fields != ["_id"] and all(value is _MISSING for value in key):
+                continue
+            for doc in self._docs:
+                if doc is not ignore and [_first(doc, field) for field in fields] == key:
+                    raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.database.name}.{self.name} key: {dict(zip(fields, key))}")
+
+class _ListCursor(list):
+    """Resultado de aggregate: una lista con to_list() como los cursores."""
+
+    def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        return self[:length] if length else list(self)
+
+# ======== CONSULTAS ========
+
+def _resolve(doc: Any, path: str) -> List[Any]:
+    """Valores de un campo con notación de puntos, recorriendo arrays como MongoDB."""
+    values = [doc]
+    for part in path.split("."):
+        found = []
+        for value in values:
+            if isinstance(value, dict):
+                found.append(value.get(part, _MISSING))
+            elif isinstance(value, list):
+                if part.isdigit() and int(part) < len(value):
+                    found.append(value[int(part)])
+                else:
+                    found.extend(item.get(part, _MISSING) for item in value if isinstance(item, dict))
+            else:
+                found.append(_MISSING)
+        values = found
+    return values or [_MISSING]
+
+def _first(doc: Dict[str, Any], path: str) -> Any:
+    return _resolve(doc, path)[0]
+
+def _candidates(values: List[Any]) -> List[Any]:
+    # Un campo array coincide si coincide el array completo o cualquiera de sus elementos
+    expanded = []
+    for value in values:
+        expanded.append(value)
+        if isinstance(value, list):
+            expanded.extend(value)
+    return expanded
+
+def _comparable(a: Any, b: Any) -> bool:
+    if a is _MISSING or b is _MISSING or a is None or b is None:
+        return False
+    numbers = (int, float)
+    return (isinstance(a, numbers) and isinstance(b, numbers) and not isinstance(a, bool)) or type(a) == type(b)
+
+def _regex(pattern: Any, options: str = "") -> "re.Pattern":
+    if isinstance(pattern, re.Pattern):
+        return pattern
+    flags = 0
+    for option, flag in (("i", re.IGNORECASE), ("m", re.MULTILINE), ("s", re.DOTALL), ("x", re.VERBOSE)):
+        if option in options:
+            flags |= flag
+    return re.compile(pattern, flags)
+
+def _match_operator(values: List[Any], operator: str, argument: Any, spec: Dict[str, Any]) -> bool:
+    candidates = _candidates(values)
+    present = [value for value in candidates if value is not _MISSING]
+    if operator == "$eq":
+        return _equals(candidates, argument)
+    if operator == "$ne":
+        return not _equals(candidates, argument)
+    if operator == "$in":
+        return any(_equals(candidates, item) for item in argument)
+    if operator == "$nin":
+        return not any(_equals(candidates, item) for item in argument)
+    if operator == "$exists":
+        return bool(present) == bool(argument)
+    if operator in ("$gt", "$gte", "$lt", "$lte"):
+        compare: Callable[[Any, Any], bool] = {
+            "$gt": lambda a, b: a > b, "$gte": lambda a, b: a >= b,
+            "$lt": lambda a, b: a < b, "$lte": lambda a, b: a <= b
+        }[operator]
+        return any(_comparable(value, argument) and compare(value, argument) for value in present)
+    if operator == "$regex":
+        pattern = _regex(argument, spec.get("$options", ""))
+        return any(isinstance(value, str) and pattern.search(value) for value in present)
+    if operator == "$options":
+        return True
+    if operator == "$size":
+        return any(isinstance(value, list) and len(value) == argument for value in values)
+    if operator == "$all":
+        return all(_equals(candidates, item) for item in argument)
+    if operator == "$elemMatch":
+        return any(
+            isinstance(value, list) and any(
+                _matches(item, argument) if isinstance(item, dict) else _match_field([item], argument)
+                for item in value
+            )
+            for value in values
+        )
+    if operator == "$not":
+        return not _match_field(values, argument)
+    raise OperationFailure(f"Operador de consulta no soportado: {operator}")
+
+def _equals(candidates: List[Any], expected: Any) -> bool:
+    if isinstance(expected, re.Pattern):
+        return any(isinstance(value, str) and expected.search(value) for value in candidates)
+    if expected is None:
+        return any(value is None or value is _MISSING for value in candidates)
+    return any(value == expected for value in candidates if value is not _MISSING)
+
+def _match_field(values: List[Any], condition: Any) -> bool:
+    if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+        return all(_match_operator(values, operator, argument, condition) for operator, argument in condition.items())
+    return _equals(_candidates(values), condition)
+
+def _matches(doc: Dict[str, Any], filter: Dict[str, Any]) -> bool:
+    for key, condition in filter.items():
+        if key == "$and":
+            if not all(_matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(_matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$nor":
+            if any(_matches(doc, sub) for sub in condition):
+                return False
+        elif not _match_field(_resolve(doc, key), condition):
+            return False
+    return True
+
+# ======== PROYECCIONES Y ORDEN ========
+
+def _project(doc: Dict[str, Any], projection: Optional[Union[Dict[str, Any], List[str]]]) -> Dict[str, Any]:
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    include_id = bool(projection.get("_id", 1))
+    included = [field for field, flag in projection.items() if flag and field != "_id"]
+    if included:
+        projected: Dict[str, Any] = {}
+        for field in included:
+            value = _first(doc, field)
+            if value is not _MISSING:
+                _set_path(projected, field, copy.deepcopy(value))
+    else:
+        projected = doc
+        for field, flag in projection.items():
+            if not flag and field != "_id":
+                _unset_path(projected, field)
+    projected.pop("_id", None)
+    if include_id and "_id" in doc:
+        projected = {"_id": doc["_id"], **projected}
+    return projected
+
+def _normalize_sort(key_or_list, direction: Optional[int]) -> List[Tuple[str, int]]:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or ASCENDING)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return [tuple(item) if isinstance(item, (list, tuple)) else (item, ASCENDING) for item in key_or_list]
+
+_TYPE_ORDER = {type(None): 0, int: 1, float: 1, str: 2, dict: 3, list: 4, ObjectId: 5, bool: 6}
+
+def _sort_key(value: Any) -> Tuple[int, Any]:
+    if value is _MISSING or value is None:
+        return (0, 0)
+    rank = _TYPE_ORDER.get(type(value), 7)
+    if rank in (3, 4):
+        return (rank, repr(value))
+    return (rank, value)
+
+def _sort_docs(docs: List[Dict[str, Any]], sort: List[Tuple[str, int]]) -> List[Dict[str, Any]]:
+    # Orden estable por claves de menor a mayor prioridad
+    for field, direction in reversed(sort):
+        docs = sorted(docs, key=lambda doc: _sort_key(_first(doc, field)), reverse=direction == DESCENDING)
+    return docs
+
+# ======== ACTUALIZACIONES ========
+
+def _set_path(doc: Dict[str, Any], path: str, value: Any) -> None:
+    parts = path.split(".")
+    target = doc
+    for part in parts[:-1]:
+        if isinstance(target, list) and part.isdigit():
+            target = target[int(part)]
+            continue
+        if not isinstance(target.get(part), (dict, list)):
+            target[part] = {}
+        target = target[part]
+    if isinstance(target, list) and parts[-1].isdigit():
+        target[int(parts[-1])] = value
+    else:
+        target[parts[-1]] = value
+
+def _unset_path(doc: Dict[str, Any], path: str) -> None:
+    parts = path.split(".")
+    target = doc
+    for part in parts[:-1]:
+        target = target.get(part) if isinstance(target, dict) else None
+        if target is None:
+            return
+    if isinstance(target, dict):
+        target.pop(parts[-1], None)
+
+def _get_path(doc: Dict[str, Any], path: str, default: Any = None) -> Any:
+    value = _first(doc, path)
+    return default if value is _MISSING else value
+
+def _apply_update(doc: Dict[str, Any], update: Dict[str, Any], inserting: bool) -> Dict[str, Any]:
+    for operator, fields in update.items():
+        for path, argument in fields.items():
+            argument = copy.deepcopy(argument)
+            if operator == "$set":
+                _set_path(doc, path, argument)
+            elif operator == "$setOnInsert":
+                if inserting:
+                    _set_path(doc, path, argument)
+            elif operator == "$unset":
+                _unset_path(doc, path)
+            elif operator == "$inc":
+                _set_path(doc, path, _get_path(doc, path, 0) + argument)
+            elif operator in ("$min", "$max"):
+                current = _get_path(doc, path, _MISSING)
+                if current is _MISSING or (argument < current if operator == "$min" else argument > current):
+                    _set_path(doc, path, argument)
+            elif operator == "$push":
+                values = list(_get_path(doc, path, []) or [])
+                if isinstance(argument, dict) and "$each" in argument:
+                    values.extend(argument["$each"])
+                    if "$sort" in argument:
+                        sort = argument["$sort"]
+                        if isinstance(sort, dict):
+                            values = _sort_docs(values, list(sort.items()))
+                        else:
+                            values = sorted(values, key=_sort_key, reverse=sort == DESCENDING)
+                    if "$slice" in argument:
+                        size = argument["$slice"]
+                        values = values[size:] if size < 0 else values[:size]
+                else:
+                    values.append(argument)
+                _set_path(doc, path, values)
+            elif operator == "$addToSet":
+                values = list(_get_path(doc, path, []) or [])
+                items = argument["$each"] if isinstance(argument, dict) and "$each" in argument else [argument]
+                values.extend(item for item in items if item not in values)
+                _set_path(doc, path, values)
+            elif operator == "$pull":
+                values = list(_get_path(doc, path, []) or [])
+                if isinstance(argument, dict):
+                    keep = [item for item in values if not (_matches(item, argument) if isinstance(item, dict) else _match_field([item], argument))]
+                else:
+                    keep = [item for item in values if item != argument]
+                _set_path(doc, path, keep)
+            elif operator == "$pop":
+                values = list(_get_path(doc, path, []) or [])
+                if values:
+                    values = values[1:] if argument < 0 else values[:-1]
+                _set_path(doc, path, values)
+            else:
+                raise OperationFailure(f"Operador de actualización no soportado: {operator}")
+    return doc
+
+def _upsert_seed(filter: Dict[str, Any]) -> Dict[str, Any]:
+    """Documento inicial de un upsert: las igualdades del filtro."""
+    seed: Dict[str, Any] = {}
+    for key, condition in filter.items():
+        if key.startswith("$"):
+            if key == "$and":
+                for sub in condition:
+                    seed.update(_upsert_seed(sub))
+            continue
+        if isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+            if "$eq" in condition:
+                _set_path(seed, key, copy.deepcopy(condition["$eq"]))
+            continue
+        _set_path(seed, key, copy.deepcopy(condition))
+    return seed
+
+# ======== AGREGACIÓN ========
+
+def _evaluate(expression: Any, doc: Dict[str, Any]) -> Any:
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = _first(doc, expression[1:])
+        return None if value is _MISSING else value
+    if isinstance(expression, dict):
+        return {key: _evaluate(value, doc) for key, value in expression.items()}
+    return expression
+
+def _accumulate(operator: str, argument: Any, docs: List[Dict[str, Any]]) -> Any:
+    values = [_evaluate(argument, doc) for doc in docs]
+    present = [value for value in values if value is not None]
+    if operator == "$sum":
+        return sum(value for value in values if isinstance(value, (int, float)) and not isinstance(value, bool))
+    if operator == "$avg":
+        numbers = [value for value in present if isinstance(value, (int, float))]
+        return sum(numbers) / len(numbers) if numbers else None
+    if operator == "$first":
+        return values[0] if values else None
+    if operator == "$last":
+        return values[-1] if values else None
+    if operator == "$min":
+        return min(present, key=_sort_key) if present else None
+    if operator == "$max":
+        return max(present, key=_sort_key) if present else None
+    if operator == "$push":
+        return values
+    if operator == "$addToSet":
+        unique: List[Any] = []
+        for value in values:
+            if value not in unique:
+                unique.append(value)
+        return unique
+    raise OperationFailure(f"Acumulador no soportado: {operator}")
+
+def _run_stage(operator: str, spec: Any, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    if operator == "$match":
+        return [doc for doc in docs if _matches(doc, spec)]
+    if operator == "$sort":
+        return _sort_docs(docs, list(spec.items()))
+    if operator == "$limit":
+        return docs[:spec]
+    if operator == "$skip":
+        return docs[spec:]
+    if operator == "$count":
+        return [{spec: len(docs)}] if docs else []
+    if operator == "$project":
+        computed = {field: value for field, value in spec.items() if not isinstance(value, (int, bool))}
+        flags = {field: value for field, value in spec.items() if isinstance(value, (int, bool))}
+        if computed:
+            flags.update({field: 1 for field in computed})
+        projected = [_project(doc, flags) for doc in docs]
+        for result, doc in zip(projected, docs):
+            for field, expression in computed.items():
+                _set_path(result, field, _evaluate(expression, doc))
+        return projected
+    if operator == "$unwind":
+        path = (spec["path"] if isinstance(spec, dict) else spec)[1:]
+        unwound = []
+        for doc in docs:
+            values = _get_path(doc, path, None)
+            if isinstance(values, list):
+                for value in values:
+                    item = copy.deepcopy(doc)
+                    _set_path(item, path, value)
+                    unwound.append(item)
+            elif values is not None:
+                unwound.append(doc)
+        return unwound
+    if operator == "$group":
+        groups: Dict[str, Tuple[Any, List[Dict[str, Any]]]] = {}
+        for doc in docs:
+            key = _evaluate(spec["_id"], doc)
+            groups.setdefault(repr(key), (key, []))[1].append(doc)
+        results = []
+        for key, members in groups.values():
+            result = {"_id": key}
+            for field, accumulator in spec.items():
+                if field != "_id":
+                    (acc_operator, argument), = accumulator.items()
+                    result[field] = _accumulate(acc_operator, argument, members)
+            results.append(result)
+        return results
+    raise OperationFailure(f"Etapa de agregación no soportada: {operator}")
+
+# ======== VARIANTE ASÍNCRONA (superficie de Motor) ========
+
+class AsyncMemoryCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def sort(self, key_or_list, direction: Optional[int] = None) -> "AsyncMemoryCursor":
+        self._cursor.sort(key_or_list, direction)
+        return self
+
+    def skip(self, skip: int) -> "AsyncMemoryCursor":
+        self._cursor.skip(skip)
+        return self
+
+    def limit(self, limit: int) -> "AsyncMemoryCursor":
+        self._cursor.limit(limit)
+        return self
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        return self._cursor.to_list(length)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._cursor:
+            yield doc
+
+class AsyncMemoryCollection:
+    """Envuelve una MemoryCollection con métodos awaitables, como AsyncIOMotorCollection."""
+
+    _CURSOR_METHODS = ("find", "aggregate")
+
+    def __init__(self, collection: MemoryCollection):
+        self._collection = collection
+        self.name = collection.name
+
+    def __getattr__(self, name: str):
+        method = getattr(self._collection, name)
+        if name in self._CURSOR_METHODS:
+            return lambda *args, **kwargs: AsyncMemoryCursor(method(*args, **kwargs))
+
+        async def awaitable(*args, **kwargs):
+            return method(*args, **kwargs)
+        return awaitable
+
+class AsyncMemoryDatabase:
+    def __init__(self, database: MemoryDatabase):
+        self._database = database
+        self.name = database.name
+
+    def __getitem__(self, name: str) -> AsyncMemoryCollection:
+        return AsyncMemoryCollection(self._database[name])
+
+    async def list_collection_names(self) -> List[str]:
+        return self._database.list_collection_names()
+
+    async def create_collection(self, name: str, **kwargs) -> AsyncMemoryCollection:
+        return AsyncMemoryCollection(self._database.create_collection(name, **kwargs))
+
+class AsyncMemoryClient:
+    """Cliente asíncrono que comparte los datos con el MemoryClient síncrono de la misma URI."""
+
+    def __init__(self, sync_client: MemoryClient):
+        self._client = sync_client
+        self.uri = sync_client.uri
+
+    def __getitem__(self, name: str) -> AsyncMemoryDatabase:
+        return AsyncMemoryDatabase(self._client[name])
+
+    def close(self) -> None:
+        pass
+
+def is_memory_uri(uri: str) -> bool:
+    return uri.startswith(MEMORY_URI_PREFIX)
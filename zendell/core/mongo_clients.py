@@ -0,0 +1,75 @@
+# zendell/core/mongo_clients.py
+
+import threading
+from typing import Any, Dict, Optional, Tuple
+from pymongo import MongoClient
+from config.settings import (
+    MONGO_URI, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_CONNECT_TIMEOUT_MS,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS, MONGO_COMPRESSORS
+)
+from zendell.core.memory_store import MemoryClient, AsyncMemoryClient, is_memory_uri
+
+# Registro de clientes del proceso: un MongoClient y un cliente Motor por URI.
+# Cada cliente mantiene su propio pool de conexiones; crear uno por manager
+# multiplica conexiones y repite el handshake.
+# Las URIs "memory://..." seleccionan el backend en memoria (core/memory_store.py):
+# los datos viven en el proceso y se comparten entre el cliente síncrono y el asíncrono.
+_clients: Dict[Tuple[str, str], Any] = {}
+_indexed: set = set()
+_lock = threading.Lock()
+
+def client_options(max_pool_size: Optional[int] = None) -> Dict[str, Any]:
+    """Opciones comunes de pool, timeouts y compresión para pymongo y Motor."""
+    options = {
+        "maxPoolSize": max_pool_size if max_pool_size is not None else MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS
+    }
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    return options
+
+def get_mongo_client(uri: str = MONGO_URI, max_pool_size: Optional[int] = None) -> MongoClient:
+    """Devuelve el MongoClient compartido para la URI (lo crea la primera vez)."""
+    key = ("pymongo", uri)
+    with _lock:
+        if key not in _clients:
+            if is_memory_uri(uri):
+                _clients[key] = MemoryClient(uri)
+            else:
+                _clients[key] = MongoClient(uri, **client_options(max_pool_size))
+        return _clients[key]
+
+def get_motor_client(uri: str = MONGO_URI, max_pool_size: Optional[int] = None):
+    """Devuelve el cliente Motor compartido para la URI (lo crea la primera vez)."""
+    if is_memory_uri(uri):
+        sync_client = get_mongo_client(uri)
+        with _lock:
+            return _clients.setdefault(("motor", uri), AsyncMemoryClient(sync_client))
+    from motor.motor_asyncio import AsyncIOMotorClient
+    key = ("motor", uri)
+    with _lock:
+        if key not in _clients:
+            _clients[key] = AsyncIOMotorClient(uri, **client_options(max_pool_size))
+        return _clients[key]
+
+def claim_index_setup(uri: str, db_name: str) -> bool:
+    """
+    Devuelve True solo la primera vez que se pide para (uri, db_name) en el proceso.
+    Sirve para crear índices una única vez aunque se instancien varios managers.
+    """
+    with _lock:
+        if (uri, db_name) in _indexed:
+            return False
+        _indexed.add((uri, db_name))
+        return True
+
+def close_all() -> None:
+    """Cierra todos los clientes registrados (al terminar el proceso)."""
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        _indexed.clear()
@@ -0,0 +1,60 @@
+# zendell/core/rate_limit.py
+
+import asyncio
+import threading
+import time
+
+class TokenBucket:
+    """
+    Limitador token bucket: se recargan `rate` tokens por segundo hasta `capacity`.
+
+    Es seguro entre hilos y ofrece una interfaz síncrona (try_acquire/time_until)
+    para código bloqueante y una asíncrona (acquire) para el event loop.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1, reserve: float = 0) -> bool:
+        """Consume tokens si hay suficientes dejando al menos `reserve` en el bucket; no espera."""
+        with self._lock:
+            self._refill()
+            if self._tokens - reserve >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def time_until(self, tokens: float = 1, reserve: float = 0) -> float:
+        """Segundos hasta que haya `tokens` disponibles por encima de `reserve` (0 si ya los hay)."""
+        with self._lock:
+            self._refill()
+            missing = min(tokens + reserve, self.capacity) - self._tokens
+            if missing <= 0 or self.rate <= 0:
+                return 0.0
+            return missing / self.rate
+
+    def adjust(self, tokens: float) -> None:
+        """Corrige un consumo ya hecho: positivo consume más (puede quedar en negativo), negativo devuelve."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens - tokens)
+
+    def penalize(self, seconds: float) -> None:
+        """Vacía el bucket durante `seconds` (p. ej. tras un 429 con retry_after)."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+
+    async def acquire(self, tokens: float = 1) -> None:
+        """Espera (sin bloquear el loop) hasta poder consumir `tokens`."""
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(max(self.time_until(tokens), 0.01))
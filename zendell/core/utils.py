@@ -14,6 +14,4 @@ def has_one_hour_passed(last_time_str: str) -> bool:
 
 def get_timestamp():
     """Returns current timestamp string in format (HH:MM DD/MM/YYYY)"""
-    from datetime import datetime
-    now = datetime.now()
-    return f"({now.strftime('%H:%M %d/%m/%Y')})"
\ No newline at end of file
+    return datetime.now().strftime("(%H:%M %d/%m/%Y)")
\ No newline at end of file
@@ -0,0 +1,345 @@
+# zendell/core/write_buffer.py
+
+import atexit
+import contextlib
+import os
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from bson import json_util
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from zendell.core.log import get_logger
+
+logger = get_logger(__name__)
+
+# Un único buffer por fichero WAL en el proceso: es el que lo reaplica, lo escribe y lo recorta
+_wal_owners: Dict[str, "WriteBuffer"] = {}
+_wal_owners_lock = threading.RLock()
+# Buffers abiertos, para vaciarlos al terminar el proceso (un solo hook de atexit)
+_open_buffers: "weakref.WeakSet[WriteBuffer]" = weakref.WeakSet()
+# Funciones (colección, operación, ms) que se llaman tras cada round trip de un flush
+_flush_listeners: List[Callable[[str, str, float], None]] = []
+
+def add_flush_listener(listener: Callable[[str, str, float], None]) -> None:
+    """Registra una función que se llama tras cada escritura de un flush (p. ej. instrumentación)."""
+    if listener not in _flush_listeners:
+        _flush_listeners.append(listener)
+
+def remove_flush_listener(listener: Callable[[str, str, float], None]) -> None:
+    if listener in _flush_listeners:
+        _flush_listeners.remove(listener)
+
+def _notify_flush(collection: str, operation: str, elapsed_ms: float) -> None:
+    for listener in list(_flush_listeners):
+        try:
+            listener(collection, operation, elapsed_ms)
+        except Exception as e:
+            logger.error("Error en listener %s: %s", getattr(listener, '__name__', listener), e)
+
+class WriteBuffer:
+    """
+    Buffer write-behind para escrituras frecuentes y pequeñas (mensajes de conversación,
+    trazas de agentes y pushes a short_term_info).
+
+    - Las inserciones se agrupan en un insert_many por colección y las actualizaciones en
+      un bulk_write, ambos ordenados: un turno pasa de 5-10 round trips a uno o dos.
+    - Se vacía al final de cada turno (flush), cada `flush_interval` segundos si se indica,
+      y al terminar el proceso.
+    - flush() saca los lotes pendientes bajo `lock` y escribe en MongoDB sin él: encolar y
+      leer no esperan al round trip. Solo una lectura de un usuario con un lote en vuelo en
+      esa colección espera a que termine (reading()).
+    - Las lecturas tampoco consultan MongoDB bajo `lock`: mientras un lector de un usuario
+      está dentro de reading(), flush() retiene las operaciones de ese usuario en esa colección.
+    - Con `wal_path` cada operación se añade a un fichero JSONL antes de aceptarla; cuando
+      la escritura de una colección termina, sus operaciones se quitan del fichero, y lo que
+      queda se reaplica al arrancar (replay_wal). Cada fichero tiene un único buffer dueño.
+    - Los lectores del MongoDBManager combinan lo pendiente con lo leído (overlay) dentro
+      de reading(), de modo que las lecturas ven las escrituras aún no enviadas, ni más ni menos.
+    """
+
+    def __init__(self, db, flush_interval: float = 0.0, max_pending: int = 500, wal_path: Optional[str] = None,
+                 owner_key: Any = None):
+        self.db = db
+        self.max_pending = max_pending
+        self.wal_path = os.path.abspath(wal_path) if wal_path else None
+        self.owner_key = owner_key
+        self.lock = threading.RLock()
+        self._flushed = threading.Condition(self.lock)
+        self._flush_lock = threading.Lock()
+        self._inserts: Dict[str, List[Dict[str, Any]]] = {}
+        self._updates: Dict[str, List[Dict[str, Any]]] = {}
+        self._in_flight: Dict[Tuple[str, Any], int] = {}
+        self._readers: Dict[Tuple[str, Any], int] = {}
+        self._logged: Dict[int, str] = {}
+        self._seq = 0
+        self._pending = 0
+        self._stats = {"buffered": 0, "flushes": 0, "round_trips": 0, "errors": 0}
+        self._stop = threading.Event()
+        self._timer = None
+        self.closed = False
+
+        if self.wal_path:
+            with _wal_owners_lock:
+                owner = _wal_owners.get(self.wal_path)
+                if owner is not None and not owner.closed:
+                    raise ValueError(f"El WAL {self.wal_path} ya tiene un buffer dueño (usar get_write_buffer)")
+                _wal_owners[self.wal_path] = self
+            self.replay_wal()
+        if flush_interval > 0:
+            self._timer = threading.Thread(target=self._flush_loop, args=(flush_interval,), daemon=True, name="zendell-write-buffer")
+            self._timer.start()
+        _open_buffers.add(self)
+
+    # ======== ENCOLADO ========
+
+    def insert(self, collection: str, doc: Dict[str, Any]) -> None:
+        """Encola una inserción."""
+        self._append({"op": "insert", "c": collection, "doc": doc})
+
+    def update(self, collection: str, filter: Dict[str, Any], update: Dict[str, Any], upsert: bool = False) -> None:
+        """Encola una actualización de un documento."""
+        self._append({"op": "update", "c": collection, "filter": filter, "update": update, "upsert": upsert})
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        with self.lock:
+            line = self._add(entry)
+            if line is not None:
+                with open(self.wal_path, "a", encoding="utf-8") as wal:
+                    wal.write(line + "\n")
+            full = self._pending >= self.max_pending
+        if full:
+            self.flush()
+
+    def _add(self, entry: Dict[str, Any]) -> Optional[str]:
+        """Numera y encola la operación (bajo `lock`); devuelve su línea del WAL si lo hay."""
+        self._seq += 1
+        entry["seq"] = self._seq
+        target = self._inserts if entry["op"] == "insert" else self._updates
+        target.setdefault(entry["c"], []).append(entry)
+        self._pending += 1
+        self._stats["buffered"] += 1
+        if not self.wal_path:
+            return None
+        line = json_util.dumps(entry)
+        self._logged[entry["seq"]] = line
+        return line
+
+    @staticmethod
+    def _user_of(entry: Dict[str, Any]) -> Any:
+        return (entry["doc"] if entry["op"] == "insert" else entry["filter"]).get("user_id")
+
+    # ======== OVERLAY PARA LECTURAS ========
+
+    @contextlib.contextmanager
+    def reading(self, collection: str, user_id: str) -> Iterator[None]:
+        """
+        Bloque para leer de MongoDB y aplicar lo pendiente sin que un flush cambie nada a mitad.
+        Solo espera si hay un lote del usuario en vuelo en esa colección; la lectura se hace
+        sin `lock` y, mientras dura, flush() no envía las operaciones de ese usuario.
+        """
+        key = (collection, user_id)
+        with self._flushed:
+            while self._in_flight.get(key):
+                self._flushed.wait()
+            self._readers[key] = self._readers.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                if self._readers[key] > 1:
+                    self._readers[key] -= 1
+                else:
+                    del self._readers[key]
+
+    def pending_inserts(self, collection: str, match: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Documentos pendientes de insertar en la colección que cumplen las igualdades de `match`."""
+        with self.lock:
+            return [
+                dict(entry["doc"]) for entry in self._inserts.get(collection, [])
+                if all(entry["doc"].get(k) == v for k, v in match.items())
+            ]
+
+    def apply_pending_updates(self, collection: str, user_id: str, doc: Dict[str, Any]) -> Dict[str, Any]:
+        """Aplica en memoria sobre `doc` las actualizaciones pendientes ($set y $push con $each/$slice)."""
+        with self.lock:
+            for entry in self._updates.get(collection, []):
+                if entry["filter"].get("user_id") != user_id:
+                    continue
+                for field_name, value in entry["update"].get("$set", {}).items():
+                    doc[field_name] = value
+                for field_name, spec in entry["update"].get("$push", {}).items():
+                    values = list(doc.get(field_name) or [])
+                    if isinstance(spec, dict) and "$each" in spec:
+                        values.extend(spec["$each"])
+                        if "$slice" in spec:
+                            values = values[spec["$slice"]:] if spec["$slice"] < 0 else values[:spec["$slice"]]
+                    else:
+                        values.append(spec)
+                    doc[field_name] = values
+            return doc
+
+    def has_pending(self) -> bool:
+        with self.lock:
+            return self._pending > 0
+
+    # ======== VACIADO ========
+
+    def flush(self) -> int:
+        """Envía todo lo pendiente a MongoDB. Devuelve el número de operaciones escritas."""
+        # Un flush a la vez, para que los lotes de una colección lleguen en orden
+        with self._flush_lock:
+            with self.lock:
+                if not self._pending:
+                    return 0
+                batches = self._take_batches()
+                for _, collection, entries in batches:
+                    self._mark_in_flight(collection, entries, 1)
+            if not batches:
+                return 0
+
+            written = 0
+            for position, (kind, collection, entries) in enumerate(batches):
+                operation = "insert_many" if kind == "insert" else "bulk_write"
+                started = time.perf_counter()
+                try:
+                    if kind == "insert":
+                        self.db[collection].insert_many([entry["doc"] for entry in entries], ordered=True)
+                    else:
+                        self.db[collection].bulk_write(
+                            [UpdateOne(e["filter"], e["update"], upsert=e["upsert"]) for e in entries], ordered=True
+                        )
+                except Exception as e:
+                    _notify_flush(collection, operation, (time.perf_counter() - started) * 1000)
+                    # Lotes ordenados: lo escrito antes del fallo no se repite; el resto vuelve al buffer
+                    logger.error("Error al vaciar %s: %s", collection, e)
+                    done = self._written_before_error(kind, e)
+                    with self.lock:
+                        self._stats["errors"] += 1
+                        self._finish(collection, entries[:done])
+                        self._requeue(batches[position:], skip=done)
+                    return written + done
+                _notify_flush(collection, operation, (time.perf_counter() - started) * 1000)
+                with self.lock:
+                    self._stats["round_trips"] += 1
+                    self._finish(collection, entries)
+                written += len(entries)
+            with self.lock:
+                self._stats["flushes"] += 1
+            return written
+
+    def _take_batches(self) -> List[Tuple[str, str, List[Dict[str, Any]]]]:
+        """Saca lo pendiente (bajo `lock`), salvo lo de usuarios con una lectura en curso en esa colección."""
+        batches = []
+        for kind, pending in (("insert", self._inserts), ("update", self._updates)):
+            for collection, entries in list(pending.items()):
+                held = [e for e in entries if self._readers.get((collection, self._user_of(e)))]
+                sent = [e for e in entries if not self._readers.get((collection, self._user_of(e)))]
+                if held:
+                    pending[collection] = held
+                else:
+                    del pending[collection]
+                if sent:
+                    batches.append((kind, collection, sent))
+                self._pending -= len(sent)
+        return batches
+
+    def _mark_in_flight(self, collection: str, entries: List[Dict[str, Any]], delta: int) -> None:
+        for entry in entries:
+            key = (collection, self._user_of(entry))
+            count = self._in_flight.get(key, 0) + delta
+            if count > 0:
+                self._in_flight[key] = count
+            else:
+                self._in_flight.pop(key, None)
+        self._flushed.notify_all()
+
+    def _finish(self, collection: str, entries: List[Dict[str, Any]]) -> None:
+        """Lote de la colección ya escrito: deja de estar en vuelo y sale del WAL."""
+        self._mark_in_flight(collection, entries, -1)
+        if self.wal_path and entries:
+            for entry in entries:
+                self._logged.pop(entry["seq"], None)
+            self._rewrite_wal()
+
+    @staticmethod
+    def _written_before_error(kind: str, error: Exception) -> int:
+        if isinstance(error, BulkWriteError):
+            details = error.details or {}
+            return details.get("nInserted", 0) if kind == "insert" else details.get("nMatched", 0) + details.get("nUpserted", 0)
+        return 0
+
+    def _requeue(self, batches, skip: int = 0) -> None:
+        """Devuelve al buffer los lotes no escritos, delante de lo encolado durante el flush."""
+        for index, (kind, collection, entries) in enumerate(batches):
+            entries = entries[skip:] if index == 0 else entries
+            self._mark_in_flight(collection, entries, -1)
+            target = self._inserts if kind == "insert" else self._updates
+            target[collection] = entries + target.get(collection, [])
+            self._pending += len(entries)
+
+    def _rewrite_wal(self) -> None:
+        """Reescribe el WAL con las operaciones aún no escritas (bajo `lock`)."""
+        tmp_path = self.wal_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as wal:
+            for line in self._logged.values():
+                wal.write(line + "\n")
+        os.replace(tmp_path, self.wal_path)
+
+    def _flush_loop(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            self.flush()
+
+    def replay_wal(self) -> int:
+        """Reaplica las operaciones de un WAL que no llegaron a vaciarse (p. ej. tras una caída)."""
+        if not self.wal_path or not os.path.exists(self.wal_path):
+            return 0
+        with open(self.wal_path, encoding="utf-8") as wal:
+            entries = [json_util.loads(line) for line in wal if line.strip()]
+        with self.lock:
+            for entry in entries:
+                self._add(entry)
+            # Las operaciones se renumeran: el fichero pasa a reflejar exactamente lo pendiente
+            self._rewrite_wal()
+        if entries:
+            logger.info("Reaplicando %s operaciones del WAL", len(entries))
+            self.flush()
+        return len(entries)
+
+    def close(self) -> None:
+        """Detiene el timer, vacía lo pendiente y libera el WAL (se llama también al salir del proceso)."""
+        self._stop.set()
+        self.flush()
+        self.closed = True
+        if self.wal_path:
+            with _wal_owners_lock:
+                if _wal_owners.get(self.wal_path) is self:
+                    _wal_owners.pop(self.wal_path, None)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self.lock:
+            return {**self._stats, "pending": self._pending}
+
+def get_write_buffer(db, owner_key: Any, wal_path: Optional[str] = None, **kwargs) -> WriteBuffer:
+    """
+    Buffer de escrituras para una base de datos. Con WAL se comparte un único buffer por
+    fichero entre los managers del proceso; `owner_key` (uri y base de datos) evita que dos
+    bases de datos distintas usen el mismo fichero.
+    """
+    if not wal_path:
+        return WriteBuffer(db, owner_key=owner_key, **kwargs)
+    path = os.path.abspath(wal_path)
+    with _wal_owners_lock:
+        owner = _wal_owners.get(path)
+        if owner is None or owner.closed:
+            return WriteBuffer(db, wal_path=path, owner_key=owner_key, **kwargs)
+    if owner.owner_key != owner_key:
+        raise ValueError(f"El WAL {path} ya lo usa otra base de datos: {owner.owner_key}")
+    return owner
+
+@atexit.register
+def _close_open_buffers() -> None:
+    for buffer in list(_open_buffers):
+        if not buffer.closed:
+            buffer.close()
@@ -3,10 +3,24 @@
 import discord
 import asyncio
 import os
-from config.settings import DISCORD_BOT_TOKEN
-from core.utils import get_timestamp
+import random
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
+from config.settings import (
+    DISCORD_BOT_TOKEN, DISCORD_SEND_RATE_PER_SECOND, DISCORD_SEND_BURST, DISCORD_SEND_MAX_RETRIES,
+    DISCORD_STREAM_EDIT_INTERVAL
+)
 from zendell.services.llm_provider import ask_gpt
 from zendell.core.db import MongoDBManager
+from zendell.core.rate_limit import TokenBucket
+from zendell.core.log import get_logger
+from zendell.services.messaging_service import PartialDelivery
+
+logger = get_logger(__name__)
+
+# Límite de caracteres de un mensaje de Discord
+DISCORD_MAX_MESSAGE_LENGTH = 2000
 
 close_app_task = None
 intents = discord.Intents.default()
@@ -21,18 +35,18 @@ client.default_channel = None
 
 @client.event
 async def on_ready():
-    print(f"{get_timestamp()}",f"[DISCORD] Bot conectado como {client.user}")
+    logger.info("Bot conectado como %s", client.user)
     found_channel = None
     for guild in client.guilds:
-        print(f"{get_timestamp()}",f"[DISCORD] Guild detectado: {guild.name} (ID: {guild.id})")
+        logger.info("Guild detectado: %s (ID: %s)", guild.name, guild.id)
         for channel in guild.text_channels:
             perms = channel.permissions_for(guild.me)
             if perms.send_messages:
-                print(f"{get_timestamp()}",f"  -> Canal: {channel.name} (ID: {channel.id}) - Enviable")
+                logger.debug("  -> Canal: %s (ID: %s) - Enviable", channel.name, channel.id)
                 if not found_channel:
                     found_channel = channel
     client.default_channel = found_channel
-    print(f"{get_timestamp()}",f"[DEBUG] client.default_channel asignado: {client.default_channel}")
+    logger.debug("client.default_channel asignado: %s", client.default_channel)
     if not client.first_ready:
         client.first_ready = True
         asyncio.create_task(send_first_message_system())
@@ -40,45 +54,246 @@ async def on_ready():
 async def send_first_message_system():
     await asyncio.sleep(3.0)
     if not client.default_channel:
-        print(f"{get_timestamp()}","[DISCORD] No hay un canal por defecto configurado (default_channel=None).")
+        logger.warning("No hay un canal por defecto configurado (default_channel=None).")
         return
     prompt = (
         "Eres Zendell, un sistema multiagente. Genera un mensaje de presentación amistoso en español. "
         "Saluda al usuario, explícale brevemente que eres un asistente y que te gustaría conocer su nombre, "
         "ocupación, gustos y metas. Indícale que estás para ayudarle. Sé amigable."
     )
-    greeting = ask_gpt(prompt)
+    # ask_gpt es bloqueante: se ejecuta en un hilo para no congelar el gateway
+    greeting = await asyncio.to_thread(ask_gpt, prompt)
     if not greeting:
         greeting = "¡Hola! Soy Zendell, tu asistente multiagente. ¿Podrías presentarte?"
     try:
-        await client.default_channel.send(greeting)
-        print(f"{get_timestamp()}",f"[DISCORD] Primer mensaje (sistema) enviado: {greeting}")
-        db_manager = MongoDBManager()
-        db_manager.save_conversation_message(user_id="system_init", role="assistant", content=greeting, extra_data={"step": "first_message_system"})
+        # Por la cola de salida, como el resto de mensajes: mismo token bucket y reintentos de 429
+        await outbound.send(client.default_channel, greeting)
+        logger.info("Primer mensaje (sistema) enviado: %s", greeting)
+        # Se reutiliza el manager del Communicator (mismo cliente y cachés); si no hay, el compartido del proceso
+        if client.communicator is not None:
+            db_manager = client.communicator.db_manager
+        else:
+            db_manager = MongoDBManager(ensure_indexes=False)
+        await asyncio.to_thread(
+            db_manager.save_conversation_message,
+            user_id="system_init", role="assistant", content=greeting, extra_data={"step": "first_message_system"}
+        )
     except Exception as e:
-        print(f"{get_timestamp()}",f"[DISCORD] Error enviando el primer mensaje: {e}")
+        logger.error("Error enviando el primer mensaje: %s", e)
 
 @client.event
 async def on_message(message):
     if message.author == client.user:
         return
     raw_msg = message.content.strip() or message.clean_content.strip()
-    print(f"{get_timestamp()}",f"[DISCORD] on_message => raw content: '{message.content}' | clean: '{message.clean_content}'")
+    logger.debug("on_message => raw content: '%s' | clean: '%s'", message.content, message.clean_content)
     if client.communicator and hasattr(client.communicator, "on_user_message"):
         await client.communicator.on_user_message(raw_msg, str(message.author.id))
 
+def split_message(text: str, limit: int = DISCORD_MAX_MESSAGE_LENGTH) -> List[str]:
+    """Divide un texto en trozos de como máximo `limit` caracteres, cortando preferentemente en saltos de línea."""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = text.rfind(" ", 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text:
+        chunks.append(text)
+    return chunks
+
+def _retry_after(error: Exception) -> float:
+    """Segundos a esperar si el error es un 429 de Discord; -1 si no lo es."""
+    if isinstance(error, discord.HTTPException) and error.status == 429:
+        return float(getattr(error, "retry_after", 0) or 0)
+    return -1
+
+class OutboundDispatcher:
+    """
+    Cola de salida por canal con limitación de tasa.
+
+    - Cada canal tiene su cola y su token bucket; los envíos a canales distintos no se bloquean.
+    - Los mensajes cortos consecutivos en cola se agrupan en uno solo (hasta 2000 caracteres)
+      y los largos se dividen.
+    - Un 429 se reintenta con backoff exponencial (respetando retry_after si viene).
+    - Las ediciones de mensajes (streaming) usan el mismo bucket y reintentos (edit()).
+    """
+
+    def __init__(
+        self,
+        rate_per_second: float = DISCORD_SEND_RATE_PER_SECOND,
+        burst: int = DISCORD_SEND_BURST,
+        max_retries: int = DISCORD_SEND_MAX_RETRIES,
+        max_length: int = DISCORD_MAX_MESSAGE_LENGTH
+    ):
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.max_retries = max_retries
+        self.max_length = max_length
+        self._queues: Dict[Any, Deque[Tuple[str, asyncio.Future, bool]]] = {}
+        self._buckets: Dict[Any, TokenBucket] = {}
+        self._workers: Dict[Any, asyncio.Task] = {}
+        self.sent_messages = 0
+        self.merged_messages = 0
+        self.rate_limited = 0
+
+    async def send(self, channel, text: str, merge: bool = True):
+        """
+        Encola un texto para el canal y espera a que se envíe. Devuelve el último mensaje enviado.
+        Con merge=False el texto se envía solo (p. ej. un mensaje que luego se editará).
+        """
+        key = getattr(channel, "id", id(channel))
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queues.setdefault(key, deque()).append((text, future, merge))
+        self._bucket(key)
+        if key not in self._workers:
+            self._workers[key] = loop.create_task(self._drain(key, channel))
+        return await future
+
+    async def edit(self, channel, message, text: str):
+        """Edita un mensaje ya enviado con el token bucket del canal, reintentando los 429."""
+        bucket = self._bucket(getattr(channel, "id", id(channel)))
+        await self._with_retry(channel, bucket, lambda: message.edit(content=text))
+        return message
+
+    def _bucket(self, key) -> TokenBucket:
+        if key not in self._buckets:
+            self._buckets[key] = TokenBucket(self.rate_per_second, self.burst)
+        return self._buckets[key]
+
+    def _next_batch(self, queue: Deque[Tuple[str, asyncio.Future, bool]]) -> Tuple[str, List[asyncio.Future]]:
+        """Saca de la cola los mensajes consecutivos que caben juntos en un solo envío."""
+        text, future, merge = queue.popleft()
+        futures = [future]
+        while merge and queue and queue[0][2] and len(text) + 2 + len(queue[0][0]) <= self.max_length:
+            next_text, next_future, _ = queue.popleft()
+            text = f"{text}\n\n{next_text}"
+            futures.append(next_future)
+            self.merged_messages += 1
+        return text, futures
+
+    async def _drain(self, key, channel) -> None:
+        queue = self._queues[key]
+        bucket = self._buckets[key]
+        try:
+            while queue:
+                text, futures = self._next_batch(queue)
+                try:
+                    sent = None
+                    for chunk in split_message(text, self.max_length):
+                        sent = await self._send_with_retry(channel, bucket, chunk)
+                    for future in futures:
+                        if not future.done():
+                            future.set_result(sent)
+                except Exception as e:
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(e)
+        finally:
+            self._workers.pop(key, None)
+
+    async def _send_with_retry(self, channel, bucket: TokenBucket, text: str):
+        sent = await self._with_retry(channel, bucket, lambda: channel.send(text))
+        self.sent_messages += 1
+        return sent
+
+    async def _with_retry(self, channel, bucket: TokenBucket, call):
+        attempt = 0
+        while True:
+            await bucket.acquire()
+            try:
+                return await call()
+            except Exception as e:
+                retry_after = _retry_after(e)
+                if retry_after < 0 or attempt >= self.max_retries:
+                    raise
+                self.rate_limited += 1
+                delay = max(retry_after, (2 ** attempt) * 0.5) + random.uniform(0, 0.25)
+                bucket.penalize(delay)
+                logger.warning("429 en canal %s, reintentando en %.2fs", getattr(channel, 'id', '?'), delay)
+                attempt += 1
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Métricas de la cola de salida."""
+        return {
+            "queued": {key: len(q) for key, q in self._queues.items() if q},
+            "sent_messages": self.sent_messages,
+            "merged_messages": self.merged_messages,
+            "rate_limited": self.rate_limited
+        }
+
+outbound = OutboundDispatcher()
+
+class ChannelUnavailable(ConnectionError):
+    """Todavía no hay un canal de Discord donde escribir (bot sin conectar o sin permisos)."""
+
+def _default_channel():
+    if not client.default_channel:
+        raise ChannelUnavailable("No hay un canal por defecto (default_channel=None)")
+    return client.default_channel
+
 async def send_dm(_user_id: str, text: str):
-    channel = client.default_channel
-    if not channel:
-        print(f"{get_timestamp()}","[DISCORD] No hay un canal por defecto (default_channel=None).")
-        return
-    await asyncio.sleep(0.5)
+    """
+    Envía el texto por la cola con rate limit. Los errores se propagan: MessagingService
+    (DiscordChannel) se encarga de reintentarlos y de marcar la entrega como fallida.
+    """
+    channel = _default_channel()
+    sent = await outbound.send(channel, text)
+    logger.debug("Mensaje enviado al canal %s: %s", channel.id, text)
+    return sent
+
+async def send_dm_stream(_user_id: str, stream):
+    """
+    Envía una respuesta en streaming: publica el mensaje con el primer texto recibido y
+    lo edita como mucho cada DISCORD_STREAM_EDIT_INTERVAL segundos. Al terminar, deja el
+    texto final completo (dividido en varios mensajes si supera el límite).
+    """
+    channel = _default_channel()
+    text = ""
+    shown = ""
+    message = None
+    last_edit = 0.0
+    async for part in stream:
+        text += part
+        if not text.strip() or len(text) > DISCORD_MAX_MESSAGE_LENGTH:
+            continue
+        now = time.monotonic()
+        if message is None:
+            message = await outbound.send(channel, text, merge=False)
+            shown, last_edit = text, now
+        elif now - last_edit >= DISCORD_STREAM_EDIT_INTERVAL:
+            try:
+                await outbound.edit(channel, message, text)
+                shown, last_edit = text, now
+            except Exception as e:
+                logger.error("Error editando mensaje en streaming: %s", e)
+
+    final = stream.final_text or text
+    if message is None:
+        return await outbound.send(channel, final)
+    chunks = split_message(final)
+    completed = 0
     try:
-        sent = await channel.send(text)
-        print(f"{get_timestamp()}",f"[DISCORD] Mensaje enviado al canal {channel.id}: {text}")
-        return sent
+        if chunks and chunks[0] != shown:
+            # Un 429 en la última edición se reintenta; si aun así falla, se reenvía lo que falta
+            await outbound.edit(channel, message, chunks[0])
+        completed = 1
+        for chunk in chunks[1:]:
+            message = await outbound.send(channel, chunk, merge=False)
+            completed += 1
     except Exception as e:
-        print(f"{get_timestamp()}",f"[DISCORD] Error enviando mensaje: {e}")
+        # El usuario ya ve parte de la respuesta: el reintento solo envía lo que falta
+        if completed == 0:
+            remaining = final[len(shown):].lstrip() if final.startswith(shown) else final
+        else:
+            remaining = "\n".join(chunks[completed:])
+        raise PartialDelivery(remaining, e) from e
+    logger.debug("Mensaje (streaming) enviado al canal %s: %s", channel.id, final)
+    return message
 
 async def start_bot():
     await client.login(DISCORD_BOT_TOKEN)
@@ -86,8 +301,8 @@ async def start_bot():
     await client.connect()
 
 async def schedule_app_close(timeout_minutes: int):
-    print(f"{get_timestamp()}","[DISCORD] Timer de cierre iniciado")
+    logger.info("Timer de cierre iniciado")
     await asyncio.sleep(timeout_minutes * 60)
-    print(f"{get_timestamp()}","[DISCORD] Cerrando aplicación por inactividad...")
+    logger.info("Cerrando aplicación por inactividad...")
     await client.close()
     os._exit(0)
\ No newline at end of file
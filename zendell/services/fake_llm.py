@@ -0,0 +1,180 @@
+# zendell/services/fake_llm.py
+
+import json
+import random
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+from config.settings import FAKE_LLM_LATENCY_MS, FAKE_LLM_JITTER_MS, FAKE_LLM_FAILURE_RATE, FAKE_LLM_SEED
+from zendell.services.llm_provider import LLMProvider, LLMResponse, register_provider
+
+# Una respuesta puede ser texto, un objeto (se serializa como JSON), una función que
+# recibe el último prompt o una lista de respuestas que se usan en orden (la última se repite)
+Response = Union[str, Dict[str, Any], List[Any], Callable[[str], Any]]
+
+class FakeLLMError(RuntimeError):
+    """Fallo simulado por FakeLLMProvider (failure_rate); transitorio, como un 5xx del proveedor."""
+    retryable = True
+
+def _quoted(prompt: str, default: str = "") -> str:
+    # Primer texto entre comillas simples del prompt (el mensaje del usuario en los agentes)
+    match = re.search(r"'([^']+)'", prompt)
+    return match.group(1) if match else default
+
+def _time_context(prompt: str) -> str:
+    match = re.search(r"contexto temporal '(\w+)'", prompt)
+    return match.group(1) if match else "past"
+
+def _profile(prompt: str) -> Dict[str, str]:
+    match = re.search(r"me llamo (\w+)", prompt, re.IGNORECASE)
+    if not match:
+        return {"name": "", "ocupacion": "", "gustos": "", "metas": ""}
+    return {"name": match.group(1), "ocupacion": "Desarrollador", "gustos": "Leer", "metas": "Aprender"}
+
+# Respuestas por defecto por call_site: el formato que espera cada función que llama al LLM
+DEFAULT_RESPONSES: Dict[str, Response] = {
+    "classify_activity": {"category": "Trabajo"},
+    "extract_sub_activities": lambda prompt: {"activities": [{
+        "title": _quoted(prompt, "Actividad")[:60],
+        "category": "Trabajo",
+        "importance": 5,
+        "time_context": _time_context(prompt)
+    }]},
+    "generate_clarification_questions": {"questions": ["¿Con quién estuviste?", "¿Cuánto tiempo te llevó?"]},
+    "extract_entities_from_activity": {"entities": []},
+    "clarifier_node": {"questions": ["¿Cómo te sentiste al hacerlo?", "¿Qué fue lo más difícil?"]},
+    "process_clarifier_response": {"analysis": [], "new_questions": []},
+    # El perfil se completa cuando el usuario se presenta ("me llamo ..."), como en una conversación real
+    "extract_and_update_user_info": lambda prompt: _profile(prompt),
+    "_extract_entities_from_message": {"entities": []},
+    "analyze_conversation": {"mood": "neutral", "topics": [], "concerns": [], "insights": [], "implicit_needs": []},
+    "analyze_tone": "neutral",
+    "classify_recommendation": "Bienestar",
+    "generate_recommendations": "1. Descanso: toma una pausa corta cada hora.\n2. Planificación: define la tarea principal de mañana.",
+    "extract_insights": "El usuario mantiene una rutina estable.\nPrioriza el trabajo por la mañana.",
+    "generate_system_insights": "El usuario es constante.\n\nPrefiere mensajes breves.",
+}
+
+DEFAULT_TEXT = "Entendido. ¿Qué más hiciste en la última hora?"
+
+class FakeLLMProvider(LLMProvider):
+    """
+    Proveedor local y determinista para tests y benchmarks sin red.
+
+    - Respuestas guionizadas o por reglas según `call_site`, con DEFAULT_RESPONSES
+      como base (JSON válido para las funciones que lo parsean).
+    - Latencia simulada: `latency_ms` fijo más ruido uniforme de ±`jitter_ms`, o una
+      función `latency(rng) -> ms` para cualquier otra distribución.
+    - `model_latency_ms` fija la latencia base por modelo (niveles rápidos y lentos).
+    - Con un `timeout` menor que la latencia se lanza TimeoutError tras esperar el timeout.
+    - `failure_rate` lanza FakeLLMError con esa probabilidad (ask_gpt devuelve None).
+    - Con `seed` las latencias y los fallos son reproducibles.
+    - `calls` guarda cada LLMResponse para inspeccionar qué se pidió y cuánto tardó
+      (metadata["response_format"] indica si se pidió salida JSON).
+    """
+    name = "fake"
+    supports_response_format = True
+
+    def __init__(
+        self,
+        responses: Optional[Dict[str, Response]] = None,
+        latency_ms: float = FAKE_LLM_LATENCY_MS,
+        jitter_ms: float = FAKE_LLM_JITTER_MS,
+        failure_rate: float = FAKE_LLM_FAILURE_RATE,
+        seed: Optional[int] = FAKE_LLM_SEED,
+        latency: Optional[Callable[[random.Random], float]] = None,
+        default: Response = DEFAULT_TEXT,
+        sleep: bool = True,
+        model_latency_ms: Optional[Dict[str, float]] = None
+    ):
+        self.responses = {**DEFAULT_RESPONSES, **(responses or {})}
+        self.default = default
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.latency = latency
+        self.model_latency_ms = dict(model_latency_ms or {})
+        self.sleep = sleep
+        self.calls: List[LLMResponse] = []
+        self._rng = random.Random(seed)
+        self._positions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _sample(self, model: str = "") -> Tuple[float, bool]:
+        with self._lock:
+            if self.latency is not None:
+                delay = self.latency(self._rng)
+            else:
+                base = self.model_latency_ms.get(model, self.latency_ms)
+                delay = base + self._rng.uniform(-self.jitter_ms, self.jitter_ms)
+            failed = self._rng.random() < self.failure_rate
+        return max(delay, 0.0), failed
+
+    def _render(self, call_site: str, prompt: str) -> str:
+        response = self.responses.get(call_site, self.default)
+        if isinstance(response, list) and response:
+            with self._lock:
+                position = self._positions.get(call_site, 0)
+                self._positions[call_site] = position + 1
+            response = response[min(position, len(response) - 1)]
+        if callable(response):
+            response = response(prompt)
+        if isinstance(response, (dict, list)):
+            return json.dumps(response, ensure_ascii=False)
+        return str(response)
+
+    def complete(self, messages: List[Dict[str, str]], model: str, temperature: float, call_site: str = "", timeout: Optional[float] = None,
+                 response_format: Optional[Dict[str, Any]] = None) -> LLMResponse:
+        delay_ms, failed = self._sample(model)
+        if timeout and delay_ms > timeout * 1000:
+            if self.sleep:
+                time.sleep(timeout)
+            raise TimeoutError(f"Timeout simulado de {model} en {call_site or 'llamada'} ({timeout}s)")
+        if self.sleep and delay_ms:
+            time.sleep(delay_ms / 1000)
+        if failed:
+            raise FakeLLMError(f"Fallo simulado en {call_site or 'llamada'}")
+
+        prompt = messages[-1]["content"] if messages else ""
+        text = self._render(call_site, prompt)
+        response = LLMResponse(
+            text=text,
+            model=model,
+            provider=self.name,
+            call_site=call_site,
+            latency_ms=delay_ms,
+            # Aproximación de tokens: ~4 caracteres por token
+            prompt_tokens=sum(len(m.get("content") or "") for m in messages) // 4,
+            completion_tokens=len(text) // 4,
+            metadata={"response_format": response_format["type"]} if response_format else {}
+        )
+        with self._lock:
+            self.calls.append(response)
+        return response
+
+    def stream(self, messages: List[Dict[str, str]], model: str, temperature: float, call_site: str = "", timeout: Optional[float] = None,
+               response_format: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """La latencia se aplica antes del primer fragmento; después, una palabra por fragmento."""
+        text = self.complete(messages, model, temperature, call_site, timeout, response_format).text
+        for index, word in enumerate(text.split(" ")):
+            yield word if index == 0 else " " + word
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls.clear()
+            self._positions.clear()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Número de llamadas y latencia simulada media por call_site."""
+        with self._lock:
+            by_site: Dict[str, Dict[str, float]] = {}
+            for call in self.calls:
+                site = by_site.setdefault(call.call_site, {"calls": 0, "latency_ms": 0.0})
+                site["calls"] += 1
+                site["latency_ms"] += call.latency_ms
+            for site in by_site.values():
+                site["latency_ms"] = round(site["latency_ms"] / site["calls"], 2)
+            return {"calls": len(self.calls), "by_call_site": by_site}
+
+register_provider(FakeLLMProvider())
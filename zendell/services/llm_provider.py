@@ -1,47 +1,429 @@
 # zendell/services/llm_provider.py
 
-from openai import OpenAI
-from typing import Optional, List, Dict, Any
-from config.settings import OPENAI_API_KEY
-from core.utils import get_timestamp
+import asyncio
+import importlib
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from openai import OpenAI, AsyncOpenAI
+from typing import Optional, List, Dict, Any, Callable, Iterator, AsyncIterator
+from config.settings import OPENAI_API_KEY, LLM_PROVIDER
+from zendell.core.log import get_logger
+from zendell.core.executor import check_cancelled
+from zendell.services import model_router, llm_resilience, llm_scheduler
+from zendell.services.llm_resilience import TIMEOUT_ERRORS
+
+logger = get_logger(__name__)
 
 # Global variable to store the selected model
+# (modelo del nivel "standard" de services/model_router.py y de los niveles sin modelo propio)
 SELECTED_MODEL = "gpt-4o"
 
 def set_global_model(model_name: str):
     """Set the global model to use for all LLM requests."""
     global SELECTED_MODEL
     SELECTED_MODEL = model_name
-    print(f"{get_timestamp()}", f"[LLM_PROVIDER] Model set to: {SELECTED_MODEL}")
+    logger.info("Model set to: %s", SELECTED_MODEL)
 
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+# Los reintentos los hace llm_resilience (con plazo y circuit breaker), no el cliente
+openai_client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+async_openai_client = None
 
-def ask_gpt(prompt: str, model: str = None, temperature: float = 0.7) -> Optional[str]:
-    # Use the global model if no specific model is provided
-    model_to_use = model if model else SELECTED_MODEL
-    
-    try:
+def get_async_client() -> AsyncOpenAI:
+    """Cliente asíncrono de OpenAI, creado la primera vez que se usa (requiere un event loop)."""
+    global async_openai_client
+    if async_openai_client is None:
+        async_openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+    return async_openai_client
+
+# ======== PROVEEDORES ========
+
+def _timeout_kwargs(timeout: Optional[float]) -> Dict[str, Any]:
+    # El cliente de OpenAI interpreta timeout=None como "sin límite": solo se pasa si hay uno
+    return {"timeout": timeout} if timeout else {}
+
+def _format_kwargs(provider: "LLMProvider", response_format: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    # Solo se pasa a los proveedores que declaran supports_response_format: los demás reciben
+    # la llamada de siempre (el JSON se valida igual en services/structured_output.py)
+    return {"response_format": response_format} if response_format and provider.supports_response_format else {}
+
+@dataclass
+class LLMResponse:
+    """Resultado de una llamada al LLM con los datos necesarios para medirla."""
+    text: str
+    model: str
+    provider: str
+    call_site: str = ""
+    latency_ms: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+class LLMProvider:
+    """
+    Interfaz de un backend de LLM. `call_site` identifica la función que hace la
+    llamada (p. ej. "extract_sub_activities") para respuestas y métricas por sitio.
+    Los errores se propagan como excepciones; las funciones ask_gpt* los registran.
+    `timeout` (segundos) es el límite del nivel de modelo; al superarlo se lanza uno de TIMEOUT_ERRORS.
+    `response_format` pide salida JSON con el formato de la API de OpenAI ({"type": "json_object"}
+    o {"type": "json_schema", ...}); solo se envía a los proveedores con supports_response_format.
+    """
+    name = "base"
+    supports_response_format = False
+
+    def complete(self, messages: List[Dict[str, str]], model: str, temperature: float, call_site: str = "", timeout: Optional[float] = None,
+                 response_format: Optional[Dict[str, Any]] = None) -> LLMResponse:
+        raise NotImplementedError
+
+    def stream(self, messages: List[Dict[str, str]], model: str, temperature: float, call_site: str = "", timeout: Optional[float] = None,
+               response_format: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """Por defecto, la respuesta completa como un único fragmento."""
+        yield self.complete(messages, model, temperature, call_site, timeout, **_format_kwargs(self, response_format)).text
+
+    async def astream(self, messages: List[Dict[str, str]], model: str, temperature: float, call_site: str = "", timeout: Optional[float] = None,
+                      response_format: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        response = await asyncio.to_thread(self.complete, messages, model, temperature, call_site, timeout, **_format_kwargs(self, response_format))
+        yield response.text
+
+class OpenAIProvider(LLMProvider):
+    name = "openai"
+    supports_response_format = True
+
+    def complete(self, messages: List[Dict[str, str]], model: str, temperature: float, call_site: str = "", timeout: Optional[float] = None,
+                 response_format: Optional[Dict[str, Any]] = None) -> LLMResponse:
+        started = time.perf_counter()
         response = openai_client.chat.completions.create(
-            model=model_to_use,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=temperature
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            **_timeout_kwargs(timeout),
+            **_format_kwargs(self, response_format)
+        )
+        usage = getattr(response, "usage", None)
+        return LLMResponse(
+            text=response.choices[0].message.content.strip(),
+            model=model,
+            provider=self.name,
+            call_site=call_site,
+            latency_ms=(time.perf_counter() - started) * 1000,
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0
         )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        print(f"{get_timestamp()}", f"[ERROR] when asking GPT: {e}")
-        return None
 
-def ask_gpt_chat(messages: List[Dict[str, str]], model: str = None, temperature: float = 0.7) -> Optional[str]:
-    # Use the global model if no specific model is provided
-    model_to_use = model if model else SELECTED_MODEL
-    
-    try:
-        response = openai_client.chat.completions.create(
-            model=model_to_use,
+    def stream(self, messages: List[Dict[str, str]], model: str, temperature: float, call_site: str = "", timeout: Optional[float] = None,
+               response_format: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        stream = openai_client.chat.completions.create(
+            model=model,
             messages=messages,
-            temperature=temperature
+            temperature=temperature,
+            stream=True,
+            **_timeout_kwargs(timeout),
+            **_format_kwargs(self, response_format)
         )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        print(f"{get_timestamp()}", f"[ERROR] when asking GPT (chat mode): {e}")
-        return None
\ No newline at end of file
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def astream(self, messages: List[Dict[str, str]], model: str, temperature: float, call_site: str = "", timeout: Optional[float] = None,
+                      response_format: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        stream = await get_async_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+            **_timeout_kwargs(timeout),
+            **_format_kwargs(self, response_format)
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+# Registro de proveedores; los incluidos en el paquete se importan la primera vez que se piden
+_providers: Dict[str, LLMProvider] = {"openai": OpenAIProvider()}
+_builtin_modules = {"fake": "zendell.services.fake_llm"}
+_active = {"name": LLM_PROVIDER}
+_registry_lock = threading.Lock()
+
+def register_provider(provider: LLMProvider, name: Optional[str] = None) -> None:
+    """Registra (o reemplaza) un proveedor bajo su nombre."""
+    with _registry_lock:
+        _providers[name or provider.name] = provider
+
+def set_provider(name_or_provider) -> LLMProvider:
+    """Selecciona el proveedor activo por nombre o pasando una instancia (que se registra)."""
+    if isinstance(name_or_provider, LLMProvider):
+        register_provider(name_or_provider)
+        name_or_provider = name_or_provider.name
+    provider = get_provider(name_or_provider)
+    _active["name"] = name_or_provider
+    logger.info("Provider set to: %s", name_or_provider)
+    return provider
+
+def get_provider(name: Optional[str] = None) -> LLMProvider:
+    """Devuelve el proveedor indicado o el activo (LLM_PROVIDER por defecto)."""
+    name = name or _active["name"]
+    if name not in _providers and name in _builtin_modules:
+        importlib.import_module(_builtin_modules[name])
+    try:
+        return _providers[name]
+    except KeyError:
+        raise ValueError(f"Proveedor de LLM desconocido: {name}") from None
+
+# Funciones que reciben cada LLMResponse (también las fallidas, con metadata["error"]);
+# core/instrumentation.py se registra aquí para medir las llamadas de cada turno
+_listeners: List[Callable[[LLMResponse], None]] = []
+
+def add_listener(listener: Callable[[LLMResponse], None]) -> None:
+    """Registra una función que se llama tras cada llamada al LLM."""
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+def remove_listener(listener: Callable[[LLMResponse], None]) -> None:
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+class CallSkipped(Exception):
+    """Un guard decide no hacer la llamada (p. ej. presupuesto agotado); ask_gpt* devuelven None."""
+
+# Funciones (call_site, model) -> model que se consultan antes de cada llamada: pueden
+# cambiar el modelo o lanzar CallSkipped (services/llm_usage.py aplica los presupuestos)
+_guards: List[Callable[[str, str], str]] = []
+
+def add_guard(guard: Callable[[str, str], str]) -> None:
+    """Registra una función que se consulta antes de cada llamada al LLM."""
+    if guard not in _guards:
+        _guards.append(guard)
+
+def remove_guard(guard: Callable[[str, str], str]) -> None:
+    if guard in _guards:
+        _guards.remove(guard)
+
+def _guarded_model(call_site: str, model: str) -> str:
+    for guard in list(_guards):
+        model = guard(call_site, model)
+    return model
+
+def _notify(response: LLMResponse) -> None:
+    for listener in list(_listeners):
+        try:
+            listener(response)
+        except Exception as e:
+            logger.error("Error en listener %s: %s", getattr(listener, '__name__', listener), e)
+
+def _failed_response(provider_name: str, model: str, call_site: str, started: float, error: Exception, **metadata) -> LLMResponse:
+    return LLMResponse(
+        text="",
+        model=model,
+        provider=provider_name,
+        call_site=call_site,
+        latency_ms=(time.perf_counter() - started) * 1000,
+        metadata={"error": str(error) or type(error).__name__, **metadata}
+    )
+
+def _streamed_response(provider: LLMProvider, model: str, call_site: str, started: float, messages: List[Dict[str, str]], text: str) -> LLMResponse:
+    # El streaming no devuelve uso de tokens: se aproxima con ~4 caracteres por token
+    return LLMResponse(
+        text=text,
+        model=model,
+        provider=provider.name,
+        call_site=call_site,
+        latency_ms=(time.perf_counter() - started) * 1000,
+        prompt_tokens=sum(len(m.get("content") or "") for m in messages) // 4,
+        completion_tokens=len(text) // 4,
+        metadata={"stream": True}
+    )
+
+def _attempts(call_site: str, model: Optional[str]) -> List[model_router.Attempt]:
+    # Un modelo explícito se respeta tal cual; si no, el nivel de la ruta y su cadena de respaldo
+    if model:
+        return [model_router.Attempt("", model)]
+    return model_router.router.plan(call_site, SELECTED_MODEL)
+
+def _attempt_failed(call: llm_resilience.ResilientCall, attempt: model_router.Attempt, call_site: str, started: float,
+                    error: Exception, last_tier: bool, delivered: bool = False, **metadata) -> str:
+    # Registra el intento fallido y devuelve la decisión de ResilientCall (reintento, nivel de respaldo o fallo)
+    action = call.failed(error, last_tier, delivered)
+    timed_out = llm_resilience.is_timeout(error)
+    if timed_out:
+        model_router.router.record(attempt.tier, timed_out=True)
+    _notify(_failed_response(_active["name"], attempt.model, call_site, started, error,
+                             tier=attempt.tier, timeout=timed_out, retry=action == call.RETRY, **metadata))
+    if action == call.NEXT_TIER:
+        logger.warning("Timeout de %s en %s tras %ss; se prueba el nivel de respaldo", attempt.model, call_site, attempt.timeout)
+    elif action == call.RETRY:
+        logger.warning("Error transitorio del LLM (%s): %s; reintento %s en %.2fs", call_site, error, call.retries, call.delay)
+    else:
+        logger.error("Error when asking the LLM (%s, %s): %s", call_site, attempt.model, error)
+    return action
+
+def _fallback_response(call_site: str, messages: List[Dict[str, str]], model: str, reason: Exception) -> Optional[LLMResponse]:
+    # Respuesta en caché o neutra cuando el proveedor no está disponible; None si no hay ninguna
+    text, source = llm_resilience.fallback_text(call_site, messages)
+    logger.debug("LLM no disponible (%s): %s; respaldo: %s", call_site, reason, source or "ninguno")
+    if text is None:
+        return None
+    return LLMResponse(text=text, model=model, provider="fallback", call_site=call_site, metadata={"fallback": source})
+
+def _succeeded(call: llm_resilience.ResilientCall, ticket: llm_scheduler.Ticket, attempt: model_router.Attempt, response: LLMResponse) -> None:
+    call.succeeded(response.text)
+    # Uso real para corregir el TPM reservado y espera en la cola del planificador
+    ticket.used_tokens = response.prompt_tokens + response.completion_tokens
+    response.metadata["queue_ms"] = round(ticket.wait_ms, 1)
+    if attempt.tier:
+        response.metadata["tier"] = attempt.tier
+        model_router.router.record(attempt.tier, response.latency_ms)
+    _notify(response)
+
+def _reserve(attempts: List[model_router.Attempt], index: int) -> float:
+    # Segundos que necesitan los niveles de respaldo que quedan tras el intento `index`
+    return sum(attempt.timeout or 0 for attempt in attempts[index + 1:])
+
+def _caller() -> str:
+    # Nombre de la función que llamó a ask_gpt*, usado como call_site por defecto
+    return sys._getframe(2).f_code.co_name
+
+# ======== API DE LOS AGENTES ========
+
+def ask_llm(messages: List[Dict[str, str]], model: str = None, temperature: float = 0.7, call_site: str = "",
+            response_format: Optional[Dict[str, Any]] = None) -> Optional[LLMResponse]:
+    """
+    Llamada completa con el proveedor activo; devuelve LLMResponse o None si falla.
+    `response_format` pide salida JSON al proveedor (ver services/structured_output.py).
+    Sin `model`, el modelo y el tiempo máximo salen del nivel de call_site (model_router);
+    si se agota el tiempo se repite con el nivel de respaldo. Los errores transitorios se
+    reintentan dentro del plazo de la llamada; con el circuito abierto o el plazo agotado
+    se responde con la caché o la respuesta por defecto de llm_resilience.
+    """
+    # Un trabajo abandonado por el executor no gasta más llamadas
+    check_cancelled()
+    attempts = _attempts(call_site, model)
+    call = llm_resilience.ResilientCall(_active["name"], call_site, messages)
+    try:
+        for index, attempt in enumerate(attempts):
+            try:
+                attempt.model = _guarded_model(call_site, attempt.model)
+            except CallSkipped as e:
+                logger.debug("Llamada omitida (%s): %s", call_site, e)
+                return None
+            while True:
+                # Hueco del planificador (carril, RPM/TPM); la espera cuenta en el plazo de la llamada
+                with llm_scheduler.slot(messages, call.remaining()) as ticket:
+                    timeout = call.begin(attempt.timeout, _reserve(attempts, index))
+                    started = time.perf_counter()
+                    try:
+                        provider = get_provider()
+                        response = provider.complete(messages, attempt.model, temperature, call_site, timeout=timeout,
+                                                     **_format_kwargs(provider, response_format))
+                    except Exception as e:
+                        ticket.error = e
+                        action = _attempt_failed(call, attempt, call_site, started, e, last_tier=index == len(attempts) - 1)
+                    else:
+                        _succeeded(call, ticket, attempt, response)
+                        return response
+                # El backoff se espera fuera del hueco
+                if action == call.RETRY:
+                    time.sleep(call.delay)
+                    continue
+                if action == call.NEXT_TIER:
+                    break
+                return None
+    except llm_resilience.Unavailable as e:
+        return _fallback_response(call_site, messages, attempts[0].model, e)
+    return None
+
+def ask_gpt(prompt: str, model: str = None, temperature: float = 0.7, call_site: str = None) -> Optional[str]:
+    response = ask_llm([{"role": "user", "content": prompt}], model, temperature, call_site or _caller())
+    return response.text if response else None
+
+def ask_gpt_chat(messages: List[Dict[str, str]], model: str = None, temperature: float = 0.7, call_site: str = None) -> Optional[str]:
+    response = ask_llm(messages, model, temperature, call_site or _caller())
+    return response.text if response else None
+
+def ask_gpt_chat_stream(messages: List[Dict[str, str]], model: str = None, temperature: float = 0.7, call_site: str = None) -> Iterator[str]:
+    """
+    Versión en streaming de ask_gpt_chat: produce los fragmentos de texto a medida
+    que llegan. Si la llamada falla no produce nada (el llamador decide el fallback).
+    Los reintentos y el cambio de nivel solo ocurren antes del primer fragmento.
+    """
+    call_site = call_site or _caller()
+    check_cancelled()
+    attempts = _attempts(call_site, model)
+    call = llm_resilience.ResilientCall(_active["name"], call_site, messages)
+    try:
+        for index, attempt in enumerate(attempts):
+            try:
+                attempt.model = _guarded_model(call_site, attempt.model)
+            except CallSkipped as e:
+                logger.debug("Llamada omitida (%s): %s", call_site, e)
+                return
+            while True:
+                with llm_scheduler.slot(messages, call.remaining()) as ticket:
+                    timeout = call.begin(attempt.timeout, _reserve(attempts, index))
+                    started = time.perf_counter()
+                    chunks: List[str] = []
+
+                    try:
+                        provider = get_provider()
+                        for chunk in provider.stream(messages, attempt.model, temperature, call_site, timeout=timeout):
+                            chunks.append(chunk)
+                            yield chunk
+                    except Exception as e:
+                        ticket.error = e
+                        action = _attempt_failed(call, attempt, call_site, started, e, last_tier=index == len(attempts) - 1,
+                                                 delivered=bool(chunks), stream=True)
+                    else:
+                        _succeeded(call, ticket, attempt, _streamed_response(provider, attempt.model, call_site, started, messages, "".join(chunks)))
+                        return
+                if action == call.RETRY:
+                    time.sleep(call.delay)
+                    continue
+                if action == call.NEXT_TIER:
+                    break
+                return
+    except llm_resilience.Unavailable as e:
+        fallback = _fallback_response(call_site, messages, attempts[0].model, e)
+        if fallback is not None:
+            yield fallback.text
+
+async def ask_gpt_chat_stream_async(messages: List[Dict[str, str]], model: str = None, temperature: float = 0.7, call_site: str = None) -> AsyncIterator[str]:
+    """Variante asíncrona de ask_gpt_chat_stream para usar directamente en el event loop."""
+    call_site = call_site or _caller()
+    check_cancelled()
+    attempts = _attempts(call_site, model)
+    call = llm_resilience.ResilientCall(_active["name"], call_site, messages)
+    try:
+        for index, attempt in enumerate(attempts):
+            try:
+                attempt.model = _guarded_model(call_site, attempt.model)
+            except CallSkipped as e:
+                logger.debug("Llamada omitida (%s): %s", call_site, e)
+                return
+            while True:
+                async with llm_scheduler.aslot(messages, call.remaining()) as ticket:
+                    timeout = call.begin(attempt.timeout, _reserve(attempts, index))
+                    started = time.perf_counter()
+                    chunks: List[str] = []
+
+                    try:
+                        provider = get_provider()
+                        async for chunk in provider.astream(messages, attempt.model, temperature, call_site, timeout=timeout):
+                            chunks.append(chunk)
+                            yield chunk
+                    except Exception as e:
+                        ticket.error = e
+                        action = _attempt_failed(call, attempt, call_site, started, e, last_tier=index == len(attempts) - 1,
+                                                 delivered=bool(chunks), stream=True)
+                    else:
+                        _succeeded(call, ticket, attempt, _streamed_response(provider, attempt.model, call_site, started, messages, "".join(chunks)))
+                        return
+                if action == call.RETRY:
+                    await asyncio.sleep(call.delay)
+                    continue
+                if action == call.NEXT_TIER:
+                    break
+                return
+    except llm_resilience.Unavailable as e:
+        fallback = _fallback_response(call_site, messages, attempts[0].model, e)
+        if fallback is not None:
+            yield fallback.text
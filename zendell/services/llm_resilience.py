@@ -0,0 +1,304 @@
+# zendell/services/llm_resilience.py
+"""
+Resiliencia de las llamadas al LLM ante caídas o degradación del proveedor.
+
+- Plazo por llamada (LLM_CALL_DEADLINE_SECONDS): limita el tiempo total, reintentos y
+  niveles de respaldo incluidos; el timeout de cada intento nunca supera lo que queda y
+  deja sitio a los niveles de respaldo que faltan: si no caben todos, cada nivel recibe
+  una parte del plazo restante proporcional a su timeout.
+- Reintentos acotados (LLM_MAX_RETRIES) con backoff exponencial y jitter completo ante
+  errores transitorios: timeouts, errores de conexión, 429 y 5xx. Los errores definitivos
+  (400, autenticación...) no se reintentan.
+- Circuit breaker por proveedor: tras LLM_BREAKER_FAILURE_THRESHOLD fallos transitorios
+  seguidos el circuito se abre y las llamadas no llegan al proveedor durante
+  LLM_BREAKER_RESET_SECONDS; después se deja pasar una llamada de prueba (semiabierto).
+- Con el circuito abierto o el plazo agotado no se llama al proveedor: se responde con la
+  última respuesta a una petición idéntica (caché en memoria) o con una respuesta neutra
+  por call_site, si la hay; si no (o si fallan los reintentos), ask_gpt devuelve None y
+  cada agente usa su valor por defecto.
+
+llm_provider usa ResilientCall en ask_llm y en las funciones de streaming.
+"""
+
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+from config.settings import (
+    LLM_CALL_DEADLINE_SECONDS, LLM_MAX_RETRIES, LLM_RETRY_BASE_SECONDS, LLM_RETRY_MAX_SECONDS,
+    LLM_BREAKER_FAILURE_THRESHOLD, LLM_BREAKER_RESET_SECONDS,
+    LLM_RESPONSE_CACHE_SIZE, LLM_RESPONSE_CACHE_TTL_SECONDS
+)
+from zendell.core.log import get_logger
+
+logger = get_logger(__name__)
+
+# Errores que indican que la llamada superó su tiempo máximo (se prueba el nivel de respaldo)
+TIMEOUT_ERRORS = (TimeoutError, APITimeoutError)
+# Errores transitorios del proveedor que merece la pena reintentar
+RETRYABLE_ERRORS = TIMEOUT_ERRORS + (ConnectionError, APIConnectionError, RateLimitError, InternalServerError)
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+# Respuestas neutras por call_site para cuando el proveedor no está disponible
+FALLBACK_RESPONSES: Dict[str, str] = {
+    "analyze_tone": "neutral",
+    "extract_entities_from_activity": '{"entities": []}',
+    "_extract_entities_from_message": '{"entities": []}',
+}
+
+def is_timeout(error: BaseException) -> bool:
+    return isinstance(error, TIMEOUT_ERRORS)
+
+def is_retryable(error: BaseException) -> bool:
+    """True para errores transitorios (timeouts, conexión, 429, 5xx)."""
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    if getattr(error, "status_code", None) in RETRYABLE_STATUS:
+        return True
+    # Otros proveedores (p. ej. el fake) marcan sus errores transitorios con retryable = True
+    return bool(getattr(error, "retryable", False))
+
+def retry_after(error: BaseException) -> float:
+    # Segundos pedidos por el proveedor en la cabecera Retry-After (429/503), si los hay
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after", 0) or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+class Unavailable(Exception):
+    """El proveedor no se llama: circuito abierto o plazo de la llamada agotado."""
+
+@dataclass
+class RetryPolicy:
+    """Plazo total por llamada y reintentos con backoff exponencial y jitter completo."""
+    deadline_seconds: float = LLM_CALL_DEADLINE_SECONDS
+    max_retries: int = LLM_MAX_RETRIES
+    base_seconds: float = LLM_RETRY_BASE_SECONDS
+    max_seconds: float = LLM_RETRY_MAX_SECONDS
+
+    def backoff(self, retry: int, rng: random.Random) -> float:
+        """Espera antes del reintento `retry` (0, 1, ...): uniforme entre 0 y base * 2^retry (acotado)."""
+        return rng.uniform(0, min(self.max_seconds, self.base_seconds * (2 ** retry)))
+
+class CircuitBreaker:
+    """Circuito cerrado / abierto / semiabierto a partir de los fallos transitorios seguidos."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = LLM_BREAKER_FAILURE_THRESHOLD, reset_seconds: float = LLM_BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._opened = 0
+        self._rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at >= self.reset_seconds:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self) -> bool:
+        """True si la llamada puede llegar al proveedor (en semiabierto, solo una de prueba a la vez)."""
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("Circuito del proveedor %s cerrado", self.name)
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probing or (self._opened_at is None and self._failures >= self.failure_threshold > 0):
+                # Falla la llamada de prueba o se alcanza el umbral: se abre (de nuevo) el circuito
+                if self._opened_at is None:
+                    self._opened += 1
+                    logger.warning("Circuito del proveedor %s abierto tras %s fallos seguidos", self.name, self._failures)
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self._state(),
+                "consecutive_failures": self._failures,
+                "opened": self._opened,
+                "rejected": self._rejected
+            }
+
+class ResponseCache:
+    """Últimas respuestas por petición (call_site + mensajes), con tamaño y antigüedad máximos."""
+
+    def __init__(self, max_entries: int = LLM_RESPONSE_CACHE_SIZE, ttl_seconds: float = LLM_RESPONSE_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+    @staticmethod
+    def key(call_site: str, messages: List[Dict[str, str]]) -> str:
+        payload = json.dumps([call_site, messages], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def put(self, call_site: str, messages: List[Dict[str, str]], text: str) -> None:
+        if self.max_entries <= 0 or not text:
+            return
+        key = self.key(call_site, messages)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, call_site: str, messages: List[Dict[str, str]]) -> Optional[str]:
+        key = self.key(call_site, messages)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, text = entry
+            if self.ttl_seconds > 0 and time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            return text
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+policy = RetryPolicy()
+cache = ResponseCache()
+breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+_rng = random.Random()
+_stats = {"retries": 0, "fallbacks": 0, "deadline_exceeded": 0}
+_stats_lock = threading.Lock()
+
+def _count(name: str) -> None:
+    with _stats_lock:
+        _stats[name] += 1
+
+def get_breaker(provider_name: str) -> CircuitBreaker:
+    """Circuit breaker del proveedor (se crea la primera vez)."""
+    breaker = breakers.get(provider_name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = breakers.setdefault(provider_name, CircuitBreaker(provider_name))
+    return breaker
+
+def fallback_text(call_site: str, messages: List[Dict[str, str]]) -> Tuple[Optional[str], str]:
+    """Respuesta de respaldo y su origen ("cache" o "default"); (None, "") si no hay."""
+    _count("fallbacks")
+    cached = cache.get(call_site, messages)
+    if cached is not None:
+        return cached, "cache"
+    if call_site in FALLBACK_RESPONSES:
+        return FALLBACK_RESPONSES[call_site], "default"
+    return None, ""
+
+class ResilientCall:
+    """
+    Estado de una llamada al LLM: plazo restante, reintentos hechos y breaker del proveedor.
+    llm_provider llama a begin() antes de cada intento y a failed()/succeeded() después.
+    """
+    NEXT_TIER = "next_tier"
+    RETRY = "retry"
+    FAIL = "fail"
+
+    def __init__(self, provider_name: str, call_site: str, messages: List[Dict[str, str]], retry_policy: Optional[RetryPolicy] = None):
+        self.policy = retry_policy or policy
+        self.breaker = get_breaker(provider_name)
+        self.call_site = call_site
+        self.messages = messages
+        self.retries = 0
+        self.delay = 0.0
+        self._deadline = time.monotonic() + self.policy.deadline_seconds if self.policy.deadline_seconds > 0 else None
+
+    def remaining(self) -> Optional[float]:
+        if self._deadline is None:
+            return None
+        return self._deadline - time.monotonic()
+
+    def begin(self, timeout: Optional[float], reserve: float = 0.0) -> Optional[float]:
+        """
+        Timeout del intento (el del nivel acotado al plazo restante); Unavailable si no se debe llamar.
+        `reserve` son los segundos de los niveles de respaldo que quedan por detrás de este.
+        """
+        remaining = self.remaining()
+        if remaining is not None:
+            if remaining <= 0:
+                _count("deadline_exceeded")
+                raise Unavailable(f"plazo de {self.policy.deadline_seconds}s agotado")
+            wanted = timeout or remaining
+            if reserve > 0 and wanted + reserve > remaining:
+                # No caben este intento y los respaldos: cada nivel recibe su parte proporcional
+                wanted = remaining * wanted / (wanted + reserve)
+            timeout = min(wanted, remaining)
+        if not self.breaker.allow():
+            raise Unavailable(f"circuito del proveedor {self.breaker.name} abierto")
+        return timeout
+
+    def failed(self, error: BaseException, last_tier: bool, delivered: bool = False) -> str:
+        """Decide qué hacer tras un error: NEXT_TIER, RETRY (esperando self.delay) o FAIL."""
+        retryable = is_retryable(error)
+        if retryable:
+            self.breaker.record_failure()
+        else:
+            # El proveedor respondió (p. ej. un 400): no cuenta como caída
+            self.breaker.record_success()
+        if delivered:
+            return self.FAIL
+        if is_timeout(error) and not last_tier:
+            return self.NEXT_TIER
+        if retryable and self.retries < self.policy.max_retries:
+            delay = max(self.policy.backoff(self.retries, _rng), min(retry_after(error), self.policy.max_seconds))
+            remaining = self.remaining()
+            if remaining is None or delay < remaining:
+                self.retries += 1
+                self.delay = delay
+                _count("retries")
+                return self.RETRY
+        return self.FAIL
+
+    def succeeded(self, text: str) -> None:
+        self.breaker.record_success()
+        cache.put(self.call_site, self.messages, text)
+
+def get_metrics() -> Dict[str, Any]:
+    """Reintentos, respuestas de respaldo, plazos agotados y estado de cada circuito."""
+    with _stats_lock:
+        stats = dict(_stats)
+    return {**stats, "breakers": {name: breaker.get_metrics() for name, breaker in list(breakers.items())}}
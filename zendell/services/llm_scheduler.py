@@ -0,0 +1,339 @@
+# zendell/services/llm_scheduler.py
+"""
+Planificador central de las llamadas al LLM.
+
+- Carriles por prioridad: interactive (respuestas al usuario) > proactive (mensajes de
+  goal_finder) > maintenance (reflexiones e insights nocturnos). Cada llamada usa el
+  carril de su lane_scope (LLM_DEFAULT_LANE si no hay).
+- Límites compartidos: LLM_MAX_CONCURRENCY llamadas en vuelo y token buckets
+  (core/rate_limit.py) para peticiones (LLM_RPM_LIMIT) y tokens (LLM_TPM_LIMIT) por minuto.
+- Prioridad estricta con reserva: una llamada de un carril inferior solo entra si no hay
+  otra de un carril superior esperando, si su carril no supera su máximo de concurrencia y
+  si deja en los buckets la fracción LLM_LANE_RESERVE para los carriles superiores. Así el
+  mantenimiento nunca consume la capacidad que necesitan las respuestas interactivas.
+- Reparto equitativo: dentro de un carril se atiende a los usuarios por turnos (round-robin),
+  de modo que un usuario con muchas llamadas no retrasa a los demás.
+
+llm_provider pide un hueco (slot / aslot) antes de cada intento; la espera está acotada
+por el plazo de la llamada (llm_resilience) y, si se agota, la llamada no llega al proveedor.
+"""
+
+import asyncio
+import contextlib
+import threading
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Iterator, AsyncIterator, List, Optional
+from config.settings import (
+    LLM_MAX_CONCURRENCY, LLM_RPM_LIMIT, LLM_TPM_LIMIT, LLM_LANE_MAX_CONCURRENCY, LLM_LANE_RESERVE,
+    LLM_DEFAULT_LANE, LLM_EXPECTED_COMPLETION_TOKENS
+)
+from zendell.core.log import get_logger
+from zendell.core.rate_limit import TokenBucket
+from zendell.services.llm_resilience import Unavailable, retry_after
+
+logger = get_logger(__name__)
+
+INTERACTIVE = "interactive"
+PROACTIVE = "proactive"
+MAINTENANCE = "maintenance"
+# Orden de prioridad
+LANES = (INTERACTIVE, PROACTIVE, MAINTENANCE)
+
+current_lane: ContextVar[Optional[str]] = ContextVar("llm_lane", default=None)
+
+@contextlib.contextmanager
+def lane_scope(lane: str) -> Iterator[None]:
+    """Asigna un carril a las llamadas al LLM del bloque (se hereda en el executor)."""
+    if lane not in LANES:
+        raise ValueError(f"Carril de LLM desconocido: {lane}")
+    token = current_lane.set(lane)
+    try:
+        yield
+    finally:
+        current_lane.reset(token)
+
+def parse_lane_values(spec: str) -> Dict[str, float]:
+    """Convierte "proactive=0.2,maintenance=0.5" en {carril: valor}."""
+    values = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        lane, value = (part.strip() for part in item.split("=", 1))
+        if lane in LANES and value:
+            values[lane] = float(value)
+    return values
+
+def estimate_tokens(messages: List[Dict[str, str]], completion_tokens: int = LLM_EXPECTED_COMPLETION_TOKENS) -> int:
+    """Tokens estimados de una llamada: ~4 caracteres por token del prompt más la respuesta esperada."""
+    return sum(len(m.get("content") or "") for m in messages) // 4 + completion_tokens
+
+def _current_user() -> str:
+    # El usuario se toma del usage_scope de llm_usage (importado aquí: llm_usage depende de llm_provider)
+    from zendell.services.llm_usage import current_user
+    return current_user.get() or ""
+
+@dataclass
+class Ticket:
+    """Hueco pedido por una llamada; used_tokens y error los completa quien llama antes de liberarlo."""
+    lane: str
+    user_id: str
+    tokens: float
+    enqueued_at: float = field(default_factory=time.monotonic)
+    admitted_at: Optional[float] = None
+    used_tokens: Optional[float] = None
+    error: Optional[BaseException] = None
+    released: bool = False
+    # Despierta a quien espera desde el event loop (acquire_async); los hilos usan la Condition
+    wakeup: Optional[Callable[[], None]] = field(default=None, repr=False, compare=False)
+
+    @property
+    def admitted(self) -> bool:
+        return self.admitted_at is not None
+
+    @property
+    def wait_ms(self) -> float:
+        end = self.admitted_at if self.admitted_at is not None else time.monotonic()
+        return (end - self.enqueued_at) * 1000
+
+class LLMScheduler:
+    """Colas por carril y usuario sobre límites compartidos de concurrencia, RPM y TPM."""
+
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        rpm_limit: float = LLM_RPM_LIMIT,
+        tpm_limit: float = LLM_TPM_LIMIT,
+        lane_max_concurrency: Optional[Dict[str, float]] = None,
+        lane_reserve: Optional[Dict[str, float]] = None,
+        default_lane: str = LLM_DEFAULT_LANE
+    ):
+        self.max_concurrency = max_concurrency
+        self.lane_max_concurrency = lane_max_concurrency if lane_max_concurrency is not None else parse_lane_values(LLM_LANE_MAX_CONCURRENCY)
+        self.lane_reserve = lane_reserve if lane_reserve is not None else parse_lane_values(LLM_LANE_RESERVE)
+        self.default_lane = default_lane if default_lane in LANES else INTERACTIVE
+        # Buckets por minuto: capacidad = límite por minuto, recarga = límite / 60 por segundo
+        self.rpm = TokenBucket(rpm_limit / 60, rpm_limit) if rpm_limit > 0 else None
+        self.tpm = TokenBucket(tpm_limit / 60, tpm_limit) if tpm_limit > 0 else None
+        self._cond = threading.Condition()
+        # carril -> usuario -> cola de tickets; el orden de usuarios es el turno round-robin
+        self._queues: Dict[str, "OrderedDict[str, Deque[Ticket]]"] = {lane: OrderedDict() for lane in LANES}
+        self._in_flight = {lane: 0 for lane in LANES}
+        # Momento (monotonic) en que los buckets admitirán la cabeza de la cola; None si no se espera a recarga
+        self._retry_at: Optional[float] = None
+        self._stats = {lane: {"admitted": 0, "timeouts": 0, "wait_ms": 0.0, "max_wait_ms": 0.0} for lane in LANES}
+
+    # ======== ADMISIÓN ========
+
+    def _bucket_args(self, bucket: TokenBucket, lane: str, tokens: float):
+        # Una petición mayor que el bucket se limita a su capacidad; la reserva nunca la hace imposible
+        tokens = min(tokens, bucket.capacity)
+        reserve = min(self.lane_reserve.get(lane, 0.0) * bucket.capacity, bucket.capacity - tokens)
+        return tokens, max(reserve, 0.0)
+
+    def _rate_delay(self, ticket: Ticket) -> float:
+        delay = 0.0
+        if self.rpm is not None:
+            delay = max(delay, self.rpm.time_until(*self._bucket_args(self.rpm, ticket.lane, 1)))
+        if self.tpm is not None:
+            delay = max(delay, self.tpm.time_until(*self._bucket_args(self.tpm, ticket.lane, ticket.tokens)))
+        return delay
+
+    def _take_rate(self, ticket: Ticket) -> bool:
+        rpm_args = self._bucket_args(self.rpm, ticket.lane, 1) if self.rpm is not None else None
+        tpm_args = self._bucket_args(self.tpm, ticket.lane, ticket.tokens) if self.tpm is not None else None
+        if rpm_args is not None and not self.rpm.try_acquire(*rpm_args):
+            return False
+        if tpm_args is not None and not self.tpm.try_acquire(*tpm_args):
+            if self.rpm is not None:
+                self.rpm.adjust(-1)
+            return False
+        return True
+
+    def _dispatch(self) -> Optional[float]:
+        """
+        Admite todas las llamadas que caben, por prioridad y por turnos entre usuarios.
+        Devuelve los segundos hasta que los buckets admitan la siguiente (None si espera a un release).
+        Se llama con self._cond adquirido. Despierta a los admitidos y, si la próxima recarga llega
+        antes de lo previsto, a todos los que esperan para que ajusten su espera.
+        """
+        admitted = False
+        delay: Optional[float] = None
+        for lane in LANES:
+            queue = self._queues[lane]
+            # Con el carril en su máximo pueden entrar carriles inferiores
+            lane_limit = self.lane_max_concurrency.get(lane, self.max_concurrency)
+            while queue and sum(self._in_flight.values()) < self.max_concurrency and self._in_flight[lane] < lane_limit:
+                user_id, tickets = next(iter(queue.items()))
+                ticket = tickets[0]
+                wait = self._rate_delay(ticket)
+                if wait > 0 or not self._take_rate(ticket):
+                    # Prioridad estricta: los carriles inferiores (con más reserva) tampoco entran
+                    delay = max(wait, 0.001)
+                    break
+                tickets.popleft()
+                if tickets:
+                    queue.move_to_end(user_id)
+                else:
+                    del queue[user_id]
+                ticket.admitted_at = time.monotonic()
+                self._in_flight[lane] += 1
+                stats = self._stats[lane]
+                stats["admitted"] += 1
+                stats["wait_ms"] += ticket.wait_ms
+                stats["max_wait_ms"] = max(stats["max_wait_ms"], ticket.wait_ms)
+                if ticket.wakeup is not None:
+                    ticket.wakeup()
+                admitted = True
+            if delay is not None or sum(self._in_flight.values()) >= self.max_concurrency:
+                break
+        retry_at = time.monotonic() + delay if delay is not None else None
+        earlier = retry_at is not None and (self._retry_at is None or retry_at < self._retry_at - 0.001)
+        self._retry_at = retry_at
+        if earlier:
+            self._wake_all()
+        elif admitted:
+            self._cond.notify_all()
+        return delay
+
+    def _wake_all(self) -> None:
+        self._cond.notify_all()
+        for queue in self._queues.values():
+            for tickets in queue.values():
+                for ticket in tickets:
+                    if ticket.wakeup is not None:
+                        ticket.wakeup()
+
+    def _enqueue(self, ticket: Ticket) -> None:
+        self._queues[ticket.lane].setdefault(ticket.user_id, deque()).append(ticket)
+
+    def _abandon(self, ticket: Ticket) -> None:
+        # Quita de la cola un ticket que deja de esperar (plazo agotado o cancelación); los de
+        # detrás pueden entrar ya, porque nadie más los despierta
+        queue = self._queues[ticket.lane]
+        tickets = queue.get(ticket.user_id)
+        if tickets is not None and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del queue[ticket.user_id]
+        self._stats[ticket.lane]["timeouts"] += 1
+        self._dispatch()
+
+    def _new_ticket(self, tokens: float, lane: Optional[str], user_id: Optional[str]) -> Ticket:
+        lane = lane or current_lane.get() or self.default_lane
+        return Ticket(lane if lane in LANES else self.default_lane, user_id if user_id is not None else _current_user(), tokens)
+
+    def acquire(self, tokens: float = 1, max_wait: Optional[float] = None, lane: Optional[str] = None, user_id: Optional[str] = None) -> Ticket:
+        """Espera un hueco (bloquea el hilo); Unavailable si no llega en max_wait segundos."""
+        ticket = self._new_ticket(tokens, lane, user_id)
+        deadline = time.monotonic() + max_wait if max_wait is not None else None
+        with self._cond:
+            self._enqueue(ticket)
+            while True:
+                delay = self._dispatch()
+                if ticket.admitted:
+                    return ticket
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    self._abandon(ticket)
+                    raise Unavailable(f"sin hueco en el carril {ticket.lane} tras {ticket.wait_ms:.0f} ms")
+                waits = [w for w in (delay, remaining) if w is not None]
+                self._cond.wait(min(waits) if waits else None)
+
+    async def acquire_async(self, tokens: float = 1, max_wait: Optional[float] = None, lane: Optional[str] = None, user_id: Optional[str] = None) -> Ticket:
+        """
+        Como acquire, sin bloquear el event loop: el ticket lleva un asyncio.Event que se activa
+        al admitirlo o al adelantarse la recarga (también desde hilos, con call_soon_threadsafe),
+        y entre tanto solo se duerme hasta la recarga de los buckets o el plazo.
+        """
+        ticket = self._new_ticket(tokens, lane, user_id)
+        deadline = time.monotonic() + max_wait if max_wait is not None else None
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        ticket.wakeup = lambda: loop.call_soon_threadsafe(event.set)
+        with self._cond:
+            self._enqueue(ticket)
+        try:
+            while True:
+                with self._cond:
+                    # Se limpia con el lock tomado: un aviso posterior no se pierde
+                    event.clear()
+                    delay = self._dispatch()
+                    if ticket.admitted:
+                        return ticket
+                    remaining = deadline - time.monotonic() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        self._abandon(ticket)
+                        raise Unavailable(f"sin hueco en el carril {ticket.lane} tras {ticket.wait_ms:.0f} ms")
+                waits = [w for w in (delay, remaining) if w is not None]
+                try:
+                    await asyncio.wait_for(event.wait(), min(waits) if waits else None)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            with self._cond:
+                if ticket.admitted:
+                    self._release(ticket)
+                else:
+                    self._abandon(ticket)
+            raise
+        finally:
+            ticket.wakeup = None
+
+    def release(self, ticket: Ticket) -> None:
+        """Libera el hueco, corrige el TPM con el uso real y aplica el retry-after de un 429."""
+        with self._cond:
+            self._release(ticket)
+
+    def _release(self, ticket: Ticket) -> None:
+        if not ticket.admitted or ticket.released:
+            return
+        ticket.released = True
+        self._in_flight[ticket.lane] -= 1
+        if self.tpm is not None and ticket.used_tokens is not None:
+            self.tpm.adjust(ticket.used_tokens - min(ticket.tokens, self.tpm.capacity))
+        if ticket.error is not None and getattr(ticket.error, "status_code", None) == 429 and self.rpm is not None:
+            seconds = retry_after(ticket.error) or 1.0
+            logger.warning("Límite de peticiones del proveedor alcanzado; pausa de %.1fs", seconds)
+            self.rpm.penalize(seconds)
+        self._dispatch()
+
+    # ======== MÉTRICAS ========
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Por carril: llamadas en espera y en vuelo, admitidas, abandonadas y espera media/máxima."""
+        with self._cond:
+            metrics = {}
+            for lane in LANES:
+                stats = self._stats[lane]
+                metrics[lane] = {
+                    "waiting": sum(len(tickets) for tickets in self._queues[lane].values()),
+                    "in_flight": self._in_flight[lane],
+                    "admitted": stats["admitted"],
+                    "timeouts": stats["timeouts"],
+                    "avg_wait_ms": round(stats["wait_ms"] / stats["admitted"], 1) if stats["admitted"] else 0.0,
+                    "max_wait_ms": round(stats["max_wait_ms"], 1)
+                }
+            return metrics
+
+scheduler = LLMScheduler()
+
+@contextlib.contextmanager
+def slot(messages: List[Dict[str, str]], max_wait: Optional[float] = None) -> Iterator[Ticket]:
+    """Hueco del planificador global para una llamada; se libera al salir del bloque."""
+    ticket = scheduler.acquire(estimate_tokens(messages), max_wait)
+    try:
+        yield ticket
+    finally:
+        scheduler.release(ticket)
+
+@contextlib.asynccontextmanager
+async def aslot(messages: List[Dict[str, str]], max_wait: Optional[float] = None) -> AsyncIterator[Ticket]:
+    """Variante asíncrona de slot para el event loop."""
+    ticket = await scheduler.acquire_async(estimate_tokens(messages), max_wait)
+    try:
+        yield ticket
+    finally:
+        scheduler.release(ticket)
@@ -0,0 +1,273 @@
+# zendell/services/llm_usage.py
+"""
+Contabilidad de tokens y presupuestos diarios de LLM por usuario.
+
+- Cada respuesta del LLM (listener de llm_provider) suma llamadas, tokens y coste
+  estimado al usuario en curso (usage_scope / ContextVar), por agente (call_site),
+  modelo y día UTC. Los incrementos se acumulan en memoria y se envían a la colección
+  llm_usage en un único bulk_write de upserts con $inc (flush), no uno por llamada.
+- Antes de cada llamada (guard de llm_provider) se compara el gasto del día del
+  usuario con LLM_USER_DAILY_BUDGET_USD:
+    * por debajo del presupuesto, nada cambia;
+    * al superarlo, las llamadas de baja prioridad (reflexiones, insights, tono...)
+      pasan al modelo barato LLM_BUDGET_FALLBACK_MODEL;
+    * al superar presupuesto x LLM_BUDGET_HARD_MULTIPLIER, las de baja prioridad se
+      omiten (ask_gpt devuelve None) y el resto pasa al modelo barato.
+  Así el coste por usuario queda acotado aunque crezca el número de usuarios.
+"""
+
+import contextlib
+import threading
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+from pymongo import UpdateOne
+from config.settings import (
+    LLM_USER_DAILY_BUDGET_USD, LLM_BUDGET_HARD_MULTIPLIER, LLM_BUDGET_FALLBACK_MODEL,
+    LLM_LOW_PRIORITY_CALL_SITES, LLM_USAGE_MAX_PENDING
+)
+from zendell.core.log import get_logger
+from zendell.services import llm_provider
+from zendell.services.llm_provider import CallSkipped, LLMResponse
+
+logger = get_logger(__name__)
+
+# Precios en USD por millón de tokens (entrada, salida); los modelos desconocidos usan DEFAULT_PRICE
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-4": (30.00, 60.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+DEFAULT_PRICE = MODEL_PRICES["gpt-4o"]
+
+# Usuario al que se imputan las llamadas (las de fuera de un usuario van a SYSTEM_USER)
+SYSTEM_USER = "system"
+current_user: ContextVar[Optional[str]] = ContextVar("llm_usage_user", default=None)
+
+@contextlib.contextmanager
+def usage_scope(user_id: str) -> Iterator[None]:
+    """Imputa al usuario las llamadas al LLM del bloque (se hereda en el executor)."""
+    token = current_user.set(user_id)
+    try:
+        yield
+    finally:
+        current_user.reset(token)
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Coste estimado en USD de una llamada."""
+    input_price, output_price = MODEL_PRICES.get(model, DEFAULT_PRICE)
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+def _today() -> str:
+    return datetime.utcnow().strftime("%Y-%m-%d")
+
+class BudgetExceeded(CallSkipped):
+    """Llamada de baja prioridad omitida porque el usuario agotó su presupuesto diario."""
+
+class UsageTracker:
+    """Acumula el uso por (usuario, día, agente, modelo) y aplica los presupuestos diarios."""
+
+    def __init__(
+        self,
+        daily_budget_usd: float = LLM_USER_DAILY_BUDGET_USD,
+        hard_multiplier: float = LLM_BUDGET_HARD_MULTIPLIER,
+        fallback_model: str = LLM_BUDGET_FALLBACK_MODEL,
+        low_priority: Optional[Set[str]] = None,
+        max_pending: int = LLM_USAGE_MAX_PENDING
+    ):
+        self.daily_budget_usd = daily_budget_usd
+        self.hard_multiplier = hard_multiplier
+        self.fallback_model = fallback_model
+        self.low_priority = set(low_priority if low_priority is not None else LLM_LOW_PRIORITY_CALL_SITES)
+        self.max_pending = max_pending
+        self.collection = None
+        self._lock = threading.Lock()
+        # (usuario, día) -> gasto en USD (persistido + pendiente)
+        self._spend: Dict[Tuple[str, str], float] = {}
+        # (usuario, día, agente, modelo) -> incrementos pendientes de enviar
+        self._pending: Dict[Tuple[str, str, str, str], Dict[str, float]] = {}
+        self._degraded = 0
+        self._skipped = 0
+
+    def attach(self, db_manager) -> None:
+        """Persiste el uso en la colección llm_usage del manager (sin ella, solo en memoria)."""
+        self.flush()
+        with self._lock:
+            self.collection = db_manager.llm_usage_coll
+            self._spend.clear()
+
+    # ======== GASTO Y PRESUPUESTO ========
+
+    def _load_spend(self, user_id: str, day: str) -> float:
+        # Gasto ya persistido del día; se consulta una vez por usuario y día
+        if self.collection is None:
+            return 0.0
+        try:
+            rows = list(self.collection.aggregate([
+                {"$match": {"user_id": user_id, "day": day}},
+                {"$group": {"_id": None, "cost_usd": {"$sum": "$cost_usd"}}}
+            ]))
+        except Exception as e:
+            logger.error("Error al leer el uso de LLM de %s: %s", user_id, e)
+            return 0.0
+        return rows[0]["cost_usd"] if rows else 0.0
+
+    def spend(self, user_id: str, day: Optional[str] = None) -> float:
+        """Gasto estimado del usuario en el día (USD)."""
+        day = day or _today()
+        key = (user_id, day)
+        with self._lock:
+            if key in self._spend:
+                return self._spend[key]
+        loaded = self._load_spend(user_id, day)
+        with self._lock:
+            # Al cambiar de día se descartan los gastos de días anteriores
+            for stale in [k for k in self._spend if k[1] != day]:
+                del self._spend[stale]
+            return self._spend.setdefault(key, loaded)
+
+    def budget_ratio(self, user_id: str) -> float:
+        """Fracción del presupuesto diario consumida (0 si no hay presupuesto)."""
+        if self.daily_budget_usd <= 0:
+            return 0.0
+        return self.spend(user_id) / self.daily_budget_usd
+
+    def allows(self, user_id: str, call_site: str) -> bool:
+        """False si una llamada de este call_site se omitiría para el usuario (para evitar trabajo previo)."""
+        return not (call_site in self.low_priority and self.budget_ratio(user_id) >= self.hard_multiplier)
+
+    def guard(self, call_site: str, model: str) -> str:
+        """Guard de llm_provider: modelo a usar para la llamada o BudgetExceeded para omitirla."""
+        user_id = current_user.get()
+        if not user_id or self.daily_budget_usd <= 0:
+            return model
+        ratio = self.budget_ratio(user_id)
+        if ratio < 1:
+            return model
+        low_priority = call_site in self.low_priority
+        if low_priority and ratio >= self.hard_multiplier:
+            with self._lock:
+                self._skipped += 1
+                self._pending_entry(user_id, _today(), call_site, model)["skipped"] += 1
+            raise BudgetExceeded(f"presupuesto diario agotado para {user_id}")
+        if (low_priority or ratio >= self.hard_multiplier) and self.fallback_model and model != self.fallback_model:
+            with self._lock:
+                self._degraded += 1
+                self._pending_entry(user_id, _today(), call_site, self.fallback_model)["degraded"] += 1
+            logger.debug("Llamada %s degradada a %s", call_site, self.fallback_model, user_id=user_id)
+            return self.fallback_model
+        return model
+
+    # ======== REGISTRO ========
+
+    def _pending_entry(self, user_id: str, day: str, agent: str, model: str) -> Dict[str, float]:
+        key = (user_id, day, agent, model)
+        entry = self._pending.get(key)
+        if entry is None:
+            entry = self._pending[key] = {
+                "calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0, "degraded": 0, "skipped": 0
+            }
+        return entry
+
+    def record(self, response: LLMResponse) -> None:
+        """Listener de llm_provider: suma la llamada al usuario en curso."""
+        if response.metadata.get("error"):
+            return
+        user_id = current_user.get() or SYSTEM_USER
+        day = _today()
+        cost = estimate_cost(response.model, response.prompt_tokens, response.completion_tokens)
+        # El gasto persistido se carga antes de sumar lo nuevo
+        self.spend(user_id, day)
+        with self._lock:
+            entry = self._pending_entry(user_id, day, response.call_site or "unknown", response.model)
+            entry["calls"] += 1
+            entry["prompt_tokens"] += response.prompt_tokens
+            entry["completion_tokens"] += response.completion_tokens
+            entry["cost_usd"] += cost
+            self._spend[(user_id, day)] = self._spend.get((user_id, day), 0.0) + cost
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        """Envía los incrementos pendientes en un bulk_write. Devuelve los documentos actualizados."""
+        with self._lock:
+            if self.collection is None or not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+        requests = [
+            UpdateOne(
+                {"user_id": user_id, "day": day, "agent": agent, "model": model},
+                {"$inc": increments, "$set": {"updated_at": datetime.utcnow().isoformat()}},
+                upsert=True
+            )
+            for (user_id, day, agent, model), increments in pending.items()
+        ]
+        try:
+            self.collection.bulk_write(requests, ordered=False)
+        except Exception as e:
+            logger.error("Error al guardar el uso de LLM: %s", e)
+            # Se devuelven a la cola para el siguiente flush
+            with self._lock:
+                for key, increments in pending.items():
+                    entry = self._pending.get(key)
+                    if entry is None:
+                        self._pending[key] = increments
+                    else:
+                        for field_name, value in increments.items():
+                            entry[field_name] += value
+            return 0
+        return len(requests)
+
+    # ======== CONSULTAS ========
+
+    def get_usage(self, user_id: str, day: Optional[str] = None) -> Dict[str, Any]:
+        """Uso del usuario en el día por agente (persistido más pendiente)."""
+        day = day or _today()
+        by_agent: Dict[str, Dict[str, float]] = {}
+
+        def add(agent: str, values: Dict[str, Any]) -> None:
+            totals = by_agent.setdefault(agent, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0})
+            for field_name in totals:
+                totals[field_name] += values.get(field_name, 0)
+
+        if self.collection is not None:
+            for row in self.collection.find({"user_id": user_id, "day": day}, {"_id": 0}):
+                add(row["agent"], row)
+        with self._lock:
+            for (pending_user, pending_day, agent, _), values in self._pending.items():
+                if pending_user == user_id and pending_day == day:
+                    add(agent, values)
+        return {
+            "user_id": user_id,
+            "day": day,
+            "cost_usd": round(sum(values["cost_usd"] for values in by_agent.values()), 6),
+            "budget_usd": self.daily_budget_usd,
+            "by_agent": by_agent
+        }
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "tracked_users": len(self._spend),
+                "degraded_calls": self._degraded,
+                "skipped_calls": self._skipped
+            }
+
+tracker = UsageTracker()
+
+def _record(response: LLMResponse) -> None:
+    tracker.record(response)
+
+def _guard(call_site: str, model: str) -> str:
+    return tracker.guard(call_site, model)
+
+llm_provider.add_listener(_record)
+llm_provider.add_guard(_guard)
+
+def flush() -> int:
+    """Envía el uso pendiente del tracker global."""
+    return tracker.flush()
@@ -0,0 +1,404 @@
+# zendell/services/messaging_service.py
+
+import asyncio
+import contextlib
+import random
+import time
+import uuid
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+from config.settings import MESSAGING_MAX_RETRIES, MESSAGING_CHANNEL_CONCURRENCY, DISCORD_STREAM_REPLIES
+from zendell.core.log import get_logger
+
+logger = get_logger(__name__)
+
+class TokenStream:
+    """
+    Respuesta que se entrega a medida que se genera.
+
+    push() y close() se pueden llamar desde cualquier hilo (el orquestador corre en
+    el executor); el canal consume los fragmentos con `async for` en el event loop.
+    Al cerrar se indica el texto final completo, que es el que se da por entregado.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._started = asyncio.Event()
+        self._closed = asyncio.Event()
+        self.final_text: Optional[str] = None
+        self.first_token_at: Optional[float] = None
+
+    def push(self, token: str) -> None:
+        self._loop.call_soon_threadsafe(self._put, token)
+
+    def close(self, final_text: str) -> None:
+        self._loop.call_soon_threadsafe(self._finish, final_text)
+
+    def _put(self, token: str) -> None:
+        self._queue.put_nowait(token)
+        self._started.set()
+
+    def _finish(self, final_text: str) -> None:
+        self.final_text = final_text
+        self._queue.put_nowait(None)
+        self._started.set()
+        self._closed.set()
+
+    async def wait_started(self) -> None:
+        """Espera al primer fragmento (o al cierre, si no llega ninguno)."""
+        await self._started.wait()
+
+    async def wait_closed(self) -> str:
+        await self._closed.wait()
+        return self.final_text or ""
+
+    async def __aiter__(self):
+        while True:
+            token = await self._queue.get()
+            if token is None:
+                return
+            if self.first_token_at is None:
+                self.first_token_at = time.monotonic()
+            yield token
+
+class PartialDelivery(Exception):
+    """
+    Un canal falló a mitad de una respuesta en streaming que ya se ve en parte;
+    `remaining` es el texto que falta por mostrar (el reintento solo envía eso).
+    """
+
+    def __init__(self, remaining: str, cause: Optional[BaseException] = None):
+        super().__init__(str(cause) if cause is not None else "entrega parcial")
+        self.remaining = remaining
+
+@dataclass
+class DeliveryReceipt:
+    """Acuse de entrega de un mensaje saliente."""
+    message_id: str
+    user_id: str
+    channel: str
+    text: str
+    status: str = "queued"  # queued | delivered | failed
+    attempts: int = 0
+    enqueued_at: float = field(default_factory=time.monotonic)
+    delivered_at: Optional[float] = None
+    error: Optional[str] = None
+    stream: Optional[TokenStream] = field(default=None, repr=False)
+    routes: Tuple["ReplyRoute", ...] = field(default=(), repr=False)
+    _done: Optional[asyncio.Future] = field(default=None, repr=False)
+
+    @property
+    def latency_ms(self) -> Optional[float]:
+        if self.delivered_at is None:
+            return None
+        return (self.delivered_at - self.enqueued_at) * 1000
+
+    @property
+    def first_token_ms(self) -> Optional[float]:
+        if self.stream is None or self.stream.first_token_at is None:
+            return None
+        return (self.stream.first_token_at - self.enqueued_at) * 1000
+
+    async def wait(self) -> "DeliveryReceipt":
+        """Espera a que el mensaje se entregue o falle definitivamente."""
+        if self._done is not None:
+            await asyncio.shield(self._done)
+        return self
+
+@dataclass(eq=False)
+class ReplyRoute:
+    """
+    Respuestas de una petición concreta (p. ej. una llamada HTTP): el canal por el que
+    salen, sus acuses y, opcionalmente, una cola donde el canal publica sus eventos.
+    """
+    channel: str
+    receipts: List[DeliveryReceipt] = field(default_factory=list)
+    events: Optional[asyncio.Queue] = None
+
+    async def replies(self) -> List[str]:
+        """Espera a que se entreguen las respuestas de la petición y devuelve sus textos."""
+        for receipt in list(self.receipts):
+            await receipt.wait()
+        return [r.text for r in self.receipts if r.status == "delivered"]
+
+# Rutas de la petición en curso: los mensajes enviados dentro de reply_scope() se entregan
+# por su canal y quedan asociados a ellas, sin cambiar el canal fijado para el usuario
+_reply_routes: ContextVar[Tuple[ReplyRoute, ...]] = ContextVar("reply_routes", default=())
+# Acuse que se está entregando (lo consultan los canales que publican por ruta)
+current_receipt: ContextVar[Optional[DeliveryReceipt]] = ContextVar("current_receipt", default=None)
+
+@contextlib.contextmanager
+def reply_scope(routes) -> Iterator[None]:
+    """Asocia a las rutas indicadas los mensajes enviados dentro del bloque."""
+    token = _reply_routes.set(tuple(dict.fromkeys(routes or ())))
+    try:
+        yield
+    finally:
+        _reply_routes.reset(token)
+
+class MessagingChannel:
+    """
+    Canal de salida. Las subclases implementan send(); el pipeline se encarga
+    de colas, reintentos y límites de concurrencia.
+    """
+    name = "base"
+    max_concurrency = MESSAGING_CHANNEL_CONCURRENCY
+    supports_streaming = False
+
+    async def send(self, user_id: str, text: str) -> Any:
+        raise NotImplementedError
+
+    async def send_stream(self, user_id: str, stream: TokenStream) -> Any:
+        """
+        Entrega una respuesta en streaming. Por defecto espera al texto completo y lo envía.
+        Si falla con parte del texto ya visible, debe lanzar PartialDelivery con lo que falta.
+        """
+        async for _ in stream:
+            pass
+        return await self.send(user_id, stream.final_text or "")
+
+class DiscordChannel(MessagingChannel):
+    """Canal de Discord (usa la cola con rate limit de discord_service)."""
+    name = "discord"
+    supports_streaming = DISCORD_STREAM_REPLIES
+
+    async def send(self, user_id: str, text: str) -> Any:
+        # Import perezoso: el cliente de Discord solo se carga si se usa este canal
+        from zendell.services.discord_service import send_dm
+        return await send_dm(user_id, text)
+
+    async def send_stream(self, user_id: str, stream: TokenStream) -> Any:
+        from zendell.services.discord_service import send_dm_stream
+        return await send_dm_stream(user_id, stream)
+
+class LoopbackChannel(MessagingChannel):
+    """
+    Canal local sin red para pruebas y pruebas de carga: guarda los mensajes
+    en memoria y puede simular latencia y fallos.
+    """
+    name = "loopback"
+
+    def __init__(self, latency_seconds: float = 0.0, failure_rate: float = 0.0, max_concurrency: int = 64, seed: Optional[int] = None):
+        self.latency_seconds = latency_seconds
+        self.failure_rate = failure_rate
+        self.max_concurrency = max_concurrency
+        self.outbox: Dict[str, List[str]] = {}
+        self._random = random.Random(seed)
+
+    async def send(self, user_id: str, text: str) -> Any:
+        if self.latency_seconds:
+            await asyncio.sleep(self.latency_seconds)
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            raise ConnectionError("Fallo simulado en el canal loopback")
+        self.outbox.setdefault(user_id, []).append(text)
+        return text
+
+    def messages(self, user_id: str) -> List[str]:
+        return list(self.outbox.get(user_id, []))
+
+    def pop_messages(self, user_id: str) -> List[str]:
+        """Devuelve y vacía los mensajes acumulados para el usuario."""
+        return self.outbox.pop(user_id, [])
+
+class MessagingService:
+    """
+    Pipeline asíncrono de entrega compartido por todos los canales.
+
+    - send() encola y devuelve un DeliveryReceipt al instante: la latencia del
+      canal queda fuera del camino crítico del orquestador.
+    - Los mensajes de un mismo usuario en un canal se entregan en orden.
+    - Cada canal limita sus entregas simultáneas (max_concurrency). Una respuesta en
+      streaming toma su hueco al llegar el primer fragmento, no mientras se genera.
+    - Los fallos se reintentan con backoff exponencial hasta max_retries; tras un fallo
+      a mitad de un streaming solo se reenvía lo que el usuario aún no ve.
+    """
+
+    def __init__(self, channels: Optional[List[MessagingChannel]] = None, default_channel: Optional[str] = None,
+                 max_retries: int = MESSAGING_MAX_RETRIES, retry_base_delay: float = 0.5, receipts_kept: int = 1000):
+        self.channels: Dict[str, MessagingChannel] = {}
+        self.default_channel = default_channel
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._queues: Dict[Tuple[str, str], Deque[DeliveryReceipt]] = {}
+        self._workers: Dict[Tuple[str, str], asyncio.Task] = {}
+        self.receipts: Deque[DeliveryReceipt] = deque(maxlen=receipts_kept)
+        self._user_channels: Dict[str, str] = {}
+        self._counters = {"queued": 0, "delivered": 0, "failed": 0, "retries": 0}
+        for channel in channels or []:
+            self.register_channel(channel)
+
+    def register_channel(self, channel: MessagingChannel) -> None:
+        """Registra un canal; el primero registrado pasa a ser el canal por defecto."""
+        self.channels[channel.name] = channel
+        if self.default_channel is None:
+            self.default_channel = channel.name
+
+    def set_user_channel(self, user_id: str, channel: str) -> None:
+        """Fija el canal por el que se responde a un usuario (p. ej. el de la API HTTP)."""
+        if channel not in self.channels:
+            raise ValueError(f"Canal de mensajería no registrado: {channel}")
+        self._user_channels[user_id] = channel
+
+    async def send(self, user_id: str, text: str, channel: Optional[str] = None) -> DeliveryReceipt:
+        """Encola un mensaje para el usuario y devuelve su acuse sin esperar la entrega."""
+        channel_name = self._resolve_channel(user_id, channel)
+        loop = asyncio.get_running_loop()
+        receipt = DeliveryReceipt(
+            message_id=str(uuid.uuid4()),
+            user_id=user_id,
+            channel=channel_name,
+            text=text,
+            _done=loop.create_future()
+        )
+        self._enqueue(receipt)
+        return receipt
+
+    def _resolve_channel(self, user_id: str, channel: Optional[str]) -> str:
+        """Canal explícito, el de la petición en curso (reply_scope), el del usuario o el por defecto."""
+        routes = _reply_routes.get()
+        channel_name = channel or (routes[0].channel if routes else None) or self._user_channels.get(user_id) or self.default_channel
+        if channel_name not in self.channels:
+            raise ValueError(f"Canal de mensajería no registrado: {channel_name}")
+        return channel_name
+
+    def _enqueue(self, receipt: DeliveryReceipt) -> None:
+        receipt.routes = tuple(r for r in _reply_routes.get() if r.channel == receipt.channel)
+        for route in receipt.routes:
+            route.receipts.append(receipt)
+        self.receipts.append(receipt)
+        self._counters["queued"] += 1
+        key = (receipt.channel, receipt.user_id)
+        self._queues.setdefault(key, deque()).append(receipt)
+        if key not in self._workers:
+            self._workers[key] = asyncio.get_running_loop().create_task(self._drain(key))
+
+    async def open_stream(self, user_id: str, channel: Optional[str] = None) -> Optional[TokenStream]:
+        """
+        Encola una respuesta en streaming para el usuario. Devuelve el TokenStream donde
+        escribir los fragmentos, o None si el canal no admite streaming (usar send()).
+        """
+        channel_name = self._resolve_channel(user_id, channel)
+        if not self.channels[channel_name].supports_streaming:
+            return None
+        loop = asyncio.get_running_loop()
+        stream = TokenStream(loop)
+        receipt = DeliveryReceipt(
+            message_id=str(uuid.uuid4()),
+            user_id=user_id,
+            channel=channel_name,
+            text="",
+            stream=stream,
+            _done=loop.create_future()
+        )
+        self._enqueue(receipt)
+        return stream
+
+    async def send_and_wait(self, user_id: str, text: str, channel: Optional[str] = None) -> DeliveryReceipt:
+        """Encola un mensaje y espera su entrega."""
+        receipt = await self.send(user_id, text, channel)
+        return await receipt.wait()
+
+    def _get_semaphore(self, channel_name: str) -> asyncio.Semaphore:
+        if channel_name not in self._semaphores:
+            self._semaphores[channel_name] = asyncio.Semaphore(self.channels[channel_name].max_concurrency)
+        return self._semaphores[channel_name]
+
+    async def _drain(self, key: Tuple[str, str]) -> None:
+        channel_name, _ = key
+        queue = self._queues[key]
+        channel = self.channels[channel_name]
+        semaphore = self._get_semaphore(channel_name)
+        try:
+            while queue:
+                receipt = queue.popleft()
+                if receipt.stream is not None:
+                    # Mientras el turno genera la respuesta no se ocupa un hueco del canal
+                    await receipt.stream.wait_started()
+                async with semaphore:
+                    await self._deliver(channel, receipt)
+        finally:
+            self._workers.pop(key, None)
+            if not queue:
+                self._queues.pop(key, None)
+
+    async def _deliver(self, channel: MessagingChannel, receipt: DeliveryReceipt) -> None:
+        token = current_receipt.set(receipt)
+        try:
+            await self._deliver_receipt(channel, receipt)
+        finally:
+            current_receipt.reset(token)
+
+    async def _deliver_receipt(self, channel: MessagingChannel, receipt: DeliveryReceipt) -> None:
+        text = receipt.text
+        if receipt.stream is not None:
+            text = await self._deliver_stream(channel, receipt)
+            if text is None:
+                return
+        while True:
+            receipt.attempts += 1
+            try:
+                await channel.send(receipt.user_id, text)
+                receipt.status = "delivered"
+                receipt.delivered_at = time.monotonic()
+                self._counters["delivered"] += 1
+                break
+            except Exception as e:
+                receipt.error = str(e)
+                if receipt.attempts > self.max_retries:
+                    receipt.status = "failed"
+                    self._counters["failed"] += 1
+                    logger.warning("Entrega fallida a %s por %s: %s", receipt.user_id, channel.name, e)
+                    break
+                self._counters["retries"] += 1
+                await asyncio.sleep(self.retry_base_delay * (2 ** (receipt.attempts - 1)))
+        if receipt._done is not None and not receipt._done.done():
+            receipt._done.set_result(receipt.status)
+
+    async def _deliver_stream(self, channel: MessagingChannel, receipt: DeliveryReceipt) -> Optional[str]:
+        """
+        Entrega en streaming. Devuelve None si quedó entregada o el texto que falta por
+        enviar con send(): el final completo, o solo el resto si ya se ve una parte.
+        """
+        receipt.attempts += 1
+        try:
+            await channel.send_stream(receipt.user_id, receipt.stream)
+        except Exception as e:
+            receipt.error = str(e)
+            receipt.text = await receipt.stream.wait_closed()
+            remaining = e.remaining if isinstance(e, PartialDelivery) else receipt.text
+            if remaining.strip():
+                self._counters["retries"] += 1
+                return remaining
+        receipt.text = receipt.stream.final_text or ""
+        receipt.status = "delivered"
+        receipt.delivered_at = time.monotonic()
+        self._counters["delivered"] += 1
+        if receipt._done is not None and not receipt._done.done():
+            receipt._done.set_result(receipt.status)
+        return None
+
+    async def drain(self, user_id: Optional[str] = None) -> None:
+        """Espera a que se vacíen las colas de entrega (todas o solo las de un usuario)."""
+        while True:
+            workers = [task for key, task in self._workers.items() if user_id is None or key[1] == user_id]
+            if not workers:
+                return
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Métricas de entrega: contadores, colas pendientes y latencias recientes."""
+        latencies = sorted(r.latency_ms for r in self.receipts if r.latency_ms is not None)
+        p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] if latencies else 0.0
+        first_tokens = [r.first_token_ms for r in self.receipts if r.first_token_ms is not None]
+        return {
+            **self._counters,
+            "pending": sum(len(q) for q in self._queues.values()),
+            "channels": list(self.channels),
+            "delivery_latency_avg_ms": (sum(latencies) / len(latencies)) if latencies else 0.0,
+            "delivery_latency_p95_ms": p95,
+            "first_token_latency_avg_ms": (sum(first_tokens) / len(first_tokens)) if first_tokens else 0.0
+        }
@@ -0,0 +1,141 @@
+# zendell/services/model_router.py
+"""
+Enrutado de modelos por call_site.
+
+- Tres niveles por defecto: "fast" (clasificaciones y extracciones cortas), "standard"
+  (el modelo global de --llm) y "strong" (reflexiones e informes largos). Cada nivel
+  tiene un modelo, un tiempo máximo (su objetivo de latencia) y un nivel de respaldo.
+- LLM_MODEL_ROUTES asigna call_sites a niveles ("classify_*=fast,generate_user_summary=strong");
+  los que no aparecen usan LLM_DEFAULT_TIER.
+- plan() devuelve los intentos de una llamada: el nivel de la ruta y, si se agota su
+  tiempo, los de su cadena de respaldo (sin repetir modelo). llm_provider los recorre.
+- Las llamadas con un modelo explícito (ask_gpt(..., model=...)) no se enrutan.
+"""
+
+import threading
+from dataclasses import dataclass
+from fnmatch import fnmatchcase
+from typing import Any, Dict, List, Optional
+from config.settings import (
+    LLM_TIER_FAST_MODEL, LLM_TIER_FAST_TIMEOUT_SECONDS, LLM_TIER_FAST_FALLBACK,
+    LLM_TIER_STANDARD_MODEL, LLM_TIER_STANDARD_TIMEOUT_SECONDS, LLM_TIER_STANDARD_FALLBACK,
+    LLM_TIER_STRONG_MODEL, LLM_TIER_STRONG_TIMEOUT_SECONDS, LLM_TIER_STRONG_FALLBACK,
+    LLM_DEFAULT_TIER, LLM_MODEL_ROUTES
+)
+from zendell.core.log import get_logger
+
+logger = get_logger(__name__)
+
+@dataclass
+class ModelTier:
+    """Nivel de modelo: model "" usa el modelo global; timeout_seconds 0 no limita la llamada."""
+    name: str
+    model: str = ""
+    timeout_seconds: float = 0.0
+    fallback: str = ""
+
+@dataclass
+class Attempt:
+    """Un intento de llamada: nivel, modelo y tiempo máximo (None = sin límite)."""
+    tier: str
+    model: str
+    timeout: Optional[float] = None
+
+DEFAULT_TIERS: Dict[str, ModelTier] = {
+    "fast": ModelTier("fast", LLM_TIER_FAST_MODEL, LLM_TIER_FAST_TIMEOUT_SECONDS, LLM_TIER_FAST_FALLBACK),
+    "standard": ModelTier("standard", LLM_TIER_STANDARD_MODEL, LLM_TIER_STANDARD_TIMEOUT_SECONDS, LLM_TIER_STANDARD_FALLBACK),
+    "strong": ModelTier("strong", LLM_TIER_STRONG_MODEL, LLM_TIER_STRONG_TIMEOUT_SECONDS, LLM_TIER_STRONG_FALLBACK),
+}
+
+def parse_routes(spec: str) -> Dict[str, str]:
+    """Convierte "classify_*=fast,generate_user_summary=strong" en {patrón: nivel}."""
+    routes = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        pattern, tier = (part.strip() for part in item.split("=", 1))
+        if pattern and tier:
+            routes[pattern] = tier
+    return routes
+
+class ModelRouter:
+    """Tabla call_site -> nivel y cadenas de respaldo entre niveles."""
+
+    def __init__(
+        self,
+        tiers: Optional[Dict[str, ModelTier]] = None,
+        routes: Optional[Dict[str, str]] = None,
+        default_tier: str = LLM_DEFAULT_TIER
+    ):
+        self.tiers = dict(tiers if tiers is not None else DEFAULT_TIERS)
+        self.routes = dict(routes if routes is not None else parse_routes(LLM_MODEL_ROUTES))
+        self.default_tier = default_tier
+        for tier in {default_tier, *self.routes.values()} - set(self.tiers):
+            logger.warning("Nivel de modelo desconocido en las rutas: %s", tier)
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def set_route(self, pattern: str, tier: str) -> None:
+        """Asigna un call_site (o patrón con comodines) a un nivel."""
+        if tier not in self.tiers:
+            raise ValueError(f"Nivel de modelo desconocido: {tier}")
+        self.routes[pattern] = tier
+
+    def tier_for(self, call_site: str) -> str:
+        """Nivel del call_site: ruta exacta, después el primer patrón que coincida, si no el nivel por defecto."""
+        tier = self.routes.get(call_site)
+        if tier is None:
+            tier = next((t for pattern, t in self.routes.items() if fnmatchcase(call_site or "", pattern)), self.default_tier)
+        return tier if tier in self.tiers else self.default_tier
+
+    def plan(self, call_site: str, default_model: str) -> List[Attempt]:
+        """Intentos para la llamada: el nivel de la ruta seguido de su cadena de respaldo."""
+        attempts: List[Attempt] = []
+        seen_tiers = set()
+        name = self.tier_for(call_site)
+        while name and name in self.tiers and name not in seen_tiers:
+            seen_tiers.add(name)
+            tier = self.tiers[name]
+            model = tier.model or default_model
+            if all(attempt.model != model for attempt in attempts):
+                attempts.append(Attempt(name, model, tier.timeout_seconds or None))
+            name = tier.fallback
+        return attempts or [Attempt("", default_model)]
+
+    # ======== MÉTRICAS ========
+
+    def record(self, tier: str, latency_ms: float = 0.0, timed_out: bool = False) -> None:
+        """Registra el resultado de un intento (llamado por llm_provider)."""
+        if not tier:
+            return
+        with self._lock:
+            stats = self._stats.setdefault(tier, {"calls": 0, "timeouts": 0, "latency_ms": 0.0})
+            if timed_out:
+                stats["timeouts"] += 1
+            else:
+                stats["calls"] += 1
+                stats["latency_ms"] += latency_ms
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Por nivel: modelo, objetivo de latencia, llamadas, timeouts y latencia media."""
+        with self._lock:
+            metrics = {}
+            for name, tier in self.tiers.items():
+                stats = self._stats.get(name, {"calls": 0, "timeouts": 0, "latency_ms": 0.0})
+                metrics[name] = {
+                    "model": tier.model,
+                    "timeout_seconds": tier.timeout_seconds,
+                    "fallback": tier.fallback,
+                    "calls": stats["calls"],
+                    "timeouts": stats["timeouts"],
+                    "avg_latency_ms": round(stats["latency_ms"] / stats["calls"], 1) if stats["calls"] else 0.0
+                }
+            return metrics
+
+router = ModelRouter()
+
+def set_router(new_router: ModelRouter) -> ModelRouter:
+    """Sustituye la tabla de enrutado (p. ej. en tests o benchmarks) y devuelve la anterior."""
+    global router
+    previous, router = router, new_router
+    return previous
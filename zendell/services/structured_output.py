@@ -0,0 +1,275 @@
+# zendell/services/structured_output.py
+"""
+Salida estructurada (JSON) de las llamadas al LLM que usan los agentes.
+
+- Cada call_site que espera JSON declara su esquema en SCHEMAS (subconjunto de JSON Schema:
+  type, properties, required, items), con la forma de los datos que usa su código.
+- ask_json() pide al proveedor salida JSON (LLM_STRUCTURED_OUTPUT_MODE: modo JSON o el
+  esquema declarado), extrae el objeto aunque venga entre ```json``` o con texto alrededor
+  y lo valida contra el esquema.
+- Solo si la respuesta no valida se hace una llamada de reparación (call_site "repair_json",
+  enrutada al nivel fast) con la respuesta y los errores, no con el prompt original.
+- Si tampoco valida, o el LLM no responde, devuelve None y cada agente usa su valor por defecto.
+- get_metrics() cuenta por call_site las respuestas válidas, reparadas, inválidas y las llamadas de reparación.
+"""
+
+import json
+import re
+import sys
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from config.settings import LLM_STRUCTURED_OUTPUT_MODE, LLM_STRUCTURED_OUTPUT_REPAIR
+from zendell.services import llm_provider
+from zendell.core.log import get_logger
+
+logger = get_logger(__name__)
+
+REPAIR_CALL_SITE = "repair_json"
+# Caracteres de la respuesta inválida que se envían en la llamada de reparación
+REPAIR_MAX_CHARS = 4000
+
+_STRING = {"type": "string"}
+_STRINGS = {"type": "array", "items": _STRING}
+
+# Esquemas por call_site: lo que el código de cada función lee de la respuesta
+SCHEMAS: Dict[str, Dict[str, Any]] = {
+    "classify_activity": {
+        "type": "object",
+        "properties": {"category": _STRING},
+        "required": ["category"]
+    },
+    "extract_sub_activities": {
+        "type": "object",
+        "properties": {"activities": {"type": "array", "items": {
+            "type": "object",
+            "properties": {
+                "title": _STRING,
+                "category": _STRING,
+                "importance": {"type": ["integer", "number", "string"]},
+                "time_context": _STRING
+            }
+        }}},
+        "required": ["activities"]
+    },
+    "generate_clarification_questions": {
+        "type": "object",
+        "properties": {"questions": _STRINGS},
+        "required": ["questions"]
+    },
+    "clarifier_node": {
+        "type": "object",
+        "properties": {"questions": _STRINGS},
+        "required": ["questions"]
+    },
+    "process_clarifier_response": {
+        "type": "object",
+        "properties": {
+            "analysis": {"type": "array", "items": {
+                "type": "object",
+                "properties": {"question": _STRING, "extracted_info": _STRING, "insights": _STRING}
+            }},
+            "new_questions": _STRINGS
+        },
+        "required": ["analysis"]
+    },
+    "extract_entities_from_activity": {
+        "type": "object",
+        "properties": {"entities": {"type": "array", "items": {
+            "type": "object",
+            "properties": {"name": _STRING, "type": _STRING, "relationship": _STRING}
+        }}},
+        "required": ["entities"]
+    },
+    "extract_and_update_user_info": {
+        "type": "object",
+        "properties": {field: {"type": ["string", "null"]} for field in ("name", "ocupacion", "gustos", "metas")}
+    },
+    "analyze_conversation": {
+        "type": "object",
+        "properties": {
+            "mood": _STRING,
+            "topics": _STRINGS,
+            "concerns": _STRINGS,
+            "insights": _STRINGS,
+            "implicit_needs": _STRINGS
+        },
+        "required": ["mood"]
+    },
+    "_extract_entities_from_message": {
+        "type": "object",
+        "properties": {"entities": {"type": "array", "items": {
+            "type": "object",
+            "properties": {"name": _STRING, "type": _STRING, "context": _STRING}
+        }}},
+        "required": ["entities"]
+    },
+}
+
+# ======== VALIDACIÓN ========
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+    "null": type(None),
+}
+
+def _is_type(value: Any, name: str) -> bool:
+    if name in ("integer", "number") and isinstance(value, bool):
+        return False
+    if name == "integer" and isinstance(value, float):
+        return value.is_integer()
+    return isinstance(value, _TYPES.get(name, object))
+
+def validate(value: Any, schema: Dict[str, Any], path: str = "$") -> List[str]:
+    """Errores de `value` frente al esquema (lista vacía si es válido)."""
+    expected = schema.get("type")
+    if expected:
+        types = expected if isinstance(expected, list) else [expected]
+        if not any(_is_type(value, name) for name in types):
+            return [f"{path}: se esperaba {'/'.join(types)}, no {type(value).__name__}"]
+    errors: List[str] = []
+    if isinstance(value, dict):
+        for key in schema.get("required", []):
+            if key not in value:
+                errors.append(f"{path}: falta '{key}'")
+        for key, subschema in schema.get("properties", {}).items():
+            if key in value:
+                errors.extend(validate(value[key], subschema, f"{path}.{key}"))
+    elif isinstance(value, list) and "items" in schema:
+        for index, item in enumerate(value):
+            errors.extend(validate(item, schema["items"], f"{path}[{index}]"))
+    return errors
+
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+
+def extract_json(text: str) -> Any:
+    """
+    JSON de la respuesta: el texto completo, el bloque ```json``` o el primer objeto
+    que empiece por '{' y se pueda decodificar. ValueError si no hay ninguno.
+    """
+    text = (text or "").strip()
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    fence = _FENCE.search(text)
+    if fence:
+        try:
+            return json.loads(fence.group(1))
+        except ValueError:
+            pass
+    decoder = json.JSONDecoder()
+    for match in re.finditer(r"\{", text):
+        try:
+            return decoder.raw_decode(text, match.start())[0]
+        except ValueError:
+            continue
+    raise ValueError("la respuesta no contiene JSON")
+
+def parse(text: str, schema: Dict[str, Any]) -> Tuple[Any, List[str]]:
+    """(valor, errores) de la respuesta; errores vacío si el JSON cumple el esquema."""
+    try:
+        value = extract_json(text)
+    except ValueError as e:
+        return None, [str(e)]
+    return value, validate(value, schema)
+
+def response_format(call_site: str, schema: Dict[str, Any], mode: str = None) -> Optional[Dict[str, Any]]:
+    """response_format para el proveedor según el modo configurado (None con "off")."""
+    mode = mode or LLM_STRUCTURED_OUTPUT_MODE
+    if mode == "json_schema":
+        name = re.sub(r"[^a-zA-Z0-9_-]", "_", call_site or "response")[:64]
+        return {"type": "json_schema", "json_schema": {"name": name, "schema": schema}}
+    if mode == "json_object":
+        return {"type": "json_object"}
+    return None
+
+# ======== MÉTRICAS ========
+
+_stats: Dict[str, Dict[str, int]] = {}
+_stats_lock = threading.Lock()
+
+def _record(call_site: str, outcome: str, repair_call: bool = False) -> None:
+    with _stats_lock:
+        stats = _stats.setdefault(call_site, {"calls": 0, "valid": 0, "repaired": 0, "invalid": 0, "unavailable": 0, "repair_calls": 0})
+        stats["calls"] += 1
+        stats[outcome] += 1
+        if repair_call:
+            stats["repair_calls"] += 1
+
+def get_metrics() -> Dict[str, Any]:
+    """Totales y, por call_site, respuestas válidas a la primera, reparadas, inválidas y sin respuesta."""
+    with _stats_lock:
+        by_call_site = {site: dict(stats) for site, stats in _stats.items()}
+    totals = {key: sum(stats[key] for stats in by_call_site.values())
+              for key in ("calls", "valid", "repaired", "invalid", "unavailable", "repair_calls")}
+    answered = totals["calls"] - totals["unavailable"]
+    totals["parse_failure_rate"] = round((totals["repaired"] + totals["invalid"]) / answered, 4) if answered else 0.0
+    return {**totals, "by_call_site": by_call_site}
+
+def reset_metrics() -> None:
+    with _stats_lock:
+        _stats.clear()
+
+# ======== API DE LOS AGENTES ========
+
+def _messages(prompt: str) -> List[Dict[str, str]]:
+    return [{"role": "user", "content": prompt}]
+
+def _repair_prompt(text: str, schema: Dict[str, Any], errors: List[str]) -> str:
+    return (
+        "La siguiente respuesta debía ser un JSON válido según este esquema (JSON Schema):\n"
+        f"{json.dumps(schema, ensure_ascii=False)}\n\n"
+        f"Errores encontrados: {'; '.join(errors[:5])}\n\n"
+        f"Respuesta:\n{text[:REPAIR_MAX_CHARS]}\n\n"
+        "Devuelve ÚNICAMENTE el JSON corregido, conservando la información de la respuesta y sin texto adicional."
+    )
+
+def ask_json(
+    prompt: str,
+    call_site: str = None,
+    schema: Dict[str, Any] = None,
+    model: str = None,
+    temperature: float = 0.7,
+    repair: bool = None
+) -> Optional[Any]:
+    """
+    Llama al LLM pidiendo JSON y devuelve el valor validado contra el esquema del call_site
+    (por defecto, el nombre de la función que llama), o None si no hay respuesta válida.
+    El prompt debe mencionar "JSON" (requisito del modo JSON de OpenAI); si no, no se pide formato.
+    """
+    call_site = call_site or sys._getframe(1).f_code.co_name
+    schema = schema or SCHEMAS.get(call_site) or {"type": "object"}
+    fmt = response_format(call_site, schema) if "json" in prompt.lower() else None
+
+    response = llm_provider.ask_llm(_messages(prompt), model, temperature, call_site, response_format=fmt)
+    if response is None:
+        _record(call_site, "unavailable")
+        return None
+    logger.debug("Respuesta JSON de %s: '%.100s...'", call_site, response.text, sample=True)
+    value, errors = parse(response.text, schema)
+    if not errors:
+        _record(call_site, "valid")
+        return value
+
+    logger.warning("Respuesta de %s no válida: %s", call_site, "; ".join(errors[:3]))
+    if not (LLM_STRUCTURED_OUTPUT_REPAIR if repair is None else repair) or not response.text.strip():
+        _record(call_site, "invalid")
+        return None
+
+    # Una única llamada de reparación, barata: nivel fast, temperatura 0 y solo la respuesta inválida
+    repaired = llm_provider.ask_llm(
+        _messages(_repair_prompt(response.text, schema, errors)), None, 0.0, REPAIR_CALL_SITE,
+        response_format=response_format(call_site, schema)
+    )
+    value, errors = parse(repaired.text, schema) if repaired is not None else (None, ["sin respuesta"])
+    if errors:
+        logger.warning("La reparación de %s no produjo JSON válido: %s", call_site, "; ".join(errors[:3]))
+        _record(call_site, "invalid", repair_call=True)
+        return None
+    _record(call_site, "repaired", repair_call=True)
+    return value
@@ -0,0 +1,34 @@
+# tests/test_benchmarks.py
+
+def test_conversation_replay_covers_every_stage_in_process(monkeypatch):
+    """El replay recorre el ciclo completo con LLM fake y base de datos en memoria."""
+    from zendell.services import llm_provider
+    from benchmarks import conversation_replay
+
+    monkeypatch.setitem(llm_provider._active, "name", llm_provider._active["name"])
+    report = conversation_replay.main(["--users", "2", "--seed", "3"])
+
+    assert report["turns"] == 14
+    assert set(report["stage_latency_ms"]) == {
+        "initial", "ask_profile", "ask_last_hour", "clarifier_last_hour",
+        "ask_next_hour", "clarifier_next_hour", "final"
+    }
+    assert report["llm_calls_per_turn"]["mean"] > 0
+    assert report["db_ops_per_turn"]["mean"] > 0
+    assert report["memory_kb"]["peak"] >= report["memory_kb"]["end"]
+
+
+def test_load_generator_reports_throughput_and_saturation(monkeypatch):
+    """Un paso corto de carga con el Communicator real, LLM fake y base de datos en memoria."""
+    from zendell.services import llm_provider
+    from benchmarks import load_generator
+
+    monkeypatch.setitem(llm_provider._active, "name", llm_provider._active["name"])
+    report = load_generator.main(["--users", "2", "--duration", "1", "--rate", "3", "--latency-ms", "0", "--jitter-ms", "0"])
+
+    step = report["steps"][0]
+    assert step["messages_sent"] > 0
+    assert step["messages_completed"] + step["messages_unfinished"] + step["errors"] == step["messages_sent"]
+    assert step["latency_ms"]["count"] == step["messages_completed"]
+    assert step["event_loop_lag_ms"]["count"] > 0
+    assert load_generator.find_saturation([{**step, "messages_unfinished": 1}], slo_p99_ms=1e9) == 2
@@ -0,0 +1,408 @@
+# /tests/test_core.py
+
+from unittest.mock import MagicMock
+from zendell.agents.orchestrator import build_system_context, generate_last_hour_question
+
+
+# =============================================================================
+#                        TESTS PARA CONTEXTO DEL SISTEMA
+# =============================================================================
+def test_stage_question_reads_the_user_state_once(monkeypatch):
+    """La pregunta de etapa y su contexto del sistema comparten una sola lectura del estado."""
+    from zendell.agents import orchestrator
+
+    db = MagicMock()
+    db.get_state.return_value = {"name": "Daniel", "short_term_info": ["[USER] Hola"]}
+    db.get_dialogue.return_value = []
+    chats = []
+    monkeypatch.setattr(orchestrator, "ask_gpt_chat", lambda chat, temperature: chats.append(chat) or "¿Qué tal tu hora?")
+
+    ranges = {"last_hour": {"start": "10:00", "end": "11:00"}}
+    assert generate_last_hour_question(db, "u1", ranges) == "¿Qué tal tu hora?"
+
+    assert db.get_state.call_count == 1
+    assert "Usuario: Daniel" in chats[0][0]["content"]
+    assert "Usuario: Daniel" in build_system_context(db, "u1", "final")
+    assert db.get_state.call_count == 2
+
+
+# =============================================================================
+#                        TESTS PARA USER DISPATCHER
+# =============================================================================
+def test_dispatcher_orders_per_user_and_parallelizes_users():
+    """Mensajes del mismo usuario en orden; usuarios distintos en paralelo."""
+    import asyncio
+    from zendell.core.dispatcher import UserDispatcher
+
+    events = []
+
+    async def handle(user_id, n):
+        events.append((user_id, n, "start"))
+        await asyncio.sleep(0.01)
+        events.append((user_id, n, "end"))
+        return n
+
+    async def run():
+        dispatcher = UserDispatcher(max_concurrent_users=2)
+        results = await asyncio.gather(
+            dispatcher.submit("a", handle, "a", 1),
+            dispatcher.submit("a", handle, "a", 2),
+            dispatcher.submit("b", handle, "b", 1),
+        )
+        return results, dispatcher.get_metrics()
+
+    results, metrics = asyncio.run(run())
+
+    assert results == [1, 2, 1]
+    # El segundo mensaje de "a" empieza solo cuando termina el primero
+    a_events = [e for e in events if e[0] == "a"]
+    assert a_events == [("a", 1, "start"), ("a", 1, "end"), ("a", 2, "start"), ("a", 2, "end")]
+    # "b" arranca antes de que "a" termine su primer mensaje
+    assert events.index(("b", 1, "start")) < events.index(("a", 1, "end"))
+    assert metrics["processed"] == 3
+    assert metrics["queued_total"] == 0
+
+
+# =============================================================================
+#                        TESTS PARA DEBOUNCE DEL COMMUNICATOR
+# =============================================================================
+def test_communicator_coalesces_rapid_fragments_into_one_turn():
+    """Fragmentos seguidos generan un solo turno; un comando vacía lo pendiente antes."""
+    import asyncio
+    from zendell.agents.communicator import Communicator
+
+    async def run():
+        communicator = Communicator(MagicMock(), debounce_seconds=0.05, debounce_max_seconds=1)
+        turns = []
+        commands = []
+
+        async def fake_process(text, author_id):
+            turns.append(text)
+
+        async def fake_command(text, author_id):
+            commands.append((text, list(turns)))
+
+        communicator._process_user_message = fake_process
+        communicator._process_command = fake_command
+
+        await asyncio.gather(
+            communicator.on_user_message("fui al gimnasio", "u1"),
+            communicator.on_user_message("y luego trabajé", "u1"),
+        )
+        await asyncio.gather(
+            communicator.on_user_message("estudié", "u1"),
+            communicator.on_user_message("FIN", "u1"),
+        )
+        return turns, commands, communicator.get_metrics()
+
+    turns, commands, metrics = asyncio.run(run())
+
+    assert turns == ["fui al gimnasio\ny luego trabajé", "estudié"]
+    assert commands == [("FIN", turns)]
+    assert metrics["coalesced_messages"] == 1
+    assert metrics["pending_fragments"] == 0
+
+
+# =============================================================================
+#                        TESTS PARA ORCHESTRATOR EXECUTOR
+# =============================================================================
+def test_executor_keeps_event_loop_responsive_and_times_out():
+    """El trabajo bloqueante no congela el loop y respeta el timeout."""
+    import asyncio
+    import time as _time
+    from zendell.core.executor import OrchestratorExecutor
+
+    async def run():
+        executor = OrchestratorExecutor(max_workers=2, default_timeout=0.05)
+        ticks = []
+
+        async def heartbeat():
+            for _ in range(3):
+                ticks.append(_time.monotonic())
+                await asyncio.sleep(0.01)
+
+        value, _ = await asyncio.gather(executor.run(_time.sleep, 0.03, timeout=1), heartbeat())
+        try:
+            await executor.run(_time.sleep, 0.2)
+            timed_out = False
+        except asyncio.TimeoutError:
+            timed_out = True
+        executor.shutdown()
+        return ticks, timed_out, executor.get_metrics()
+
+    ticks, timed_out, metrics = asyncio.run(run())
+
+    assert len(ticks) == 3
+    assert timed_out
+    assert metrics["completed"] == 1
+    assert metrics["timeouts"] == 1
+
+
+def test_timed_out_turn_is_cancelled_and_holds_the_mailbox_until_its_thread_ends(monkeypatch):
+    """Tras un timeout el usuario recibe el aviso, el turno abandonado no guarda respuesta ni etapa y el siguiente espera."""
+    import asyncio
+    from zendell.agents.communicator import Communicator, TIMEOUT_FALLBACK_TEXT
+    from zendell.core.db import MongoDBManager
+    from zendell.core.executor import OrchestratorExecutor
+    from zendell.services import llm_provider
+    from zendell.services.fake_llm import FakeLLMProvider
+    from zendell.services.messaging_service import MessagingService, LoopbackChannel
+
+    monkeypatch.setitem(llm_provider._active, "name", llm_provider._active["name"])
+    monkeypatch.setitem(llm_provider._providers, "fake", llm_provider.get_provider("fake"))
+    slow = FakeLLMProvider(latency_ms=150, jitter_ms=0)
+    llm_provider.set_provider(slow)
+    db = MongoDBManager(uri="memory://orphaned-turn", db_name="zendell_test_db")
+    channel = LoopbackChannel()
+    executor = OrchestratorExecutor(max_workers=2, default_timeout=0.05)
+
+    async def run():
+        communicator = Communicator(db, debounce_seconds=0, executor=executor, messaging=MessagingService([channel]))
+        await communicator.on_user_message("hola, me llamo Ana", "u1")
+        # on_user_message vuelve cuando el hilo abandonado terminó: el buzón ya está libre
+        orphaned_after_timeout = executor.get_metrics()["orphaned"]
+        slow.latency_ms = 0
+        executor.default_timeout = 5
+        await communicator.on_user_message("hola de nuevo", "u1")
+        await communicator.messaging.drain()
+        return orphaned_after_timeout
+
+    orphaned_after_timeout = asyncio.run(run())
+    executor.shutdown()
+
+    assert orphaned_after_timeout == 0
+    assert executor.get_metrics()["timeouts"] == 1
+    # Solo el turno completo guardó respuesta y cambió la etapa
+    dialogue = db.get_dialogue("u1", limit=10)
+    assert [m["role"] for m in dialogue] == ["user", "user", "assistant"]
+    assert channel.messages("u1")[0] == TIMEOUT_FALLBACK_TEXT
+    assert channel.messages("u1")[1] == dialogue[-1]["content"]
+    assert db.get_state("u1")["conversation_stage"] != "initial"
+
+
+def test_turn_error_replies_with_an_error_text_not_the_timeout_one(monkeypatch):
+    """Un fallo del orquestador (no un timeout) se registra y el usuario recibe el aviso de error, con y sin streaming."""
+    import asyncio
+    from zendell.agents import communicator as communicator_module
+    from zendell.agents.communicator import Communicator, ERROR_FALLBACK_TEXT
+    from zendell.services.messaging_service import MessagingService, LoopbackChannel
+
+    class StreamingLoopback(LoopbackChannel):
+        name = "streaming"
+        supports_streaming = True
+
+    def broken_flow(user_id, text, db, on_token=None):
+        if on_token is not None:
+            on_token("Hola")
+        raise RuntimeError("proveedor caído")
+
+    monkeypatch.setattr(communicator_module, "orchestrator_flow", broken_flow)
+    plain, streaming = LoopbackChannel(), StreamingLoopback()
+
+    async def run():
+        for channel in (plain, streaming):
+            communicator = Communicator(MagicMock(), debounce_seconds=0, messaging=MessagingService([channel]))
+            await communicator.on_user_message("hola", "u1")
+            await communicator.messaging.drain()
+
+    asyncio.run(run())
+
+    assert plain.messages("u1") == [ERROR_FALLBACK_TEXT]
+    assert streaming.messages("u1") == [ERROR_FALLBACK_TEXT]
+
+
+# =============================================================================
+#                        TESTS PARA LA API HTTP
+# =============================================================================
+def test_api_batch_routes_replies_to_each_user(monkeypatch):
+    """El endpoint batch procesa varios usuarios y devuelve las respuestas de cada uno."""
+    from fastapi.testclient import TestClient
+    from zendell.agents import communicator as communicator_module
+    from zendell.agents.communicator import Communicator
+    from zendell.core.api import create_app
+    from zendell.services.messaging_service import MessagingService, LoopbackChannel
+
+    monkeypatch.setattr(
+        communicator_module, "orchestrator_flow",
+        lambda user_id, text, db, on_token=None: {"final_text": f"{user_id}: {text}"}
+    )
+    communicator = Communicator(MagicMock(), debounce_seconds=0, messaging=MessagingService([LoopbackChannel()]))
+    client = TestClient(create_app(communicator, async_db_manager=MagicMock()))
+
+    response = client.post("/messages/batch", json={"messages": [
+        {"user_id": "u1", "text": "hola"},
+        {"user_id": "u2", "text": "buenas"},
+        {"user_id": "u1", "text": "otra cosa"},
+    ]})
+
+    assert response.status_code == 200
+    replies = {r["user_id"]: r["replies"] for r in response.json()["results"]}
+    assert replies == {"u1": ["u1: hola", "u1: otra cosa"], "u2": ["u2: buenas"]}
+    assert client.get("/metrics").json()["processed"] == 3
+
+
+def test_api_returns_each_request_its_own_replies_and_keeps_the_user_channel(monkeypatch):
+    """Peticiones simultáneas del mismo usuario no se roban respuestas y luego se sigue respondiendo por el canal del usuario."""
+    import asyncio
+    import time
+    import httpx
+    from zendell.agents import communicator as communicator_module
+    from zendell.agents.communicator import Communicator
+    from zendell.core.api import create_app
+    from zendell.services.messaging_service import MessagingService, LoopbackChannel
+
+    def slow_flow(user_id, text, db, on_token=None):
+        time.sleep(0.02)
+        return {"final_text": f"re: {text}"}
+
+    monkeypatch.setattr(communicator_module, "orchestrator_flow", slow_flow)
+    loopback = LoopbackChannel()
+    communicator = Communicator(MagicMock(), debounce_seconds=0, messaging=MessagingService([loopback]))
+    app = create_app(communicator, async_db_manager=MagicMock())
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://zendell") as client:
+            first, second = await asyncio.gather(
+                client.post("/messages", json={"user_id": "u1", "text": "uno"}),
+                client.post("/messages", json={"user_id": "u1", "text": "dos"}),
+            )
+        # Un mensaje proactivo posterior vuelve a salir por el canal del usuario, no por la API
+        await communicator.messaging.send_and_wait("u1", "proactivo")
+        return first.json()["replies"], second.json()["replies"]
+
+    first, second = asyncio.run(run())
+
+    assert first == ["re: uno"]
+    assert second == ["re: dos"]
+    assert loopback.messages("u1") == ["proactivo"]
+
+
+def test_api_streams_reply_tokens_as_server_sent_events(monkeypatch):
+    """Los fragmentos llegan como eventos "token" y el texto completo como "reply"."""
+    from fastapi.testclient import TestClient
+    from zendell.agents import communicator as communicator_module
+    from zendell.agents.communicator import Communicator
+    from zendell.core.api import create_app
+    from zendell.services.messaging_service import MessagingService, LoopbackChannel
+
+    def fake_flow(user_id, text, db, on_token=None):
+        for part in ["Hola", ", ", "Daniel"]:
+            on_token(part)
+        return {"final_text": "Hola, Daniel"}
+
+    monkeypatch.setattr(communicator_module, "orchestrator_flow", fake_flow)
+    communicator = Communicator(MagicMock(), debounce_seconds=0, messaging=MessagingService([LoopbackChannel()]))
+    client = TestClient(create_app(communicator, async_db_manager=MagicMock()))
+
+    body = client.post("/messages/stream", json={"user_id": "u1", "text": "hola"}).text
+
+    events = [block.split("\n") for block in body.strip().split("\n\n")]
+    names = [lines[0].removeprefix("event: ") for lines in events]
+    assert names == ["token", "token", "token", "reply", "done"]
+    assert events[3][1] == 'data: "Hola, Daniel"'
+    assert communicator.get_metrics()["messaging"]["first_token_latency_avg_ms"] > 0
+
+
+# =============================================================================
+#                        TESTS PARA INSTRUMENTACIÓN
+# =============================================================================
+def test_orchestrator_turn_reports_llm_db_and_stage_metrics(monkeypatch, tmp_path):
+    """El turno devuelve su traza y se exporta en JSONL y en formato Prometheus."""
+    import json
+    from zendell.agents.orchestrator import orchestrator_flow
+    from zendell.core import instrumentation
+    from zendell.core.db import MongoDBManager
+    from zendell.services import llm_provider
+    from zendell.services.fake_llm import FakeLLMProvider
+
+    monkeypatch.setitem(llm_provider._active, "name", llm_provider._active["name"])
+    llm_provider.set_provider(FakeLLMProvider(sleep=False))
+    monkeypatch.setattr(instrumentation, "registry", instrumentation.MetricsRegistry())
+    jsonl_path = tmp_path / "turns.jsonl"
+    monkeypatch.setattr(instrumentation, "INSTRUMENTATION_JSONL_PATH", str(jsonl_path))
+    db = MongoDBManager(uri="memory://instrumentation-tests", db_name="zendell_instrumentation_db")
+    instrumentation.instrument_db_manager(db)
+
+    result = orchestrator_flow("metrics_user", "Hola, me llamo Ana", db)
+    metrics = result["metrics"]
+
+    assert metrics["stage"] == "initial"
+    assert metrics["llm"]["calls"] == len(metrics["llm"]["spans"]) > 0
+    assert all(span["call_site"] and span["model"] for span in metrics["llm"]["spans"])
+    assert metrics["llm"]["prompt_tokens"] > 0
+    assert metrics["db"]["operations"] > 0
+    assert "save_state" in metrics["db"]["by_method"]
+    assert {"activity_collector", "stage.initial", "persist"} <= set(metrics["spans_ms"])
+
+    exported = [json.loads(line) for line in jsonl_path.read_text(encoding="utf-8").splitlines()]
+    assert exported[-1]["llm"]["calls"] == metrics["llm"]["calls"]
+    assert exported[-1]["wall_ms"] > 0
+
+    text = instrumentation.registry.to_prometheus()
+    assert 'zendell_turns_total{stage="initial"} 1' in text
+    assert 'zendell_turn_duration_ms_bucket{stage="initial",le="+Inf"} 1' in text
+    assert "zendell_llm_calls_total{call_site=" in text
+    assert "zendell_db_operations_total{collection=\"user_states\"" in text
+
+
+def test_instrumenting_a_manager_leaves_its_shared_write_buffer_untouched(monkeypatch, tmp_path):
+    """El buffer compartido conserva su base de datos y sus flushes cuentan en el turno que los hace."""
+    from zendell.core import instrumentation
+    from zendell.core import db as db_module
+    from zendell.core.db import MongoDBManager
+
+    monkeypatch.setattr(instrumentation, "registry", instrumentation.MetricsRegistry())
+    monkeypatch.setattr(instrumentation, "INSTRUMENTATION_JSONL_PATH", None)
+    monkeypatch.setattr(db_module, "WRITE_BUFFER_WAL_PATH", str(tmp_path / "shared.wal"))
+    monkeypatch.setattr(db_module, "INSTRUMENTATION_ENABLED", False)
+    first = MongoDBManager(uri="memory://instrumentation-shared", db_name="zendell_shared_db", write_buffer=True)
+    second = MongoDBManager(uri="memory://instrumentation-shared", db_name="zendell_shared_db", write_buffer=True)
+    assert first.write_buffer is second.write_buffer
+    buffer_db = first.write_buffer.db
+
+    instrumentation.instrument_db_manager(first)
+    assert first.write_buffer.db is buffer_db
+
+    second.save_conversation_message("otro_user", "user", "hola")
+    with instrumentation.turn("shared_user") as trace:
+        first.save_conversation_message("shared_user", "user", "buenas")
+        first.write_buffer.flush()
+    first.write_buffer.close()
+    assert trace.db_ops["conversations.insert_many"][0] == 1
+
+
+# =============================================================================
+#                        TESTS PARA LOGGING
+# =============================================================================
+def test_structured_logger_levels_sampling_and_queue():
+    """Formato perezoso, niveles por módulo, muestreo y escritura por cola en JSON."""
+    import io
+    import json
+    from zendell.core import log
+
+    class Expensive:
+        renders = 0
+
+        def __str__(self):
+            Expensive.renders += 1
+            return "caro"
+
+    stream = io.StringIO()
+    try:
+        log.configure_logging(level="INFO", module_levels="tests.verbose=DEBUG", fmt="json", use_queue=True, stream=stream)
+        quiet_logger = log.get_logger("tests.quiet")
+        verbose_logger = log.get_logger("tests.verbose")
+
+        quiet_logger.debug("No se formatea: %s", Expensive())
+        quiet_logger.info("Turno completado", user_id="u1", stage="final")
+        for index in range(10):
+            verbose_logger.debug("Respuesta del LLM %s", index, sample=0.5)
+        log.shutdown_logging()
+    finally:
+        log.configure_logging()
+
+    entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert Expensive.renders == 0
+    assert entries[0] == {**entries[0], "level": "INFO", "logger": "zendell.tests.quiet", "user_id": "u1", "stage": "final"}
+    sampled = [entry["msg"] for entry in entries if entry["logger"] == "zendell.tests.verbose"]
+    assert sampled == [f"Respuesta del LLM {index}" for index in (0, 2, 4, 6, 8)]
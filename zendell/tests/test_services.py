@@ -31,3 +31,562 @@ def test_ask_gpt_basic(prompt):
     # Verificación extra: comprobar que la respuesta contiene alguna palabra clave esperada
     if "capital" in prompt.lower():
         assert "París" in response, "La respuesta debería mencionar 'París'."
+
+
+# =============================================================================
+#                        TESTS PARA LA COLA DE SALIDA DE DISCORD
+# =============================================================================
+class _FakeChannel:
+    def __init__(self, fail_with=None):
+        self.id = 1
+        self.sent = []
+        self.fail_with = list(fail_with or [])
+
+    async def send(self, text):
+        if self.fail_with:
+            raise self.fail_with.pop(0)
+        self.sent.append(text)
+        return text
+
+
+def test_outbound_dispatcher_merges_splits_and_retries_429():
+    """Agrupa mensajes cortos en cola, divide los largos y reintenta un 429."""
+    import asyncio
+    import discord
+    from types import SimpleNamespace
+    from zendell.services.discord_service import OutboundDispatcher
+
+    rate_limited = discord.HTTPException(SimpleNamespace(status=429, reason="Too Many Requests"), "slow down")
+    rate_limited.retry_after = 0.01
+
+    async def run():
+        dispatcher = OutboundDispatcher(rate_per_second=1000, burst=10, max_retries=2)
+        channel = _FakeChannel(fail_with=[rate_limited])
+        await asyncio.gather(
+            dispatcher.send(channel, "hola"),
+            dispatcher.send(channel, "¿qué tal?"),
+            dispatcher.send(channel, "adiós"),
+        )
+        await dispatcher.send(channel, "x" * 2500)
+        return channel, dispatcher.get_metrics()
+
+    channel, metrics = asyncio.run(run())
+
+    assert channel.sent[0] == "hola\n\n¿qué tal?\n\nadiós"
+    assert [len(m) for m in channel.sent[1:]] == [2000, 500]
+    assert metrics["rate_limited"] == 1
+    assert metrics["merged_messages"] == 2
+
+
+# =============================================================================
+#                        TESTS PARA MESSAGING SERVICE
+# =============================================================================
+def test_messaging_service_delivers_in_order_and_retries():
+    """El loopback recibe los mensajes en orden por usuario y se reintentan los fallos."""
+    import asyncio
+    from zendell.services.messaging_service import MessagingService, LoopbackChannel
+
+    class FlakyLoopback(LoopbackChannel):
+        failures = 1
+
+        async def send(self, user_id, text):
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError("caída temporal")
+            return await super().send(user_id, text)
+
+    async def run():
+        channel = FlakyLoopback(max_concurrency=2)
+        service = MessagingService([channel], retry_base_delay=0.001)
+        receipts = [await service.send("u1", f"mensaje {i}") for i in range(3)]
+        receipts.append(await service.send("u2", "hola"))
+        assert all(r.status == "queued" for r in receipts)
+        await service.drain()
+        return channel, receipts, service.get_metrics()
+
+    channel, receipts, metrics = asyncio.run(run())
+
+    assert channel.messages("u1") == ["mensaje 0", "mensaje 1", "mensaje 2"]
+    assert channel.messages("u2") == ["hola"]
+    assert all(r.status == "delivered" for r in receipts)
+    assert receipts[0].attempts == 2
+    assert metrics["delivered"] == 4
+    assert metrics["retries"] == 1
+
+
+def test_discord_channel_failures_are_retried_and_reported_as_failed(monkeypatch):
+    """Sin canal de Discord o con un error del envío, el acuse queda en failed tras los reintentos."""
+    import asyncio
+    from zendell.services import discord_service
+    from zendell.services.discord_service import OutboundDispatcher
+    from zendell.services.messaging_service import MessagingService, DiscordChannel
+
+    monkeypatch.setattr(discord_service, "outbound", OutboundDispatcher(rate_per_second=1000, burst=10))
+
+    async def run():
+        service = MessagingService([DiscordChannel()], max_retries=1, retry_base_delay=0.001)
+        monkeypatch.setattr(discord_service.client, "default_channel", None)
+        missing = await service.send_and_wait("u1", "hola")
+        monkeypatch.setattr(discord_service.client, "default_channel", _FakeChannel(fail_with=[RuntimeError("403 Forbidden")] * 2))
+        rejected = await service.send_and_wait("u1", "hola")
+        channel = _FakeChannel(fail_with=[RuntimeError("reset")])
+        monkeypatch.setattr(discord_service.client, "default_channel", channel)
+        recovered = await service.send_and_wait("u1", "hola")
+        return missing, rejected, recovered, channel, service.get_metrics()
+
+    missing, rejected, recovered, channel, metrics = asyncio.run(run())
+
+    assert (missing.status, missing.attempts) == ("failed", 2) and "default_channel" in missing.error
+    assert (rejected.status, rejected.error) == ("failed", "403 Forbidden")
+    assert recovered.status == "delivered" and channel.sent == ["hola"]
+    assert (metrics["delivered"], metrics["failed"], metrics["retries"]) == (1, 2, 3)
+
+
+def test_stream_waits_for_its_first_token_outside_the_channel_slot_and_resends_only_the_rest():
+    """Un streaming sin fragmentos no ocupa el hueco del canal; tras un fallo parcial solo se envía lo que falta."""
+    import asyncio
+    from zendell.services.messaging_service import MessagingService, LoopbackChannel, PartialDelivery
+
+    class BrokenStreamChannel(LoopbackChannel):
+        supports_streaming = True
+
+        async def send_stream(self, user_id, stream):
+            shown = ""
+            async for token in stream:
+                shown += token
+                break
+            self.outbox.setdefault(user_id, []).append(shown)
+            final = await stream.wait_closed()
+            raise PartialDelivery(final[len(shown):].lstrip(), ConnectionError("edición rechazada"))
+
+    async def run():
+        channel = BrokenStreamChannel(max_concurrency=1)
+        service = MessagingService([channel], retry_base_delay=0.001)
+        stream = await service.open_stream("u1")
+        # Con un único hueco, el mensaje de otro usuario no espera a que el turno de u1 empiece a responder
+        other = await asyncio.wait_for(service.send_and_wait("u2", "hola"), 1)
+        stream.push("Hola")
+        stream.push(" mundo")
+        stream.close("Hola mundo")
+        await service.drain()
+        return channel, other, service.receipts[0], service.get_metrics()
+
+    channel, other, receipt, metrics = asyncio.run(run())
+
+    assert other.status == "delivered"
+    assert channel.messages("u1") == ["Hola", "mundo"]
+    assert (receipt.status, receipt.text) == ("delivered", "Hola mundo")
+    assert metrics["retries"] == 1
+
+
+def test_discord_stream_retries_a_429_on_the_final_edit(monkeypatch):
+    """Un 429 al editar el mensaje con el texto final se reintenta por la cola de salida y no pierde el texto."""
+    import asyncio
+    import discord
+    from types import SimpleNamespace
+    from zendell.services import discord_service
+    from zendell.services.discord_service import OutboundDispatcher, send_dm_stream
+    from zendell.services.messaging_service import TokenStream
+
+    rate_limited = discord.HTTPException(SimpleNamespace(status=429, reason="Too Many Requests"), "slow down")
+    rate_limited.retry_after = 0.01
+
+    class EditableMessage:
+        def __init__(self, content):
+            self.content = content
+            self.fail_with = [rate_limited]
+
+        async def edit(self, content):
+            if self.fail_with:
+                raise self.fail_with.pop(0)
+            self.content = content
+
+    class StreamChannel(_FakeChannel):
+        async def send(self, text):
+            await super().send(text)
+            return EditableMessage(text)
+
+    monkeypatch.setattr(discord_service, "outbound", OutboundDispatcher(rate_per_second=1000, burst=10, max_retries=2))
+    monkeypatch.setattr(discord_service, "DISCORD_STREAM_EDIT_INTERVAL", 3600)
+    channel = StreamChannel()
+    monkeypatch.setattr(discord_service.client, "default_channel", channel)
+
+    async def run():
+        stream = TokenStream(asyncio.get_running_loop())
+        stream.push("Hola")
+        stream.push(", Daniel")
+        stream.close("Hola, Daniel")
+        return await send_dm_stream("u1", stream), discord_service.outbound.get_metrics()
+
+    message, metrics = asyncio.run(run())
+
+    assert channel.sent == ["Hola"]
+    assert message.content == "Hola, Daniel"
+    assert metrics["rate_limited"] == 1
+
+
+def test_fake_llm_provider_answers_by_call_site_and_simulates_failures(monkeypatch):
+    """El proveedor fake responde según la función que llama y puede simular fallos."""
+    from zendell.services import llm_provider
+    from zendell.services.fake_llm import FakeLLMProvider
+    from zendell.agents.activity_collector import extract_sub_activities, generate_clarification_questions
+
+    monkeypatch.setitem(llm_provider._active, "name", llm_provider._active["name"])
+    monkeypatch.setitem(llm_provider._providers, "fake", llm_provider.get_provider("fake"))
+    fake = FakeLLMProvider(responses={"generate_clarification_questions": [{"questions": ["¿Primera?"]}, {"questions": ["¿Segunda?"]}]},
+                           latency_ms=5, jitter_ms=2, seed=7, sleep=False)
+    llm_provider.set_provider(fake)
+
+    activities = extract_sub_activities("Estuve programando", "past")
+    assert activities[0]["title"] == "Estuve programando"
+    assert generate_clarification_questions("x", "y") == ["¿Primera?"]
+    assert generate_clarification_questions("x", "y") == ["¿Segunda?"]
+    assert llm_provider.ask_gpt("hola", call_site="saludo") == "Entendido. ¿Qué más hiciste en la última hora?"
+    assert "".join(llm_provider.ask_gpt_chat_stream([{"role": "user", "content": "hola"}])) == fake.calls[-1].text
+
+    metrics = fake.get_metrics()
+    assert metrics["by_call_site"]["extract_sub_activities"]["calls"] == 1
+    assert 3 <= metrics["by_call_site"]["saludo"]["latency_ms"] <= 7
+
+    llm_provider.set_provider(FakeLLMProvider(failure_rate=1.0, sleep=False))
+    assert llm_provider.ask_gpt("hola") is None
+
+
+def test_llm_usage_is_accounted_per_user_and_daily_budget_degrades_then_skips(monkeypatch):
+    """El uso se imputa al usuario del turno; al agotar el presupuesto se degrada y luego se omite lo prescindible."""
+    from zendell.core.db import MongoDBManager
+    from zendell.services import llm_provider, llm_usage
+    from zendell.services.fake_llm import FakeLLMProvider
+
+    monkeypatch.setitem(llm_provider._active, "name", llm_provider._active["name"])
+    monkeypatch.setitem(llm_provider._providers, "fake", llm_provider.get_provider("fake"))
+    fake = FakeLLMProvider(sleep=False)
+    llm_provider.set_provider(fake)
+    manager = MongoDBManager(uri="memory://usage-test", db_name="zendell_test_db")
+    tracker = llm_usage.UsageTracker(daily_budget_usd=0.0001, hard_multiplier=2, fallback_model="gpt-4o-mini",
+                                     low_priority={"analyze_tone"})
+    tracker.attach(manager)
+    monkeypatch.setattr(llm_usage, "tracker", tracker)
+
+    with llm_usage.usage_scope("u1"):
+        while tracker.budget_ratio("u1") < 1:
+            assert llm_provider.ask_gpt("hola " * 50, model="gpt-4o", call_site="analyze_tone")
+        llm_provider.ask_gpt("hola " * 50, model="gpt-4o", call_site="analyze_tone")
+        assert fake.calls[-1].model == "gpt-4o-mini"
+        while tracker.budget_ratio("u1") < 2:
+            llm_provider.ask_gpt("hola " * 50, model="gpt-4o", call_site="orchestrator")
+            assert fake.calls[-1].model == "gpt-4o"
+        llm_provider.ask_gpt("hola", model="gpt-4o", call_site="orchestrator")
+        assert fake.calls[-1].model == "gpt-4o-mini"
+        calls = len(fake.calls)
+        assert llm_provider.ask_gpt("hola", call_site="analyze_tone") is None
+        assert len(fake.calls) == calls
+        assert not tracker.allows("u1", "analyze_tone") and tracker.allows("u1", "orchestrator")
+    assert llm_provider.ask_gpt("hola", call_site="analyze_tone") is not None
+
+    assert manager.llm_usage_coll.count_documents({}) == 0
+    assert tracker.flush() >= 3
+    rows = list(manager.llm_usage_coll.find({"user_id": "u1"}, {"_id": 0}))
+    assert {(row["agent"], row["model"]) for row in rows} >= {("analyze_tone", "gpt-4o"), ("analyze_tone", "gpt-4o-mini")}
+    usage = tracker.get_usage("u1")
+    assert usage["cost_usd"] >= 2 * 0.0001
+    assert sum(row["skipped"] for row in rows) == 1
+    assert tracker.get_usage(llm_usage.SYSTEM_USER)["by_agent"]["analyze_tone"]["calls"] == 1
+
+
+def test_model_router_picks_tier_per_call_site_and_falls_back_on_timeout(monkeypatch):
+    """Cada call_site usa el modelo de su nivel; si el nivel agota su tiempo se repite con el de respaldo."""
+    from zendell.services import llm_provider, model_router
+    from zendell.services.fake_llm import FakeLLMProvider
+    from zendell.services.model_router import ModelRouter, ModelTier
+
+    monkeypatch.setitem(llm_provider._active, "name", llm_provider._active["name"])
+    monkeypatch.setitem(llm_provider._providers, "fake", llm_provider.get_provider("fake"))
+    monkeypatch.setattr(llm_provider, "SELECTED_MODEL", "global-model")
+    router = ModelRouter(
+        tiers={
+            "fast": ModelTier("fast", "small", 0.05),
+            "standard": ModelTier("standard", "", 0, "fast"),
+            "strong": ModelTier("strong", "large", 0.1, "standard"),
+        },
+        routes=model_router.parse_routes("classify_*=fast,generate_long_term_reflection=strong"),
+        default_tier="standard"
+    )
+    monkeypatch.setattr(model_router, "router", router)
+    fake = FakeLLMProvider(model_latency_ms={"large": 500}, sleep=False)
+    llm_provider.set_provider(fake)
+
+    assert [a.model for a in router.plan("generate_long_term_reflection", "global-model")] == ["large", "global-model", "small"]
+    assert router.tier_for("classify_recommendation") == "fast" and router.tier_for("otro") == "standard"
+
+    llm_provider.ask_gpt("x", call_site="classify_activity")
+    llm_provider.ask_gpt("x", call_site="analyze_conversation")
+    assert [call.model for call in fake.calls] == ["small", "global-model"]
+    # "large" supera su tiempo máximo: la reflexión se resuelve con el nivel standard
+    assert llm_provider.ask_gpt("x", call_site="generate_long_term_reflection")
+    assert fake.calls[-1].model == "global-model"
+    assert "".join(llm_provider.ask_gpt_chat_stream([{"role": "user", "content": "x"}], call_site="generate_long_term_reflection"))
+    assert fake.calls[-1].model == "global-model"
+    # Un modelo explícito no se enruta
+    llm_provider.ask_gpt("x", model="large", call_site="classify_activity")
+    assert fake.calls[-1].model == "large"
+
+    metrics = router.get_metrics()
+    assert metrics["strong"]["timeouts"] == 2 and metrics["strong"]["calls"] == 0
+    assert metrics["standard"]["calls"] == 3 and metrics["fast"]["calls"] == 1
+
+
+def test_llm_calls_retry_transient_errors_and_open_the_circuit_with_fallbacks(monkeypatch):
+    """Los errores transitorios se reintentan; con el proveedor caído el circuito se abre y se responde sin llamarlo."""
+    from zendell.services import llm_provider, llm_resilience
+    from zendell.services.fake_llm import FakeLLMProvider
+    from zendell.services.llm_resilience import CircuitBreaker, ResponseCache, RetryPolicy
+
+    class FlakyProvider(FakeLLMProvider):
+        name = "flaky"
+
+        def __init__(self, errors):
+            super().__init__(sleep=False)
+            self.errors = list(errors)
+            self.attempts = 0
+
+        def complete(self, messages, model, temperature, call_site="", timeout=None):
+            self.attempts += 1
+            if self.errors:
+                raise self.errors.pop(0)
+            return super().complete(messages, model, temperature, call_site, timeout)
+
+    monkeypatch.setitem(llm_provider._active, "name", llm_provider._active["name"])
+    monkeypatch.setattr(llm_resilience, "policy", RetryPolicy(deadline_seconds=5, max_retries=2, base_seconds=0.001, max_seconds=0.01))
+    monkeypatch.setattr(llm_resilience, "cache", ResponseCache(max_entries=8))
+    monkeypatch.setattr(llm_resilience, "breakers", {"flaky": CircuitBreaker("flaky", failure_threshold=3, reset_seconds=60)})
+
+    # Dos fallos transitorios y éxito al tercer intento; un error definitivo no se reintenta
+    provider = FlakyProvider([ConnectionError("reset"), TimeoutError("lento")])
+    llm_provider.set_provider(provider)
+    assert llm_provider.ask_gpt("hola", model="m", call_site="saludo") == "Entendido. ¿Qué más hiciste en la última hora?"
+    assert provider.attempts == 3
+    provider.errors = [ValueError("petición inválida")]
+    assert llm_provider.ask_gpt("otra", model="m", call_site="saludo") is None
+    assert provider.attempts == 4
+
+    # Proveedor caído: se agotan los reintentos, se abre el circuito y no se vuelve a llamar
+    provider.errors = [ConnectionError("caído")] * 10
+    assert llm_provider.ask_gpt("hola de nuevo", model="m", call_site="saludo") is None
+    assert provider.attempts == 7
+    assert llm_resilience.breakers["flaky"].state == CircuitBreaker.OPEN
+    # Con el circuito abierto: la última respuesta a la misma petición, la neutra del call_site o None
+    assert llm_provider.ask_gpt("hola", model="m", call_site="saludo") == "Entendido. ¿Qué más hiciste en la última hora?"
+    assert llm_provider.ask_gpt("x", model="m", call_site="analyze_tone") == "neutral"
+    assert list(llm_provider.ask_gpt_chat_stream([{"role": "user", "content": "x"}], model="m", call_site="classify_recommendation")) == []
+    assert provider.attempts == 7
+    assert llm_resilience.breakers["flaky"].get_metrics()["rejected"] == 3
+
+
+def test_default_deadline_leaves_room_for_the_tier_fallback_chain(monkeypatch):
+    """Con los niveles y el plazo por defecto, un timeout del nivel strong cae a standard y después a fast."""
+    from types import SimpleNamespace
+    from zendell.services import llm_provider, llm_resilience, model_router
+    from zendell.services.fake_llm import FakeLLMProvider
+    from zendell.services.llm_resilience import ResilientCall, RetryPolicy
+    from zendell.services.model_router import ModelRouter, DEFAULT_TIERS
+
+    clock = [1000.0]
+    monkeypatch.setattr(llm_resilience, "time", SimpleNamespace(monotonic=lambda: clock[0]))
+
+    class ClockedProvider(FakeLLMProvider):
+        """Avanza el reloj simulado lo que dura cada intento (su latencia o su timeout)."""
+        name = "clocked"
+
+        def complete(self, messages, model, temperature, call_site="", timeout=None, response_format=None):
+            self.timeouts.append(timeout)
+            clock[0] += min(self.model_latency_ms[model] / 1000, timeout or float("inf"))
+            return super().complete(messages, model, temperature, call_site, timeout)
+
+    monkeypatch.setitem(llm_provider._active, "name", llm_provider._active["name"])
+    monkeypatch.setattr(llm_provider, "SELECTED_MODEL", "standard-model")
+    monkeypatch.setattr(model_router, "router", ModelRouter(tiers=DEFAULT_TIERS, routes={"generate_long_term_reflection": "strong"}))
+    monkeypatch.setattr(llm_resilience, "breakers", {})
+    monkeypatch.setattr(llm_resilience, "policy", RetryPolicy(max_retries=0))
+    strong, fast = DEFAULT_TIERS["strong"], DEFAULT_TIERS["fast"]
+    provider = ClockedProvider(model_latency_ms={strong.model: 90_000, "standard-model": 90_000, fast.model: 1_000}, sleep=False)
+    provider.timeouts = []
+    llm_provider.set_provider(provider)
+
+    assert llm_provider.ask_gpt("x", call_site="generate_long_term_reflection")
+    assert [call.model for call in provider.calls] == [fast.model]
+    assert provider.timeouts == [strong.timeout_seconds, DEFAULT_TIERS["standard"].timeout_seconds, fast.timeout_seconds]
+
+    # Con un plazo menor que la cadena, cada nivel recibe una parte proporcional y el último sigue teniendo tiempo
+    call = ResilientCall("clocked", "x", [], RetryPolicy(deadline_seconds=45))
+    assert round(call.begin(60, reserve=45), 1) == 25.7
+    clock[0] += 25.7
+    assert round(call.begin(30, reserve=15), 1) == 12.9
+    clock[0] += 12.9
+    assert round(call.begin(15), 1) == 6.4
+
+
+def test_llm_scheduler_orders_lanes_by_priority_and_users_round_robin():
+    """El carril interactivo pasa primero, los usuarios se turnan y el mantenimiento respeta la reserva de RPM."""
+    import threading
+    import time
+    from zendell.services.llm_resilience import Unavailable
+    from zendell.services.llm_scheduler import LLMScheduler, INTERACTIVE, PROACTIVE, MAINTENANCE
+
+    scheduler = LLMScheduler(max_concurrency=1, rpm_limit=0, tpm_limit=0)
+    busy = scheduler.acquire(lane=MAINTENANCE, user_id="u0")
+    admitted = []
+
+    def call(lane, user_id):
+        ticket = scheduler.acquire(lane=lane, user_id=user_id, max_wait=5)
+        admitted.append((lane, user_id))
+        scheduler.release(ticket)
+
+    threads = []
+    for lane, user_id in [(MAINTENANCE, "u1"), (PROACTIVE, "u1"), (INTERACTIVE, "u1"), (INTERACTIVE, "u1"), (INTERACTIVE, "u2")]:
+        thread = threading.Thread(target=call, args=(lane, user_id))
+        thread.start()
+        threads.append(thread)
+        while sum(lane_metrics["waiting"] for lane_metrics in scheduler.get_metrics().values()) < len(threads):
+            time.sleep(0.001)
+    scheduler.release(busy)
+    for thread in threads:
+        thread.join(5)
+    assert admitted == [(INTERACTIVE, "u1"), (INTERACTIVE, "u2"), (INTERACTIVE, "u1"), (PROACTIVE, "u1"), (MAINTENANCE, "u1")]
+
+    # El mantenimiento deja la mitad del bucket de peticiones para los carriles superiores
+    limited = LLMScheduler(max_concurrency=100, rpm_limit=10, tpm_limit=0, lane_reserve={MAINTENANCE: 0.5})
+    for _ in range(5):
+        limited.release(limited.acquire(lane=MAINTENANCE, user_id="u1", max_wait=0))
+    with pytest.raises(Unavailable):
+        limited.acquire(lane=MAINTENANCE, user_id="u1", max_wait=0.01)
+    for _ in range(5):
+        limited.release(limited.acquire(lane=INTERACTIVE, user_id="u2", max_wait=0))
+    metrics = limited.get_metrics()
+    assert metrics[MAINTENANCE]["admitted"] == 5 and metrics[MAINTENANCE]["timeouts"] == 1
+    assert metrics[INTERACTIVE]["admitted"] == 5
+
+
+def test_llm_scheduler_frees_the_place_of_a_cancelled_waiter():
+    """Una llamada cancelada mientras espera sale de la cola y no retiene hueco para las siguientes."""
+    import asyncio
+    from zendell.services.llm_scheduler import LLMScheduler, INTERACTIVE
+
+    scheduler = LLMScheduler(max_concurrency=1, rpm_limit=0, tpm_limit=0)
+    busy = scheduler.acquire(lane=INTERACTIVE, user_id="u1")
+
+    async def run():
+        waiter = asyncio.create_task(scheduler.acquire_async(lane=INTERACTIVE, user_id="u2"))
+        while scheduler.get_metrics()[INTERACTIVE]["waiting"] == 0:
+            await asyncio.sleep(0.001)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        waiting = scheduler.get_metrics()[INTERACTIVE]["waiting"]
+        scheduler.release(busy)
+        scheduler.release(await scheduler.acquire_async(lane=INTERACTIVE, user_id="u3", max_wait=0.1))
+        return waiting
+
+    assert asyncio.run(run()) == 0
+    metrics = scheduler.get_metrics()[INTERACTIVE]
+    assert (metrics["in_flight"], metrics["admitted"], metrics["timeouts"]) == (0, 2, 1)
+
+
+def test_llm_scheduler_async_waiter_sleeps_until_a_release_or_the_bucket_refill():
+    """Quien espera en el event loop no sondea: lo despierta el release de otro hilo o la recarga del bucket."""
+    import asyncio
+    import threading
+    import time
+    from zendell.services.llm_scheduler import LLMScheduler, INTERACTIVE
+
+    scheduler = LLMScheduler(max_concurrency=1, rpm_limit=0, tpm_limit=600)
+    dispatches = []
+    dispatch = scheduler._dispatch
+    scheduler._dispatch = lambda: dispatches.append(1) or dispatch()
+    busy = scheduler.acquire(tokens=10, lane=INTERACTIVE, user_id="u1")
+
+    async def run():
+        waiter = asyncio.create_task(scheduler.acquire_async(tokens=10, lane=INTERACTIVE, user_id="u2", max_wait=5))
+        await asyncio.sleep(0.2)
+        polls = len(dispatches)
+        started = time.monotonic()
+        threading.Thread(target=scheduler.release, args=(busy,)).start()
+        ticket = await asyncio.wait_for(waiter, 1)
+        released_after = time.monotonic() - started
+        scheduler.release(ticket)
+        # Con el bucket vacío la siguiente espera ~0.5 s a que recargue 5 tokens (10 por segundo)
+        scheduler.tpm.penalize(0)
+        dispatches.clear()
+        started = time.monotonic()
+        scheduler.release(await scheduler.acquire_async(tokens=5, lane=INTERACTIVE, user_id="u3", max_wait=5))
+        return polls, released_after, time.monotonic() - started, len(dispatches)
+
+    polls, released_after, refill_wait, refill_dispatches = asyncio.run(run())
+    assert polls <= 3
+    assert released_after < 0.2
+    assert 0.3 < refill_wait < 1.5
+    assert refill_dispatches <= 5
+
+
+def test_structured_output_validates_json_and_repairs_once_only_when_needed(monkeypatch):
+    """Se pide modo JSON, se valida contra el esquema del call_site y solo las respuestas inválidas generan una reparación."""
+    from zendell.agents.activity_collector import classify_activity, extract_entities_from_activity, generate_clarification_questions
+    from zendell.services import llm_provider, model_router, structured_output
+    from zendell.services.fake_llm import FakeLLMProvider
+
+    monkeypatch.setitem(llm_provider._active, "name", llm_provider._active["name"])
+    monkeypatch.setitem(llm_provider._providers, "fake", llm_provider.get_provider("fake"))
+    monkeypatch.setattr(structured_output, "_stats", {})
+    fake = FakeLLMProvider(responses={
+        "classify_activity": 'Claro, aquí tienes:\n```json\n{"category": "Ocio"}\n```',
+        "extract_entities_from_activity": '{"entities": "Juan"}',
+        "generate_clarification_questions": "No se me ocurren preguntas.",
+        "repair_json": [{"entities": [{"name": "Juan", "type": "person", "relationship": "amigo"}]}, "sigue sin ser JSON"],
+    }, sleep=False)
+    llm_provider.set_provider(fake)
+
+    # JSON entre texto y ```json```: válido a la primera, sin llamada de reparación
+    assert classify_activity("fui al cine") == "Ocio"
+    assert [call.call_site for call in fake.calls] == ["classify_activity"]
+    assert fake.calls[0].metadata["response_format"] == "json_object"
+
+    # No cumple el esquema: una única reparación, enrutada al nivel fast
+    entities = extract_entities_from_activity("cené con Juan", "Cena")
+    assert [entity["name"] for entity in entities] == ["Juan"] and entities[0]["entity_id"]
+    assert fake.calls[-1].call_site == "repair_json"
+    assert model_router.router.tier_for("repair_json") == "fast"
+    assert "Juan" in fake.calls[-1].text
+
+    # La reparación tampoco valida: valor por defecto del agente, sin más llamadas
+    assert generate_clarification_questions("cené", "Cena") == ["¿Podrías darnos más detalles sobre 'Cena'?"]
+    assert [call.call_site for call in fake.calls[-2:]] == ["generate_clarification_questions", "repair_json"]
+    calls = len(fake.calls)
+    assert structured_output.ask_json("Devuelve un JSON", call_site="generate_clarification_questions", repair=False) is None
+    assert len(fake.calls) == calls + 1
+
+    assert structured_output.validate({"activities": [{"title": 3}]}, structured_output.SCHEMAS["extract_sub_activities"]) == [
+        "$.activities[0].title: se esperaba string, no int"
+    ]
+    metrics = structured_output.get_metrics()
+    assert (metrics["valid"], metrics["repaired"], metrics["invalid"], metrics["repair_calls"]) == (1, 1, 2, 2)
+    assert metrics["by_call_site"]["extract_entities_from_activity"]["repaired"] == 1
+    assert metrics["parse_failure_rate"] == 0.75
+
+
+def test_json_call_sites_work_with_a_provider_without_response_format(monkeypatch):
+    """Un proveedor que implementa la interfaz base sin response_format no recibe el argumento y el JSON se valida igual."""
+    from zendell.agents.activity_collector import classify_activity
+    from zendell.services import llm_provider
+    from zendell.services.llm_provider import LLMProvider, LLMResponse
+
+    class PlainProvider(LLMProvider):
+        name = "plain"
+
+        def complete(self, messages, model, temperature, call_site="", timeout=None):
+            return LLMResponse(text='La categoría es {"category": "Estudio"}', model=model, provider=self.name, call_site=call_site)
+
+    monkeypatch.setitem(llm_provider._active, "name", llm_provider._active["name"])
+    llm_provider.set_provider(PlainProvider())
+
+    assert classify_activity("estudié para el examen") == "Estudio"
+    assert "".join(llm_provider.get_provider().stream([{"role": "user", "content": "JSON"}], "m", 0, response_format={"type": "json_object"}))